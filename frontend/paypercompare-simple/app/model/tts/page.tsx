@@ -112,9 +112,20 @@ export default function TTSStudio() {
                   {r.status === 'success' && r.audio_urls?.length > 0 ? (
                     <>
                       <div style={{ padding: '1.5rem', background: '#f9f9f9', display: 'flex', alignItems: 'center', justifyContent: 'center', flex: 1 }}>
-                        <audio controls style={{ width: '100%', height: '40px' }}>
-                          <source src={r.audio_urls[0]} type="audio/wav" />
-                        </audio>
+                        <audio
+                          controls
+                          src={r.audio_urls[0]}
+                          style={{ width: '100%', height: '40px' }}
+                          onEnded={(e) => {
+                            // Long text can come back as several chunk files; play them in order
+                            const player = e.currentTarget;
+                            const next = r.audio_urls.indexOf(player.getAttribute('src') || '') + 1;
+                            if (next > 0 && next < r.audio_urls.length) {
+                              player.src = r.audio_urls[next];
+                              player.play();
+                            }
+                          }}
+                        />
                       </div>
                       <div style={{ padding: '12px', display: 'flex', justifyContent: 'space-between', borderTop: '1px solid #eee' }}>
                         <strong>{r.model_name}</strong>
@@ -0,0 +1,228 @@
+import os
+import time
+import asyncio
+import sqlite3
+from pydantic import BaseModel
+from typing import Optional, List, Dict, Any, Callable
+from dotenv import load_dotenv
+from model.fanout import run_sqlite
+
+load_dotenv()
+
+# --- CONFIGURATION ---
+# "sqlite" keeps jobs across worker restarts, "memory" keeps them in-process only
+JOB_STORE_BACKEND = os.getenv("JOB_STORE", "sqlite")
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "jobs.sqlite3")
+
+TERMINAL_PREDICTION_STATUSES = {"succeeded", "failed", "canceled"}
+
+class PredictionState(BaseModel):
+    model_name: str
+    prediction_id: Optional[str] = None
+    status: str = "starting"  # Replicate status: starting, processing, succeeded, failed, canceled
+    output: Any = None
+    error: Optional[str] = None
+    previews: Dict[str, List[str]] = {}  # poster_urls / preview_urls once the output is processed
+    # Registry entry the prediction was started with, so a hot reload cannot change or remove it mid-job
+    model_entry: Dict[str, Any] = {}
+
+class Job(BaseModel):
+    job_id: str
+    kind: str  # e.g. "video"
+    status: str  # "running" or "completed"
+    created_at: float
+    updated_at: float
+    request: Dict[str, Any]
+    predictions: Dict[str, PredictionState]
+    result: Optional[Dict[str, Any]] = None
+    webhook_token: str
+    payment: Optional[Dict[str, Any]] = None  # Payment that funded the job; failed models are credited to its payer
+
+    def pending_predictions(self) -> List[PredictionState]:
+        return [p for p in self.predictions.values() if p.status not in TERMINAL_PREDICTION_STATUSES]
+
+class JobStore:
+    """
+    Interface for job persistence.
+    `update` must apply `mutate` as one atomic read-modify-write so webhooks and
+    pollers (possibly on different workers) never overwrite each other.
+    `claim` hands out a per-job lease, so only one worker polls a job at a time.
+    """
+    async def create(self, job: Job) -> None:
+        raise NotImplementedError
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        raise NotImplementedError
+
+    async def update(self, job_id: str, mutate: Callable[[Job], None]) -> Optional[Job]:
+        raise NotImplementedError
+
+    async def list_running(self) -> List[Job]:
+        raise NotImplementedError
+
+    async def claim(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        """
+        Take or renew the lease on a running job for `owner`. Returns False
+        while another owner's lease is unexpired, or once the job is done.
+        """
+        raise NotImplementedError
+
+class InMemoryJobStore(JobStore):
+    def __init__(self):
+        self._jobs: Dict[str, Job] = {}
+        self._leases: Dict[str, tuple] = {}  # job_id -> (owner, expires_at)
+        self._lock = asyncio.Lock()
+
+    async def create(self, job: Job) -> None:
+        async with self._lock:
+            self._jobs[job.job_id] = job.model_copy(deep=True)
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        return job.model_copy(deep=True) if job else None
+
+    async def update(self, job_id: str, mutate: Callable[[Job], None]) -> Optional[Job]:
+        async with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job = job.model_copy(deep=True)
+            mutate(job)
+            job.updated_at = time.time()
+            self._jobs[job_id] = job
+            return job.model_copy(deep=True)
+
+    async def list_running(self) -> List[Job]:
+        return [j.model_copy(deep=True) for j in self._jobs.values() if j.status == "running"]
+
+    async def claim(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        job = self._jobs.get(job_id)
+        if job is None or job.status != "running":
+            return False
+        now = time.time()
+        holder, expires_at = self._leases.get(job_id, (None, 0.0))
+        if holder not in (None, owner) and expires_at > now:
+            return False
+        self._leases[job_id] = (owner, now + lease_seconds)
+        return True
+
+class SQLiteJobStore(JobStore):
+    """
+    Stores each job as a JSON document in a SQLite file (WAL mode), so several
+    workers can share it and jobs survive a restart.
+    """
+    def __init__(self, path: str):
+        self._path = path
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " job_id TEXT PRIMARY KEY,"
+                " status TEXT NOT NULL,"
+                " data TEXT NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " claimed_by TEXT,"
+                " claimed_until REAL NOT NULL DEFAULT 0)"
+            )
+            # Job files created before leases existed
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "claimed_by" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN claimed_by TEXT")
+                conn.execute("ALTER TABLE jobs ADD COLUMN claimed_until REAL NOT NULL DEFAULT 0")
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Autocommit mode; multi-statement writes use explicit BEGIN IMMEDIATE
+        return sqlite3.connect(self._path, timeout=30, isolation_level=None)
+
+    def _create(self, job: Job) -> None:
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT INTO jobs (job_id, status, data, updated_at) VALUES (?, ?, ?, ?)",
+                (job.job_id, job.status, job.model_dump_json(), job.updated_at)
+            )
+        finally:
+            conn.close()
+
+    def _get(self, job_id: str) -> Optional[Job]:
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return Job.model_validate_json(row[0]) if row else None
+
+    def _update(self, job_id: str, mutate: Callable[[Job], None]) -> Optional[Job]:
+        conn = self._connect()
+        try:
+            # Take the write lock before reading so concurrent updates serialize
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                conn.execute("ROLLBACK")
+                return None
+            job = Job.model_validate_json(row[0])
+            mutate(job)
+            job.updated_at = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = ?, data = ?, updated_at = ? WHERE job_id = ?",
+                (job.status, job.model_dump_json(), job.updated_at, job_id)
+            )
+            conn.execute("COMMIT")
+            return job
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _list_running(self) -> List[Job]:
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT data FROM jobs WHERE status = 'running'").fetchall()
+        finally:
+            conn.close()
+        return [Job.model_validate_json(row[0]) for row in rows]
+
+    def _claim(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        conn = self._connect()
+        try:
+            now = time.time()
+            # One conditional UPDATE: of any number of workers, only one can hold the lease
+            claimed = conn.execute(
+                "UPDATE jobs SET claimed_by = ?, claimed_until = ?"
+                " WHERE job_id = ? AND status = 'running'"
+                " AND (claimed_by IS NULL OR claimed_by = ? OR claimed_until <= ?)",
+                (owner, now + lease_seconds, job_id, owner, now)
+            ).rowcount
+            return claimed == 1
+        finally:
+            conn.close()
+
+    async def create(self, job: Job) -> None:
+        await run_sqlite(self._create, job)
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        return await run_sqlite(self._get, job_id)
+
+    async def update(self, job_id: str, mutate: Callable[[Job], None]) -> Optional[Job]:
+        return await run_sqlite(self._update, job_id, mutate)
+
+    async def list_running(self) -> List[Job]:
+        return await run_sqlite(self._list_running)
+
+    async def claim(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        return await run_sqlite(self._claim, job_id, owner, lease_seconds)
+
+def create_job_store() -> JobStore:
+    if JOB_STORE_BACKEND == "memory":
+        return InMemoryJobStore()
+    if JOB_STORE_BACKEND == "sqlite":
+        return SQLiteJobStore(JOB_STORE_PATH)
+    raise ValueError(f"Unknown JOB_STORE backend '{JOB_STORE_BACKEND}'. Use 'sqlite' or 'memory'.")
+
+job_store = create_job_store()
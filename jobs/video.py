@@ -0,0 +1,400 @@
+import os
+import time
+import uuid
+import socket
+import asyncio
+import secrets
+import replicate
+from urllib.parse import quote
+from pydantic import BaseModel
+from typing import Optional, List, Dict, Any, Set
+from dotenv import load_dotenv
+from jobs.store import Job, PredictionState, TERMINAL_PREDICTION_STATUSES, job_store
+from model.img2vid import (
+    VideoGenerationRequest,
+    VideoGenerationResponse,
+    VideoResult,
+    VIDEO_MODEL_REGISTRY,
+    create_video_prediction,
+    build_video_input,
+    video_error_result,
+    summarize_video_results
+)
+from model.engine import output_urls, model_ref
+from model.cache import result_cache, result_cache_key, is_cacheable
+from model.storage import output_storage, mirror_urls
+from model.previews import video_previews
+from x402.payment import Payment
+from x402.credits import credit_failed_models
+
+load_dotenv()
+
+# --- CONFIGURATION ---
+# Public URL of this server; when unset, jobs complete by polling only
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "").rstrip("/")
+VIDEO_JOB_POLL_SECONDS = float(os.getenv("VIDEO_JOB_POLL_SECONDS", "10"))
+VIDEO_JOB_TIMEOUT_SECONDS = float(os.getenv("VIDEO_JOB_TIMEOUT_SECONDS", "1800"))
+# How long a worker's claim on polling a job lasts without renewal; renewed on
+# every poll, so keep it well above VIDEO_JOB_POLL_SECONDS
+VIDEO_JOB_LEASE_SECONDS = float(os.getenv("VIDEO_JOB_LEASE_SECONDS", "60"))
+
+# Lease owner name of this worker process
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# Keep references to poller tasks so they are not garbage collected mid-run
+_poll_tasks = set()
+# Jobs this worker is polling
+_polled_jobs: Set[str] = set()
+
+class JobSubmittedResponse(BaseModel):
+    job_id: str
+    status: str
+    status_url: str
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    status: str  # "running" or "completed"
+    created_at: float
+    updated_at: float
+    models: Dict[str, str]  # model name -> Replicate prediction status
+    result: Optional[VideoGenerationResponse] = None
+
+def job_status_response(job: Job) -> JobStatusResponse:
+    return JobStatusResponse(
+        job_id=job.job_id,
+        status=job.status,
+        created_at=job.created_at,
+        updated_at=job.updated_at,
+        models={name: p.status for name, p in job.predictions.items()},
+        result=VideoGenerationResponse.model_validate(job.result) if job.result else None
+    )
+
+def _model_config(state: PredictionState) -> Optional[dict]:
+    # The entry the prediction started with (jobs stored before it was recorded
+    # fall back to the current registry, where the model may be gone)
+    return state.model_entry or VIDEO_MODEL_REGISTRY.get(state.model_name)
+
+def _cache_key(model_config: Optional[dict], request: VideoGenerationRequest) -> Optional[str]:
+    if result_cache is None or model_config is None:
+        return None
+    input_data = build_video_input(model_config, request)
+    if not is_cacheable(model_config, input_data):
+        return None
+    return result_cache_key(model_ref(model_config), input_data)
+
+def _cached_output(model_config: dict, urls: List[str]) -> Any:
+    # Shape cached URLs like the raw prediction output so output_urls reads both
+    if model_config.get("output_type", "single") == "single":
+        return urls[0]
+    return urls
+
+def _matches(state: PredictionState, prediction_id: str, model_name: Optional[str]) -> bool:
+    # A webhook names its model, so it finds its prediction even before the id is attached
+    if state.prediction_id is None:
+        return model_name is not None and state.model_name == model_name
+    return state.prediction_id == prediction_id
+
+def _finish_if_done(job: Job) -> bool:
+    """
+    Build the final VideoGenerationResponse once every prediction is terminal.
+    Returns True only for the update that completes the job.
+    """
+    if job.status != "running" or job.pending_predictions():
+        return False
+
+    results = []
+    for model_name in job.request["models"]:
+        state = job.predictions[model_name]
+        model_config = _model_config(state) or {}
+        if state.status == "succeeded":
+            try:
+                video_urls = output_urls(model_config, state.output)
+                results.append(VideoResult(
+                    model_name=model_name,
+                    video_urls=video_urls,
+                    **state.previews,
+                    cost_usd=model_config.get("cost_usd", 0.0),
+                    status="success"
+                ))
+                continue
+            except Exception as e:
+                state.error = f"Unreadable model output: {e}"
+        results.append(video_error_result(
+            model_name, state.error or f"Prediction {state.status}", model_config.get("cost_usd")
+        ))
+
+    job.result = summarize_video_results(results).model_dump()
+    job.status = "completed"
+    return True
+
+async def _credit_failures(job: Job) -> None:
+    """
+    Credit the price of the job's failed models back to whoever paid for it.
+    """
+    if job.payment is None or not job.result:
+        return
+    credited_usd = job.result.get("total_credited_usd", 0.0)
+    if credited_usd > 0:
+        await credit_failed_models(Payment.model_validate(job.payment), credited_usd, f"job:{job.job_id}")
+
+async def _process_output(job_id: str, prediction_id: str, output: Any, model_name: Optional[str] = None) -> Optional[tuple]:
+    """
+    Mirror a finished prediction's videos and build their previews.
+    Returns (output with stable URLs, previews), or None when the prediction
+    was already recorded as finished (a duplicate webhook or a late poll).
+    """
+    job = await job_store.get(job_id)
+    for state in (job.predictions.values() if job else []):
+        if _matches(state, prediction_id, model_name):
+            if state.status in TERMINAL_PREDICTION_STATUSES:
+                return None
+            try:
+                model_config = _model_config(state) or {}
+                urls = await mirror_urls(output_urls(model_config, output))
+                # Store the stable URLs in place of the raw output so every reader of the job sees them
+                return _cached_output(model_config, urls), await video_previews(urls)
+            except Exception:
+                break
+    return output, {}
+
+async def apply_prediction_update(
+    job_id: str,
+    prediction_id: str,
+    status: str,
+    output: Any = None,
+    error: Optional[str] = None,
+    model_name: Optional[str] = None
+) -> Optional[Job]:
+    """
+    Record a prediction's latest state (from a webhook or a poll) on its job.
+    `model_name` (sent by webhooks) matches a prediction whose id is not attached yet.
+    """
+    previews = {}
+    if status == "succeeded" and output is not None and output_storage is not None:
+        processed = await _process_output(job_id, prediction_id, output, model_name)
+        if processed is None:
+            # Already mirrored and recorded; nothing to copy again
+            return await job_store.get(job_id)
+        output, previews = processed
+
+    completed = []
+
+    def mutate(job: Job) -> None:
+        for state in job.predictions.values():
+            if not _matches(state, prediction_id, model_name):
+                continue
+            # Ignore late or duplicate updates for a prediction that already finished
+            if state.status in TERMINAL_PREDICTION_STATUSES:
+                return
+            state.prediction_id = prediction_id
+            state.status = status
+            state.output = output
+            state.error = str(error) if error else None
+            state.previews = previews
+        if _finish_if_done(job):
+            completed.append(job_id)
+
+    job = await job_store.update(job_id, mutate)
+    if completed:
+        await _credit_failures(job)
+
+    # Remember successful outputs so identical requests skip Replicate entirely
+    if job is not None and status == "succeeded" and result_cache is not None:
+        for state in job.predictions.values():
+            if state.prediction_id != prediction_id:
+                continue
+            try:
+                model_config = _model_config(state)
+                key = _cache_key(model_config, VideoGenerationRequest.model_validate(job.request))
+                if key:
+                    await result_cache.set(key, output_urls(model_config, output))
+            except Exception:
+                pass
+
+    return job
+
+async def poll_video_job(job_id: str) -> None:
+    """
+    Polling fallback: refresh unfinished predictions until the job completes,
+    whether or not webhooks arrive.
+    """
+    job = await job_store.get(job_id)
+    if job is None:
+        return
+    deadline = job.created_at + VIDEO_JOB_TIMEOUT_SECONDS
+
+    while True:
+        await asyncio.sleep(VIDEO_JOB_POLL_SECONDS)
+        # Renew the lease; stop if the job finished or another worker took it over
+        if not await job_store.claim(job_id, WORKER_ID, VIDEO_JOB_LEASE_SECONDS):
+            return
+        job = await job_store.get(job_id)
+        if job is None or job.status != "running":
+            return
+
+        for state in job.pending_predictions():
+            try:
+                prediction = await replicate.predictions.async_get(state.prediction_id)
+            except Exception:
+                # Transient API error; try again on the next tick
+                continue
+            if prediction.status != state.status:
+                await apply_prediction_update(
+                    job_id, state.prediction_id, prediction.status, prediction.output, prediction.error
+                )
+
+        if time.time() > deadline:
+            completed = []
+
+            def expire(job: Job) -> None:
+                for state in job.pending_predictions():
+                    state.status = "failed"
+                    state.error = f"Prediction did not finish within {VIDEO_JOB_TIMEOUT_SECONDS:g} seconds"
+                if _finish_if_done(job):
+                    completed.append(job_id)
+
+            job = await job_store.update(job_id, expire)
+            if completed:
+                await _credit_failures(job)
+            return
+
+def start_poller(job_id: str) -> None:
+    """
+    Poll a job on this worker; call only while holding its lease.
+    """
+    task = asyncio.create_task(poll_video_job(job_id))
+    _poll_tasks.add(task)
+    _polled_jobs.add(job_id)
+    task.add_done_callback(_poll_tasks.discard)
+    task.add_done_callback(lambda _: _polled_jobs.discard(job_id))
+
+async def submit_video_job(request: VideoGenerationRequest, payment: Optional[Payment] = None) -> JobSubmittedResponse:
+    """
+    Create a job, start one async Replicate prediction per model and return right away.
+    Models that fail are credited back to `payment`'s payer when the job completes.
+    """
+    now = time.time()
+    job = Job(
+        job_id=uuid.uuid4().hex,
+        kind="video",
+        status="running",
+        created_at=now,
+        updated_at=now,
+        request=request.model_dump(),
+        predictions={
+            m: PredictionState(model_name=m, model_entry=VIDEO_MODEL_REGISTRY[m])
+            for m in request.models
+        },
+        webhook_token=secrets.token_urlsafe(24),
+        payment=payment.model_dump() if payment else None
+    )
+
+    def webhook(model_name: str) -> Optional[str]:
+        if not PUBLIC_BASE_URL:
+            return None
+        return (
+            f"{PUBLIC_BASE_URL}/webhooks/replicate/{job.job_id}"
+            f"?token={job.webhook_token}&model={quote(model_name, safe='')}"
+        )
+
+    # Identical earlier requests are answered from the result cache without a prediction
+    to_start = []
+    for model_name in request.models:
+        state = job.predictions[model_name]
+        key = _cache_key(state.model_entry, request)
+        urls = await result_cache.get(key) if key else None
+        if urls is None:
+            to_start.append(model_name)
+            continue
+        state.status = "succeeded"
+        state.output = _cached_output(state.model_entry, urls)
+        state.previews = await video_previews(urls)
+
+    # The job exists before any prediction does, so no webhook can arrive for an unknown job
+    await job_store.create(job)
+
+    # Start every remaining prediction at once; a model that cannot start fails on its own
+    started = await asyncio.gather(
+        *(create_video_prediction(m, request, webhook(m)) for m in to_start),
+        return_exceptions=True
+    )
+    completed = []
+
+    def attach(job: Job) -> None:
+        for model_name, prediction in zip(to_start, started):
+            state = job.predictions[model_name]
+            if isinstance(prediction, Exception):
+                state.status = "failed"
+                state.error = str(prediction)
+                continue
+            state.prediction_id = prediction.id
+            # A webhook may already have moved the prediction on
+            if state.status == "starting":
+                state.status = prediction.status
+        if _finish_if_done(job):
+            completed.append(job.job_id)
+
+    job = await job_store.update(job.job_id, attach)
+    if completed:
+        await _credit_failures(job)
+    elif await job_store.claim(job.job_id, WORKER_ID, VIDEO_JOB_LEASE_SECONDS):
+        start_poller(job.job_id)
+
+    return JobSubmittedResponse(
+        job_id=job.job_id,
+        status=job.status,
+        status_url=f"/jobs/{job.job_id}"
+    )
+
+async def handle_replicate_webhook(
+    job_id: str,
+    token: str,
+    payload: Dict[str, Any],
+    model_name: Optional[str] = None
+) -> bool:
+    """
+    Apply a Replicate webhook payload to its job. Returns False if the job or token is unknown.
+    """
+    job = await job_store.get(job_id)
+    if job is None or not secrets.compare_digest(job.webhook_token, token):
+        return False
+
+    if payload.get("id") and payload.get("status"):
+        await apply_prediction_update(
+            job_id, payload["id"], payload["status"], payload.get("output"), payload.get("error"), model_name
+        )
+    return True
+
+async def adopt_video_jobs() -> int:
+    """
+    Start polling every running video job whose lease is free or expired, i.e.
+    jobs whose worker stopped. Returns how many this worker took on.
+    """
+    adopted = 0
+    for job in await job_store.list_running():
+        if job.kind != "video" or job.job_id in _polled_jobs:
+            continue
+        if await job_store.claim(job.job_id, WORKER_ID, VIDEO_JOB_LEASE_SECONDS):
+            start_poller(job.job_id)
+            adopted += 1
+    return adopted
+
+async def _adopt_periodically() -> None:
+    while True:
+        await asyncio.sleep(VIDEO_JOB_LEASE_SECONDS)
+        try:
+            await adopt_video_jobs()
+        except Exception:
+            # Job store hiccup; try again on the next round
+            pass
+
+async def resume_video_jobs() -> None:
+    """
+    Restart polling for jobs that were still running when the worker stopped,
+    then keep adopting jobs left behind by other workers. Each job is polled by
+    the one worker holding its lease.
+    """
+    await adopt_video_jobs()
+    task = asyncio.create_task(_adopt_periodically())
+    _poll_tasks.add(task)
+    task.add_done_callback(_poll_tasks.discard)
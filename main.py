@@ -1,32 +1,82 @@
-from fastapi import FastAPI, Response, Header, HTTPException
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+from fastapi import FastAPI, Request, Response, Header, HTTPException, Depends
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 
 # Import logic from divided files
 from x402.payment import (
-    verify_usdc_payment, 
+    Payment,
+    payment_indexer,
     USDC_CONTRACT_ADDRESS, 
     RECEIVING_WALLET_ADDRESS
 )
+from x402.rpc import rpc_pool
+from x402.ledger import ledger
+from x402.credits import (
+    PaymentHeaders,
+    CreditAuth,
+    credit_auth,
+    payment_headers,
+    collect_payment,
+    credit_failed_models,
+    FailedModelCredits,
+    deposit_credits,
+    authenticate_credit_wallet,
+    CREDIT_AUTH_MESSAGE_FORMAT
+)
+from x402.pricing import (
+    Quote,
+    QuoteRequest,
+    issue_quote,
+    accepted_quote,
+    quoted_units,
+    image_price_units,
+    video_price_units,
+    tts_price_units
+)
 from model.txt2img import (
     ImageGenerationRequest, 
     ImageGenerationResponse, 
     run_replicate_inference,
+    stream_replicate_inference,
+    summarize_results,
+    route_request,
     MODEL_REGISTRY
 )
 from model.img2vid import (
     VideoGenerationRequest,
-    VideoGenerationResponse,
-    run_video_inference,
+    stream_video_inference,
+    summarize_video_results,
     VIDEO_MODEL_REGISTRY
 )
 from model.tts import (
     TTSRequest,
     TTSResponse,
     run_tts_inference,
-    TTS_MODEL_REGISTRY,
-    calculate_tts_cost
+    stream_tts_inference,
+    stream_tts_audio,
+    summarize_tts_results,
+    TTS_MODEL_REGISTRY
 )
+from model.cache import result_cache_stats
+from model.scheduler import scheduler_stats
+from model.routing import routing_stats
+from model.registry import model_registry
+from model.catalog import listing_response
+from model.storage import media_response, close_output_mirror, set_request_origin, start_media_sweeper, stop_media_sweeper
+from model.previews import close_preview_pool
+from model.metrics import HTTP_REQUEST_SECONDS, begin_request, metrics_payload
+from jobs.video import (
+    JobSubmittedResponse,
+    JobStatusResponse,
+    submit_video_job,
+    handle_replicate_webhook,
+    job_status_response,
+    resume_video_jobs
+)
+from jobs.store import job_store
 
 load_dotenv()
 
@@ -38,9 +88,86 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["X-Cost", "X-Run-Time"],
+    expose_headers=["X-Cost", "X-Run-Time", "Server-Timing"],
 )
 
+@app.middleware("http")
+async def timing_headers(request: Request, call_next):
+    """
+    X-Run-Time (seconds), X-Cost (USDC charged) and Server-Timing (per-stage ms)
+    on every response. Streamed responses are timed up to their headers.
+    """
+    timings = begin_request()
+    # Completes relative /media URLs when PUBLIC_BASE_URL is not set
+    set_request_origin(str(request.base_url))
+    response = await call_next(request)
+    route = request.scope.get("route")
+    HTTP_REQUEST_SECONDS.labels(
+        route=getattr(route, "path", "unmatched"), method=request.method, status=response.status_code
+    ).observe(timings.elapsed())
+    response.headers["X-Run-Time"] = f"{timings.elapsed():.3f}"
+    if timings.cost_units is not None:
+        response.headers["X-Cost"] = f"{timings.cost_units / 10**6:.6f}"
+    response.headers["Server-Timing"] = timings.server_timing()
+    return response
+
+@app.on_event("startup")
+async def resume_jobs():
+    # Pick up polling for video jobs that were running before a restart
+    await resume_video_jobs()
+
+@app.on_event("startup")
+async def start_payment_indexer():
+    # Tail USDC transfers to us so most payments verify without an RPC call
+    payment_indexer.start()
+
+@app.on_event("startup")
+async def start_registry_reload():
+    # Pick up edits to the model registry file without a restart
+    model_registry.start()
+
+@app.on_event("startup")
+async def start_media_cleanup():
+    # Keep the local media directory within its age and size limits
+    start_media_sweeper()
+
+@app.on_event("shutdown")
+async def close_connections():
+    await model_registry.stop()
+    await stop_media_sweeper()
+    await payment_indexer.stop()
+    await rpc_pool.close()
+    await close_output_mirror()
+    close_preview_pool()
+
+def sse_response(
+    results: AsyncIterator[BaseModel],
+    summarize,
+    on_result: Optional[Callable[[BaseModel], Awaitable]] = None
+) -> StreamingResponse:
+    """
+    Stream each per-model result as a `result` event the moment it completes,
+    followed by one `summary` event carrying the request totals.
+    `on_result` runs on each result before its event is sent, so its effect
+    is kept even if the client disconnects before the stream ends.
+    """
+    async def event_stream():
+        completed: List[BaseModel] = []
+        async for result in results:
+            completed.append(result)
+            if on_result is not None:
+                await on_result(result)
+            yield f"event: result\ndata: {result.model_dump_json()}\n\n"
+        
+        summary = summarize(completed)
+        yield f"event: summary\ndata: {summary.model_dump_json(exclude={'results'})}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/", tags=["Info"])
 async def root():
     return {
@@ -58,51 +185,141 @@ async def root():
             "list_image_models": "GET /models",
             "list_video_models": "GET /video-models",
             "list_tts_models": "GET /tts-models",
+            "model_catalog": "GET /catalog",
             "generate_image": "POST /generate",
             "generate_video": "POST /generate-video",
-            "generate_tts": "POST /generate-tts"
+            "video_job_status": "GET /jobs/{job_id}",
+            "deposit_credits": "POST /credits/deposit",
+            "credit_balance": "GET /balance",
+            "quote_price": "POST /quote",
+            "mirrored_output": "GET /media/{key}",
+            "generate_tts": "POST /generate-tts",
+            "stream_image": "POST /generate/events",
+            "stream_video": "POST /generate-video/events",
+            "stream_tts": "POST /generate-tts/events",
+            "stream_tts_audio": "POST /generate-tts/stream",
+            "metrics": "GET /metrics",
+            "routing_stats": "GET /routing/stats",
+            "registry_status": "GET /registry/status"
         }
     }
 
-@app.get("/models", tags=["Image Models"])
-async def list_models():
-    """List all available image models with their costs"""
-    
-    models_info = {}
-    for model_name, config in MODEL_REGISTRY.items():
-        models_info[model_name] = {
-            "cost_usd": config["cost_usd"],
-            "identifier": config.get("version") or config.get("identifier")
-        }
+@app.get("/cache/stats", tags=["Info"])
+async def cache_stats():
+    """Result cache hit/miss counters and size"""
+    return await result_cache_stats()
+
+@app.get("/scheduler/stats", tags=["Info"])
+async def get_scheduler_stats():
+    """Per-model concurrency window, queue length, latency and 429 counters"""
+    return scheduler_stats()
+
+@app.get("/metrics", tags=["Info"])
+async def metrics():
+    """Prometheus metrics: request, payment, RPC, Replicate queue/run and post-processing latency"""
+    body, content_type = metrics_payload()
+    return Response(body, media_type=content_type)
+
+@app.get("/routing/stats", tags=["Info"])
+async def get_routing_stats():
+    """Rolling p90 latency and failure rate per image model, and hedge counters"""
+    return routing_stats()
+
+@app.get("/registry/status", tags=["Info"])
+async def registry_status():
+    """Model registry file, loaded version, reload count and last reload error"""
+    return model_registry.stats()
+
+@app.get("/rpc/health", tags=["Info"])
+async def rpc_health():
+    """Latency and failure scores of each configured RPC endpoint, best first"""
+    return {"endpoints": rpc_pool.health(), "payment_indexer": payment_indexer.stats()}
+
+@app.get("/media/{key}", tags=["Info"])
+async def get_media(
+    key: str,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match")
+):
+    """Model output mirrored to local storage (OUTPUT_MIRROR=local); supports byte ranges"""
+    return media_response(key, range_header, if_none_match)
+
+@app.post("/credits/deposit", tags=["Credits"])
+async def deposit(
+    x_payment_tx: str = Header(..., alias="X-Payment-Tx"),
+    x_payment_wait: Optional[float] = Header(None, alias="X-Payment-Wait")
+):
+    """
+    Turn one on-chain USDC transfer into prepaid credits for the sending wallet.
+    Later requests spend them with the X-Credit-* headers instead of X-Payment-Tx.
+    """
+    balances = await deposit_credits(x_payment_tx, x_payment_wait)
     
     return {
-        "available_models": models_info,
-        "total_models": len(models_info)
+        "credited": {address: {"balance_units": units, "balance_usd": units / 10**6} for address, units in balances.items()},
+        "sign_message_format": CREDIT_AUTH_MESSAGE_FORMAT
     }
 
-@app.get("/video-models", tags=["Video Models"])
-async def list_video_models():
-    """List all available video models with their costs"""
-    
-    models_info = {}
-    for model_name, config in VIDEO_MODEL_REGISTRY.items():
-        models_info[model_name] = {
-            "cost_usd": config["cost_usd"],
-            "identifier": config.get("version") or config.get("identifier"),
-            "type": config["type"]
-        }
+@app.get("/balance", tags=["Credits"])
+async def get_balance(credit: CreditAuth = Depends(credit_auth)):
+    """Prepaid credit balance and recent ledger entries of the signing wallet"""
+    address = await authenticate_credit_wallet(credit)
+    units = await ledger.balance(address)
     
     return {
-        "available_models": models_info,
-        "total_models": len(models_info)
+        "address": address,
+        "balance_units": units,
+        "balance_usd": units / 10**6,
+        "recent_entries": await ledger.history(address)
     }
 
-@app.post("/generate", response_model=ImageGenerationResponse, tags=["Image Models"])
-async def generate_image(
-    request: ImageGenerationRequest, 
-    response: Response,
-    x_payment_tx: str = Header(..., alias="X-Payment-Tx")
-):
+@app.post("/quote", response_model=Quote, tags=["Credits"])
+async def quote(body: QuoteRequest):
+    """
+    Price a generation request ahead of payment. Send the returned quote_id as
+    X-Payment-Quote with the same request body to pay exactly the quoted amount.
+    """
+    request_model, price = {
+        "image": (ImageGenerationRequest, price_image_request),
+        "video": (VideoGenerationRequest, price_video_request),
+        "tts": (TTSRequest, price_tts_request)
+    }[body.modality]
+    try:
+        request = request_model.model_validate(body.request)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+    if body.modality == "image" and request.route is not None:
+        # The quote is bound to the request as sent and carries the models routing
+        # picks now; paying with it runs exactly those (see `charge_image_request`)
+        routed = route_image_request(request)
+        return issue_quote("image", request, price(routed), RECEIVING_WALLET_ADDRESS, routed.models)
+    breakdown = price(request)
+    
+    return issue_quote(body.modality, request, breakdown, RECEIVING_WALLET_ADDRESS)
+
+@app.get("/catalog", tags=["Info"])
+async def get_catalog(if_none_match: Optional[str] = Header(None, alias="If-None-Match")):
+    """Image, video and TTS model listings in one response"""
+    return listing_response("catalog", if_none_match)
+
+@app.get("/models", tags=["Image Models"])
+async def list_models(if_none_match: Optional[str] = Header(None, alias="If-None-Match")):
+    """List all available image models with their costs"""
+    return listing_response("image", if_none_match)
+
+@app.get("/video-models", tags=["Video Models"])
+async def list_video_models(if_none_match: Optional[str] = Header(None, alias="If-None-Match")):
+    """List all available video models with their costs"""
+    return listing_response("video", if_none_match)
+
+def route_image_request(request: ImageGenerationRequest) -> ImageGenerationRequest:
+    # Turn `route` (budget, latency target, best N) into concrete models
+    try:
+        return route_request(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def price_image_request(request: ImageGenerationRequest) -> Dict[str, int]:
     # Validate all selected models exist
     invalid_models = [m for m in request.models if m not in MODEL_REGISTRY]
     if invalid_models:
@@ -111,23 +328,61 @@ async def generate_image(
             detail=f"Invalid models: {invalid_models}. Use GET /models to see available models."
         )
     
-    # Calculate total cost for all selected models
-    total_cost = sum(MODEL_REGISTRY[model]["cost_usd"] for model in request.models)
+    # Per-model cost in USDC units from the precomputed price table
+    return image_price_units(request.models)
+
+async def charge_image_request(request: ImageGenerationRequest, payment: PaymentHeaders) -> tuple:
+    """
+    Resolve the models to run and charge for them. Returns (request with concrete
+    models, payment). A quote for a routed request fixes the models it priced, so
+    they are not routed again on live statistics that may have moved since.
+    """
+    terms = accepted_quote(payment.quote, "image", request)
+    if terms is not None and terms.models is not None:
+        request = request.model_copy(update={"models": terms.models})
+    else:
+        request = route_image_request(request)
+    breakdown = price_image_request(request)
+    
+    # A signed quote already fixes the amount; otherwise sum the precomputed prices
+    total_units = terms.amount_units if terms is not None else sum(breakdown.values())
     
-    # Verify payment with total cost
-    await verify_usdc_payment(total_cost, x_payment_tx)
+    # Charge prepaid credits or verify the on-chain payment for the total cost
+    return request, await collect_payment(total_units, payment)
+
+@app.post("/generate", response_model=ImageGenerationResponse, tags=["Image Models"])
+async def generate_image(
+    request: ImageGenerationRequest, 
+    response: Response,
+    payment: PaymentHeaders = Depends(payment_headers)
+):
+    request, charge = await charge_image_request(request, payment)
     
     # Run all models and get results
-    generation_response = run_replicate_inference(request)
+    generation_response = await run_replicate_inference(request)
+    
+    # Failed models are credited back and applied to the payer's next request
+    await credit_failed_models(charge, generation_response.total_credited_usd)
     
     return generation_response
 
-@app.post("/generate-video", response_model=VideoGenerationResponse, tags=["Video Models"])
-async def generate_video(
-    request: VideoGenerationRequest,
-    response: Response,
-    x_payment_tx: str = Header(..., alias="X-Payment-Tx")
+@app.post("/generate/events", tags=["Image Models"])
+async def generate_image_events(
+    request: ImageGenerationRequest,
+    payment: PaymentHeaders = Depends(payment_headers)
 ):
+    """Same as POST /generate, but streams each ModelResult as Server-Sent Events"""
+    request, charge = await charge_image_request(request, payment)
+    
+    # Each failed model is credited back as soon as its result arrives
+    credits = FailedModelCredits(charge)
+    return sse_response(
+        stream_replicate_inference(request),
+        summarize_results,
+        lambda result: credits.add(result.credited_usd)
+    )
+
+def price_video_request(request: VideoGenerationRequest) -> Dict[str, int]:
     # Validate all selected models exist
     invalid_models = [m for m in request.models if m not in VIDEO_MODEL_REGISTRY]
     if invalid_models:
@@ -136,41 +391,70 @@ async def generate_video(
             detail=f"Invalid video models: {invalid_models}. Use GET /video-models to see available models."
         )
     
-    # Calculate total cost for all selected models
-    total_cost = sum(VIDEO_MODEL_REGISTRY[model]["cost_usd"] for model in request.models)
+    # Per-model cost in USDC units from the precomputed price table
+    return video_price_units(request.models)
+
+async def charge_video_request(request: VideoGenerationRequest, payment: PaymentHeaders) -> Payment:
+    breakdown = price_video_request(request)
     
-    # Verify payment with total cost
-    await verify_usdc_payment(total_cost, x_payment_tx)
+    # A signed quote already fixes the amount; otherwise sum the precomputed prices
+    total_units = quoted_units(payment.quote, "video", request)
+    if total_units is None:
+        total_units = sum(breakdown.values())
     
-    # Run all models and get results
-    generation_response = run_video_inference(request)
+    # Charge prepaid credits or verify the on-chain payment for the total cost
+    return await collect_payment(total_units, payment)
+
+@app.post("/generate-video", response_model=JobSubmittedResponse, status_code=202, tags=["Video Models"])
+async def generate_video(
+    request: VideoGenerationRequest,
+    response: Response,
+    payment: PaymentHeaders = Depends(payment_headers)
+):
+    """Start video generation as a job; poll GET /jobs/{job_id} for the results"""
+    charge = await charge_video_request(request, payment)
     
-    return generation_response
+    # Predictions run on Replicate; the connection is released right away
+    return await submit_video_job(request, charge)
 
-@app.get("/tts-models", tags=["TTS Models"])
-async def list_tts_models():
-    """List all available TTS models with their costs"""
+@app.get("/jobs/{job_id}", response_model=JobStatusResponse, tags=["Video Models"])
+async def get_job(job_id: str):
+    job = await job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
     
-    models_info = {}
-    for model_name, config in TTS_MODEL_REGISTRY.items():
-        models_info[model_name] = {
-            "cost_per_1000_tokens": config["cost_per_1000_tokens"],
-            "identifier": config.get("version") or config.get("identifier"),
-            "output_format": config["output_format"]
-        }
+    return job_status_response(job)
+
+@app.post("/webhooks/replicate/{job_id}", include_in_schema=False)
+async def replicate_webhook(job_id: str, token: str, request: Request, model: Optional[str] = None):
+    payload = await request.json()
+    if not await handle_replicate_webhook(job_id, token, payload, model):
+        raise HTTPException(status_code=404, detail="Unknown job")
     
-    return {
-        "available_models": models_info,
-        "total_models": len(models_info),
-        "note": "TTS models charge per 1000 input tokens. Approx 1 character = 1 token."
-    }
+    return {"ok": True}
 
-@app.post("/generate-tts", response_model=TTSResponse, tags=["TTS Models"])
-async def generate_tts(
-    request: TTSRequest,
-    response: Response,
-    x_payment_tx: str = Header(..., alias="X-Payment-Tx")
+@app.post("/generate-video/events", tags=["Video Models"])
+async def generate_video_events(
+    request: VideoGenerationRequest,
+    payment: PaymentHeaders = Depends(payment_headers)
 ):
+    """Same as POST /generate-video, but streams each VideoResult as Server-Sent Events"""
+    charge = await charge_video_request(request, payment)
+    
+    # Each failed model is credited back as soon as its result arrives
+    credits = FailedModelCredits(charge)
+    return sse_response(
+        stream_video_inference(request),
+        summarize_video_results,
+        lambda result: credits.add(result.credited_usd)
+    )
+
+@app.get("/tts-models", tags=["TTS Models"])
+async def list_tts_models(if_none_match: Optional[str] = Header(None, alias="If-None-Match")):
+    """List all available TTS models with their costs"""
+    return listing_response("tts", if_none_match)
+
+def price_tts_request(request: TTSRequest) -> Dict[str, int]:
     # Validate all selected models exist
     invalid_models = [m for m in request.models if m not in TTS_MODEL_REGISTRY]
     if invalid_models:
@@ -179,20 +463,87 @@ async def generate_tts(
             detail=f"Invalid TTS models: {invalid_models}. Use GET /tts-models to see available models."
         )
     
-    # Calculate total cost for all selected models based on text length
-    total_cost = 0.0
-    for model in request.models:
-        cost, _ = calculate_tts_cost(model, request.text)
-        total_cost += cost
+    # Per-model cost in USDC units from each model's token count
+    return tts_price_units(request.models, request)
+
+async def charge_tts_request(request: TTSRequest, payment: PaymentHeaders) -> Payment:
+    breakdown = price_tts_request(request)
+    
+    # A signed quote already fixes the amount; otherwise sum the precomputed prices
+    total_units = quoted_units(payment.quote, "tts", request)
+    if total_units is None:
+        total_units = sum(breakdown.values())
     
-    # Verify payment with total cost
-    await verify_usdc_payment(total_cost, x_payment_tx)
+    # Charge prepaid credits or verify the on-chain payment for the total cost
+    return await collect_payment(total_units, payment)
+
+@app.post("/generate-tts", response_model=TTSResponse, tags=["TTS Models"])
+async def generate_tts(
+    request: TTSRequest,
+    response: Response,
+    payment: PaymentHeaders = Depends(payment_headers)
+):
+    charge = await charge_tts_request(request, payment)
     
     # Run all models and get results
-    generation_response = run_tts_inference(request)
+    generation_response = await run_tts_inference(request)
+    
+    # Failed models are credited back and applied to the payer's next request
+    await credit_failed_models(charge, generation_response.total_credited_usd)
     
     return generation_response
 
+@app.post("/generate-tts/events", tags=["TTS Models"])
+async def generate_tts_events(
+    request: TTSRequest,
+    payment: PaymentHeaders = Depends(payment_headers)
+):
+    """Same as POST /generate-tts, but streams each TTSResult as Server-Sent Events"""
+    charge = await charge_tts_request(request, payment)
+    
+    # Each failed model is credited back as soon as its result arrives
+    credits = FailedModelCredits(charge)
+    return sse_response(
+        stream_tts_inference(request),
+        summarize_tts_results,
+        lambda result: credits.add(result.credited_usd)
+    )
+
+@app.post("/generate-tts/stream", tags=["TTS Models"])
+async def generate_tts_stream(
+    request: TTSRequest,
+    payment: PaymentHeaders = Depends(payment_headers)
+):
+    """
+    Speak the text with a single model as one progressive audio response (WAV or MP3).
+    Audio starts as soon as the first sentence is synthesized; the rest follows in order.
+    """
+    if len(request.models) != 1:
+        raise HTTPException(status_code=400, detail="Streaming audio takes exactly one model.")
+    
+    charge = await charge_tts_request(request, payment)
+    
+    try:
+        media_type, audio = await stream_tts_audio(request.models[0], request)
+    except Exception as e:
+        # Nothing was delivered, so the whole charge is credited back
+        await credit_failed_models(charge, charge.units / 10**6)
+        raise HTTPException(status_code=502, detail=f"TTS model failed: {e}")
+    
+    async def audio_stream():
+        try:
+            async for piece in audio:
+                yield piece
+        except Exception:
+            # The audio is cut short; credit the model as failed
+            await credit_failed_models(charge, charge.units / 10**6)
+    
+    return StreamingResponse(
+        audio_stream(),
+        media_type=media_type,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,151 @@
+import os
+from typing import AsyncIterator, Optional, Tuple
+
+# RIFF/data size used while the total length is unknown (streamed WAV)
+WAV_UNKNOWN_SIZE = 0xFFFFFFFF
+
+class AudioStitchError(ValueError):
+    pass
+
+def wav_header(fmt: bytes, data_size: int = WAV_UNKNOWN_SIZE) -> bytes:
+    """
+    RIFF/WAVE header for PCM data described by a `fmt ` chunk payload.
+    """
+    riff_size = WAV_UNKNOWN_SIZE if data_size == WAV_UNKNOWN_SIZE else min(4 + 8 + len(fmt) + 8 + data_size, WAV_UNKNOWN_SIZE)
+    return (
+        b"RIFF" + riff_size.to_bytes(4, "little") + b"WAVE"
+        + b"fmt " + len(fmt).to_bytes(4, "little") + fmt
+        + b"data" + min(data_size, WAV_UNKNOWN_SIZE).to_bytes(4, "little")
+    )
+
+async def _split_wav(chunks: AsyncIterator[bytes]) -> Tuple[bytes, AsyncIterator[bytes]]:
+    """
+    Read a WAV stream up to its `data` chunk.
+    Returns (fmt payload, iterator over the sample bytes that follow).
+    """
+    source = chunks.__aiter__()
+    buffer = bytearray()
+
+    async def need(n: int) -> None:
+        while len(buffer) < n:
+            try:
+                buffer.extend(await source.__anext__())
+            except StopAsyncIteration:
+                raise AudioStitchError("Truncated WAV header")
+
+    await need(12)
+    if buffer[:4] != b"RIFF" or buffer[8:12] != b"WAVE":
+        raise AudioStitchError("Audio segment is not a WAV file")
+
+    pos, fmt = 12, None
+    while True:
+        await need(pos + 8)
+        chunk_id = bytes(buffer[pos:pos + 4])
+        size = int.from_bytes(buffer[pos + 4:pos + 8], "little")
+        pos += 8
+        if chunk_id == b"data":
+            break
+        # Chunks are padded to an even length
+        await need(pos + size + (size & 1))
+        if chunk_id == b"fmt ":
+            fmt = bytes(buffer[pos:pos + size])
+        pos += size + (size & 1)
+    if fmt is None:
+        raise AudioStitchError("WAV segment has no fmt chunk")
+
+    # A 0 or all-ones size means "until the end"; otherwise trailing chunks are not samples
+    remaining = None if size in (0, WAV_UNKNOWN_SIZE) else size
+    head = bytes(buffer[pos:])
+
+    async def samples() -> AsyncIterator[bytes]:
+        nonlocal remaining
+        pieces = [head]
+        while True:
+            for piece in pieces:
+                if remaining is not None:
+                    piece = piece[:remaining]
+                    remaining -= len(piece)
+                if piece:
+                    yield piece
+                if remaining == 0:
+                    return
+            try:
+                pieces = [await source.__anext__()]
+            except StopAsyncIteration:
+                return
+
+    return fmt, samples()
+
+def _id3v2_length(data: bytes) -> Optional[int]:
+    # Total length of a leading ID3v2 tag, or None if `data` does not start with one
+    if len(data) < 10 or data[:3] != b"ID3":
+        return None
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+async def _mp3_frames(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    MPEG audio bytes of one segment with any leading ID3v2 tag removed.
+    """
+    buffer = bytearray()
+    source = chunks.__aiter__()
+    async for chunk in source:
+        buffer.extend(chunk)
+        if len(buffer) >= 10:
+            break
+    skip = _id3v2_length(bytes(buffer[:10])) or 0
+    pending = bytes(buffer)
+    while True:
+        if skip >= len(pending):
+            skip -= len(pending)
+        else:
+            yield pending[skip:]
+            skip = 0
+        try:
+            pending = await source.__anext__()
+        except StopAsyncIteration:
+            return
+
+async def stitch_audio(audio_format: str, segments: AsyncIterator[AsyncIterator[bytes]]) -> AsyncIterator[bytes]:
+    """
+    Join audio segments (each an async iterator of bytes) into one stream, in order,
+    without holding more than one network chunk in memory.
+
+    WAV: one header (sizes left open, see `finalize_wav_file`) followed by the
+    samples of every segment; all segments must share one sample format.
+    MP3: frames are concatenated; ID3 tags of the later segments are dropped.
+    """
+    first = True
+    fmt = None
+    async for segment in segments:
+        if audio_format == "wav":
+            segment_fmt, samples = await _split_wav(segment)
+            if first:
+                fmt = segment_fmt
+                yield wav_header(fmt)
+            elif segment_fmt != fmt:
+                raise AudioStitchError("WAV segments have different sample formats")
+            async for piece in samples:
+                yield piece
+        elif audio_format == "mp3":
+            frames = segment if first else _mp3_frames(segment)
+            async for piece in frames:
+                yield piece
+        else:
+            raise AudioStitchError(f"Cannot stitch '{audio_format}' audio")
+        first = False
+
+def finalize_wav_file(path: str) -> None:
+    """
+    Write the real RIFF and data sizes into a stitched WAV file.
+    """
+    with open(path, "r+b") as f:
+        header = f.read(20)
+        fmt_size = int.from_bytes(header[16:20], "little")
+        data_offset = 20 + fmt_size + 8
+        data_size = os.path.getsize(path) - data_offset
+        f.seek(4)
+        f.write(min(data_offset - 8 + data_size, WAV_UNKNOWN_SIZE).to_bytes(4, "little"))
+        f.seek(data_offset - 4)
+        f.write(min(data_size, WAV_UNKNOWN_SIZE).to_bytes(4, "little"))
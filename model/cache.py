@@ -0,0 +1,255 @@
+import os
+import json
+import asyncio
+import time
+import hashlib
+import sqlite3
+from collections import OrderedDict
+from typing import Optional, List, Dict, Any, Callable, Awaitable
+from dotenv import load_dotenv
+from model.fanout import run_sqlite
+from model.metrics import RESULT_CACHE_LOOKUPS
+
+load_dotenv()
+
+# --- CONFIGURATION ---
+# "memory" (per process), "sqlite" (shared on disk) or "off"
+RESULT_CACHE_BACKEND = os.getenv("RESULT_CACHE", "memory")
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", "result_cache.sqlite3")
+# Replicate delivery URLs expire after about an hour, so keep entries well below that
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "1800"))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000"))
+
+# Inputs that make a run intentionally random; such calls are never cached
+RANDOMNESS_INPUT_KEYS = {"seed"}
+
+def result_cache_key(model_ref: str, input_data: Dict[str, Any]) -> str:
+    """
+    Content address for a model call: the model reference plus a canonical
+    (sorted, compact) JSON encoding of its input dict.
+    """
+    canonical = json.dumps(input_data, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(f"{model_ref}\n{canonical}".encode("utf-8")).hexdigest()
+
+def is_cacheable(model_config: Dict[str, Any], input_data: Dict[str, Any]) -> bool:
+    """
+    A registry entry can opt out with "cacheable": False; seeded calls always opt out.
+    """
+    if not model_config.get("cacheable", True):
+        return False
+    return not any(key in input_data for key in RANDOMNESS_INPUT_KEYS)
+
+class ResultCache:
+    """
+    TTL + LRU cache of model output URLs, keyed by `result_cache_key`.
+    """
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def get(self, key: str) -> Optional[List[str]]:
+        raise NotImplementedError
+
+    async def set(self, key: str, urls: List[str]) -> None:
+        raise NotImplementedError
+
+    async def size(self) -> int:
+        raise NotImplementedError
+
+    async def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": await self.size(),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds
+        }
+
+class InMemoryResultCache(ResultCache):
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        super().__init__(ttl_seconds, max_entries)
+        # key -> (expires_at, urls), ordered from least to most recently used
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[List[str]]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return list(entry[1])
+
+    async def set(self, key: str, urls: List[str]) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, list(urls))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def size(self) -> int:
+        return len(self._entries)
+
+class SQLiteResultCache(ResultCache):
+    """
+    Disk-backed cache shared by every worker on the host. Hit/miss counters are per process.
+    """
+    def __init__(self, path: str, ttl_seconds: float, max_entries: int):
+        super().__init__(ttl_seconds, max_entries)
+        self._path = path
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " key TEXT PRIMARY KEY,"
+                " urls TEXT NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self._path, timeout=30, isolation_level=None)
+
+    def _get(self, key: str) -> Optional[List[str]]:
+        now = time.time()
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT urls, expires_at FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE results SET last_used = ? WHERE key = ?", (now, key))
+            return json.loads(row[0])
+        finally:
+            conn.close()
+
+    def _set(self, key: str, urls: List[str]) -> int:
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, urls, expires_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(urls), now + self.ttl_seconds, now)
+            )
+            # Drop expired rows first, then the least recently used ones over the cap
+            evicted = conn.execute("DELETE FROM results WHERE expires_at < ?", (now,)).rowcount
+            excess = conn.execute("SELECT COUNT(*) FROM results").fetchone()[0] - self.max_entries
+            if excess > 0:
+                evicted += conn.execute(
+                    "DELETE FROM results WHERE key IN "
+                    "(SELECT key FROM results ORDER BY last_used LIMIT ?)",
+                    (excess,)
+                ).rowcount
+            return evicted
+        finally:
+            conn.close()
+
+    def _size(self) -> int:
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        finally:
+            conn.close()
+
+    async def get(self, key: str) -> Optional[List[str]]:
+        urls = await run_sqlite(self._get, key)
+        if urls is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return urls
+
+    async def set(self, key: str, urls: List[str]) -> None:
+        self.evictions += await run_sqlite(self._set, key, urls)
+
+    async def size(self) -> int:
+        return await run_sqlite(self._size)
+
+def create_result_cache() -> Optional[ResultCache]:
+    if RESULT_CACHE_BACKEND == "off":
+        return None
+    if RESULT_CACHE_BACKEND == "memory":
+        return InMemoryResultCache(RESULT_CACHE_TTL_SECONDS, RESULT_CACHE_MAX_ENTRIES)
+    if RESULT_CACHE_BACKEND == "sqlite":
+        return SQLiteResultCache(RESULT_CACHE_PATH, RESULT_CACHE_TTL_SECONDS, RESULT_CACHE_MAX_ENTRIES)
+    raise ValueError(f"Unknown RESULT_CACHE backend '{RESULT_CACHE_BACKEND}'. Use 'memory', 'sqlite' or 'off'.")
+
+result_cache = create_result_cache()
+
+# result_cache_key -> the one model call identical concurrent requests are waiting on
+_in_flight: Dict[str, asyncio.Task] = {}
+_coalesced = 0
+
+def _finish_flight(key: str, task: asyncio.Task) -> None:
+    if _in_flight.get(key) is task:
+        del _in_flight[key]
+    # Mark the outcome as seen even when every caller already gave up
+    if not task.cancelled():
+        task.exception()
+
+async def single_flight(key: str, run: Callable[[], Awaitable[List[str]]]) -> List[str]:
+    """
+    Run `run()` once for all concurrent callers with the same key; every caller
+    gets its result (or its exception).
+    """
+    global _coalesced
+    task = _in_flight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(run())
+        _in_flight[key] = task
+        task.add_done_callback(lambda t: _finish_flight(key, t))
+    else:
+        _coalesced += 1
+    # Shield so one caller timing out does not cancel the call for the others
+    return list(await asyncio.shield(task))
+
+async def cached_urls(
+    model_config: Dict[str, Any],
+    model_ref: str,
+    input_data: Dict[str, Any],
+    run: Callable[[], Awaitable[List[str]]]
+) -> List[str]:
+    """
+    Return output URLs for this exact model call from the cache, or call `run()`
+    and remember its URLs. Only successful runs are cached. Identical calls that
+    arrive while one is running wait for it instead of starting their own.
+    """
+    if not is_cacheable(model_config, input_data):
+        return await run()
+
+    key = result_cache_key(model_ref, input_data)
+    if result_cache is not None:
+        urls = await result_cache.get(key)
+        if urls is not None:
+            RESULT_CACHE_LOOKUPS.labels(outcome="hit").inc()
+            return urls
+    RESULT_CACHE_LOOKUPS.labels(outcome="coalesced" if key in _in_flight else "miss").inc()
+
+    async def run_and_store() -> List[str]:
+        urls = await run()
+        if result_cache is not None:
+            await result_cache.set(key, urls)
+        return urls
+
+    return await single_flight(key, run_and_store)
+
+async def result_cache_stats() -> Dict[str, Any]:
+    coalescing = {"in_flight": len(_in_flight), "coalesced": _coalesced}
+    if result_cache is None:
+        return {"backend": "off", **coalescing}
+    return {**await result_cache.stats(), **coalescing}
@@ -0,0 +1,101 @@
+import os
+import json
+import hashlib
+from typing import Optional, Dict, Any
+from dotenv import load_dotenv
+from fastapi.responses import Response
+from model.registry import RegistrySnapshot, model_registry
+
+load_dotenv()
+
+# --- CONFIGURATION ---
+# Listings change only when the registry file does; clients revalidate with If-None-Match
+CATALOG_CACHE_CONTROL = os.getenv("CATALOG_CACHE_CONTROL", "public, max-age=30")
+
+TTS_PRICING_NOTE = (
+    "TTS models charge per 1000 input tokens, counted on the text with SSML tags removed and whitespace collapsed. "
+    "token_counter says whether a token is a character, a UTF-8 byte or a word."
+)
+
+def _identifier(config: dict) -> str:
+    return config.get("version") or config.get("identifier")
+
+def image_listing(snapshot: RegistrySnapshot) -> Dict[str, Any]:
+    models_info = {
+        name: {"cost_usd": config["cost_usd"], "identifier": _identifier(config)}
+        for name, config in snapshot.image.items()
+    }
+    return {"available_models": models_info, "total_models": len(models_info)}
+
+def video_listing(snapshot: RegistrySnapshot) -> Dict[str, Any]:
+    models_info = {
+        name: {"cost_usd": config["cost_usd"], "identifier": _identifier(config), "type": config["type"]}
+        for name, config in snapshot.video.items()
+    }
+    return {"available_models": models_info, "total_models": len(models_info)}
+
+def tts_listing(snapshot: RegistrySnapshot) -> Dict[str, Any]:
+    models_info = {
+        name: {
+            "cost_per_1000_tokens": config["cost_per_1000_tokens"],
+            "token_counter": config["token_counter"],
+            "identifier": _identifier(config),
+            "output_format": config["output_format"]
+        }
+        for name, config in snapshot.tts.items()
+    }
+    return {"available_models": models_info, "total_models": len(models_info), "note": TTS_PRICING_NOTE}
+
+def full_catalog(snapshot: RegistrySnapshot) -> Dict[str, Any]:
+    return {
+        "registry_version": snapshot.version,
+        "image": image_listing(snapshot),
+        "video": video_listing(snapshot),
+        "tts": tts_listing(snapshot)
+    }
+
+LISTINGS = {
+    "image": image_listing,
+    "video": video_listing,
+    "tts": tts_listing,
+    "catalog": full_catalog
+}
+
+class EncodedListing:
+    """
+    A listing serialized once: its JSON bytes and a strong ETag over them.
+    """
+    def __init__(self, content: Dict[str, Any]):
+        # Same encoding FastAPI's JSONResponse uses
+        self.body = json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+        self.etag = '"' + hashlib.sha256(self.body).hexdigest()[:32] + '"'
+
+def _encode_listings(snapshot: RegistrySnapshot) -> Dict[str, EncodedListing]:
+    return {name: EncodedListing(build(snapshot)) for name, build in LISTINGS.items()}
+
+def encoded_listings(snapshot: RegistrySnapshot) -> Dict[str, EncodedListing]:
+    return snapshot.derived("listings", _encode_listings)
+
+# Encoded at startup and for every reloaded registry before it goes live
+encoded_listings(model_registry.current)
+model_registry.subscribe(encoded_listings)
+
+def _etag_matches(etag: str, if_none_match: Optional[str]) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match compares weakly, so a W/ prefix added by a proxy still matches
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+def listing_response(name: str, if_none_match: Optional[str]) -> Response:
+    """
+    Serve a precomputed listing ("image", "video", "tts" or "catalog") with its
+    ETag and Cache-Control, or 304 when the client already has it.
+    """
+    listing = encoded_listings(model_registry.current)[name]
+    headers = {"ETag": listing.etag, "Cache-Control": CATALOG_CACHE_CONTROL}
+    if _etag_matches(listing.etag, if_none_match):
+        return Response(status_code=304, headers=headers)
+    return Response(content=listing.body, media_type="application/json", headers=headers)
@@ -0,0 +1,158 @@
+import inspect
+import replicate
+from collections.abc import Mapping
+from contextlib import nullcontext
+from pydantic import BaseModel
+from typing import Optional, List, Dict, Any, AsyncIterator, Callable, ContextManager, Type
+from model.fanout import fan_out, fan_out_as_completed
+from model.scheduler import scheduled, PRIORITY_INTERACTIVE
+from model.cache import cached_urls
+from model.storage import mirror_urls
+
+def output_url(item: Any) -> str:
+    """
+    URL of one model output: a plain string, or a file object whose `url` is an
+    attribute or a method.
+    """
+    if isinstance(item, str):
+        return item
+    url = getattr(item, "url", None)
+    if url is None:
+        return str(item)
+    return str(url() if callable(url) else url)
+
+def output_urls(model_config: dict, output: Any) -> List[str]:
+    """
+    Normalize a model output into a list of URLs, per the entry's `output_type`.
+    """
+    if model_config.get("output_type", "single") == "single":
+        return [output_url(output)]
+    return [output_url(item) for item in output]
+
+def model_ref(model_config: dict) -> str:
+    # A pinned "owner/name:version" wins over a bare "owner/name"
+    return model_config.get("version") or model_config.get("identifier")
+
+async def run_model(
+    model_config: dict,
+    input_data: Dict[str, Any],
+    priority: int = PRIORITY_INTERACTIVE,
+    call_context: Optional[Callable[[], ContextManager]] = None,
+    timeout: Optional[float] = None
+) -> List[str]:
+    """
+    One Replicate call, the same way for every modality: served from the result
+    cache (or joined with an identical call in flight) when possible, otherwise
+    admitted by the model's scheduler (rate limit, adaptive concurrency, 429
+    retries), with its output normalized to URLs and mirrored off the expiring
+    delivery URLs. `call_context` wraps real runs only, not cache hits.
+    `timeout` bounds the call once admitted (default REPLICATE_MODEL_TIMEOUT_SECONDS).
+    """
+    ref = model_ref(model_config)
+
+    async def run() -> List[str]:
+        with (call_context or nullcontext)():
+            output = await scheduled(ref, lambda: replicate.async_run(ref, input=input_data), priority, timeout)
+
+            # Iterator-style models stream their outputs back as an async generator.
+            # A single FileOutput is async-iterable too (over its bytes), so only
+            # real generators are drained.
+            if inspect.isasyncgen(output):
+                output = [item async for item in output]
+
+            return await mirror_urls(output_urls(model_config, output))
+
+    return await cached_urls(model_config, ref, input_data, run)
+
+class Modality:
+    """
+    Plugin interface for one kind of generation (image, video, TTS, ...).
+
+    A plugin names its registry and result types and says how to build a
+    model's input and wrap its URLs; the engine does the rest (fan-out,
+    timeouts, caching, scheduling, retries, output normalization, totals).
+    Override `generate` for models that need more than one plain call.
+    """
+    name: str
+    label: str  # "Video model", as in "Video model 'x' not found"
+    registry: Mapping
+    response_model: Type[BaseModel]
+    # Seconds one admitted call may run; None uses REPLICATE_MODEL_TIMEOUT_SECONDS
+    timeout_seconds: Optional[float] = None
+
+    def build_input(self, model_name: str, request: BaseModel) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def cost(self, model_name: str, request: BaseModel) -> float:
+        return self.registry.get(model_name, {}).get("cost_usd", 0.0)
+
+    async def success_result(self, model_name: str, request: BaseModel, urls: List[str]) -> BaseModel:
+        raise NotImplementedError
+
+    def error_result(self, model_name: str, message: str, request: BaseModel) -> BaseModel:
+        raise NotImplementedError
+
+    async def generate(self, model_name: str, request: BaseModel) -> BaseModel:
+        urls = await run_model(
+            self.registry[model_name],
+            self.build_input(model_name, request),
+            timeout=self.timeout_seconds
+        )
+        return await self.success_result(model_name, request, urls)
+
+    def totals(self, results: List[BaseModel]) -> Dict[str, Any]:
+        # Modality-specific response totals on top of the shared ones
+        return {}
+
+async def run_one(modality: Modality, model_name: str, request: BaseModel) -> BaseModel:
+    """
+    Result of one model; a failure becomes its error result (price credited back).
+    """
+    if model_name not in modality.registry:
+        return modality.error_result(model_name, f"{modality.label} '{model_name}' not found", request)
+    try:
+        return await modality.generate(model_name, request)
+    except Exception as e:
+        return modality.error_result(model_name, str(e), request)
+
+def summarize(modality: Modality, results: List[BaseModel]) -> BaseModel:
+    """
+    Combine per-model results into the modality's response with totals.
+    """
+    total_charged = sum(r.cost_usd for r in results)
+    total_credited = sum(r.credited_usd for r in results)
+    successful = sum(1 for r in results if r.status == "success")
+
+    return modality.response_model(
+        results=results,
+        total_cost_usd=total_charged - total_credited,
+        total_charged_usd=total_charged,
+        total_credited_usd=total_credited,
+        total_models=len(results),
+        successful=successful,
+        failed=len(results) - successful,
+        **modality.totals(results)
+    )
+
+async def generate_all(modality: Modality, request: BaseModel) -> BaseModel:
+    """
+    Run every model of the request at once and return the combined response;
+    wall time is close to the slowest model.
+    """
+    results = await fan_out(
+        request.models,
+        lambda model_name: run_one(modality, model_name, request),
+        lambda model_name, message: modality.error_result(model_name, message, request)
+    )
+    return summarize(modality, results)
+
+async def stream_all(modality: Modality, request: BaseModel) -> AsyncIterator[BaseModel]:
+    """
+    Run every model of the request at once and yield each result as it completes.
+    """
+    async for result in fan_out_as_completed(
+        request.models,
+        lambda model_name: run_one(modality, model_name, request),
+        lambda model_name, message: modality.error_result(model_name, message, request)
+    ):
+        yield result
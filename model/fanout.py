@@ -0,0 +1,136 @@
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- CONFIGURATION ---
+# Max model calls running at once across the whole process
+GLOBAL_MAX_CONCURRENCY = int(os.getenv("REPLICATE_MAX_CONCURRENCY", "16"))
+# Max model calls running at once for a single compare request
+REQUEST_MAX_CONCURRENCY = int(os.getenv("REPLICATE_MAX_CONCURRENCY_PER_REQUEST", "6"))
+# Threads for the SQLite stores (ledger, spent hashes, jobs, result cache)
+SQLITE_MAX_CONCURRENCY = int(os.getenv("SQLITE_MAX_CONCURRENCY", "4"))
+
+# Threads for the remaining blocking work (disk, CPU-bound helpers)
+_executor = ThreadPoolExecutor(
+    max_workers=GLOBAL_MAX_CONCURRENCY,
+    thread_name_prefix="blocking"
+)
+# Kept apart so payment checks never queue behind large media writes. SQLite
+# serializes writers anyway, so a few threads are enough.
+_sqlite_executor = ThreadPoolExecutor(
+    max_workers=SQLITE_MAX_CONCURRENCY,
+    thread_name_prefix="sqlite"
+)
+
+
+class LazySemaphore:
+    """
+    An `asyncio.Semaphore` created on first use inside the running loop rather
+    than at import time, and again if a later loop (e.g. a new `asyncio.run`) uses it.
+    """
+    def __init__(self, value: int):
+        self._value = value
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self._value)
+            self._loop = loop
+        return self._semaphore
+
+    async def __aenter__(self) -> None:
+        await self._get().acquire()
+
+    async def __aexit__(self, *exc_info) -> None:
+        self._semaphore.release()
+
+
+_global_semaphore = LazySemaphore(GLOBAL_MAX_CONCURRENCY)
+
+
+async def run_blocking(func: Callable[..., Any], *args) -> Any:
+    """
+    Run a blocking function on the shared worker pool without blocking the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, func, *args)
+
+
+async def run_sqlite(func: Callable[..., Any], *args) -> Any:
+    """
+    Same as `run_blocking`, on the threads reserved for the SQLite stores.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_sqlite_executor, func, *args)
+
+
+def _guarded_runner(
+    run_one: Callable[[str], Awaitable[Any]],
+    on_error: Callable[[str, str], Any],
+    max_concurrency: Optional[int],
+    timeout: Optional[float]
+) -> Callable[[str], Awaitable[Any]]:
+    """
+    Wrap `run_one` with the per-request and global caps and an optional overall
+    timeout. Per-call Replicate timeouts are applied by the model's scheduler,
+    once the call is admitted (see model/scheduler.py).
+    """
+    if max_concurrency is None:
+        max_concurrency = REQUEST_MAX_CONCURRENCY
+
+    request_semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def run_guarded(model_name: str) -> Any:
+        async with request_semaphore, _global_semaphore:
+            try:
+                return await asyncio.wait_for(run_one(model_name), timeout=timeout)
+            except asyncio.TimeoutError:
+                return on_error(model_name, f"Model timed out after {timeout:g} seconds")
+            except Exception as e:
+                return on_error(model_name, str(e))
+
+    return run_guarded
+
+
+async def fan_out(
+    model_names: List[str],
+    run_one: Callable[[str], Awaitable[Any]],
+    on_error: Callable[[str, str], Any],
+    max_concurrency: Optional[int] = None,
+    timeout: Optional[float] = None
+) -> List[Any]:
+    """
+    Run one coroutine per model concurrently and return results in request order.
+
+    A model that raises (or runs past `timeout` seconds, if given) is turned into
+    an error result via `on_error(model_name, message)` so it never blocks the others.
+    """
+    run_guarded = _guarded_runner(run_one, on_error, max_concurrency, timeout)
+    return await asyncio.gather(*(run_guarded(m) for m in model_names))
+
+
+async def fan_out_as_completed(
+    model_names: List[str],
+    run_one: Callable[[str], Awaitable[Any]],
+    on_error: Callable[[str, str], Any],
+    max_concurrency: Optional[int] = None,
+    timeout: Optional[float] = None
+) -> AsyncIterator[Any]:
+    """
+    Same as `fan_out`, but yield each result as soon as its model finishes.
+    Models still running are cancelled if the consumer stops early.
+    """
+    run_guarded = _guarded_runner(run_one, on_error, max_concurrency, timeout)
+    tasks = [asyncio.create_task(run_guarded(m)) for m in model_names]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
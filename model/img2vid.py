@@ -1,26 +1,25 @@
 import os
 import replicate
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, AsyncIterator
 from dotenv import load_dotenv
+from model.engine import Modality, model_ref, summarize, stream_all
+from model.scheduler import scheduled
+from model.previews import video_previews
+from model.registry import RegistryView, build_model_input
 
 load_dotenv()
 
-# Video Model Registry with pricing and configuration
-VIDEO_MODEL_REGISTRY = {
-    "wan-i2v-fast": {
-        "identifier": "wan-video/wan-2.2-i2v-fast",
-        "cost_usd": 0.05,
-        "output_type": "single",
-        "type": "image-to-video"
-    },
-    "ltx-video": {
-        "version": "lightricks/ltx-video:8c47da666861d081eeb4d1261853087de23923a268a69b63febdf5dc1dee08e4",
-        "cost_usd": 0.08,
-        "output_type": "array",
-        "type": "text-to-video"
-    }
-}
+# --- CONFIGURATION ---
+# Seconds a video model may run once admitted on the streaming path (POST /generate-video/events);
+# video takes minutes, so it gets its own limit instead of REPLICATE_MODEL_TIMEOUT_SECONDS
+VIDEO_MODEL_TIMEOUT_SECONDS = float(os.getenv("REPLICATE_VIDEO_TIMEOUT_SECONDS", "600"))
+
+# Video models from the registry file (see model/registry.py); always the current version
+VIDEO_MODEL_REGISTRY = RegistryView("video")
+
+# Optional request fields passed to models whose registry entry has no "inputs" mapping
+VIDEO_INPUT_FIELDS = ["aspect_ratio", "negative_prompt", "duration", "fps", "motion_bucket_id"]
 
 class VideoGenerationRequest(BaseModel):
     prompt: str
@@ -37,131 +36,117 @@ class VideoGenerationRequest(BaseModel):
 class VideoResult(BaseModel):
     model_name: str
     video_urls: List[str]
+    # First-frame WebP posters and short low-bitrate MP4s of video_urls (OUTPUT_PREVIEWS=on)
+    poster_urls: List[str] = []
+    preview_urls: List[str] = []
     cost_usd: float
+    credited_usd: float = 0.0  # Price of a failed model, credited back to the payer
     status: str  # "success" or "error"
     error_message: Optional[str] = None
 
 class VideoGenerationResponse(BaseModel):
     results: List[VideoResult]
-    total_cost_usd: float
+    total_cost_usd: float  # Charged minus credited
+    total_charged_usd: float = 0.0
+    total_credited_usd: float = 0.0
     total_models: int
     successful: int
     failed: int
 
-def run_single_video_model_inference(model_name: str, request: VideoGenerationRequest) -> VideoResult:
+def build_video_input(model_config: dict, request: VideoGenerationRequest) -> dict:
+    """
+    Build the Replicate input dict for a video model from the request.
     """
-    Run inference for a single video model.
-    Returns VideoResult with success/error status.
+    # Image-to-video models also take the source image
+    default_fields = VIDEO_INPUT_FIELDS
+    if model_config["type"] == "image-to-video":
+        default_fields = ["image"] + VIDEO_INPUT_FIELDS
+    
+    return build_model_input(model_config, request, default_fields, {"prompt": request.prompt})
+
+class VideoModality(Modality):
     """
-    try:
-        # Validate model selection
-        if model_name not in VIDEO_MODEL_REGISTRY:
-            return VideoResult(
-                model_name=model_name,
-                video_urls=[],
-                cost_usd=0.0,
-                status="error",
-                error_message=f"Video model '{model_name}' not found"
-            )
-        
-        model_config = VIDEO_MODEL_REGISTRY[model_name]
-        
-        # Build input data based on what's provided
-        input_data = {"prompt": request.prompt}
-        
-        # Add image for image-to-video models
-        if request.image and model_config["type"] == "image-to-video":
-            input_data["image"] = request.image
-        
-        # Add optional parameters if they exist
-        if request.aspect_ratio:
-            input_data["aspect_ratio"] = request.aspect_ratio
-        
-        if request.negative_prompt:
-            input_data["negative_prompt"] = request.negative_prompt
-        
-        if request.duration:
-            input_data["duration"] = request.duration
-        
-        if request.fps:
-            input_data["fps"] = request.fps
-        
-        if request.motion_bucket_id:
-            input_data["motion_bucket_id"] = request.motion_bucket_id
-        
-        # Determine which identifier to use
-        model_ref = model_config.get("version") or model_config.get("identifier")
-        
-        # Run the model
-        output = replicate.run(model_ref, input=input_data)
-        
-        # Handle different output types
-        if model_config["output_type"] == "single":
-            # Single output
-            if isinstance(output, str):
-                video_urls = [output]
-            elif hasattr(output, 'url'):
-                url_attr = getattr(output, 'url')
-                if callable(url_attr):
-                    video_urls = [str(url_attr())]
-                else:
-                    video_urls = [str(url_attr)]
-            else:
-                video_urls = [str(output)]
-        else:
-            # Array output
-            video_urls = []
-            for item in output:
-                if isinstance(item, str):
-                    video_urls.append(item)
-                elif hasattr(item, 'url'):
-                    url_attr = getattr(item, 'url')
-                    if callable(url_attr):
-                        video_urls.append(str(url_attr()))
-                    else:
-                        video_urls.append(str(url_attr))
-                else:
-                    video_urls.append(str(item))
-        
+    Text- and image-to-video models; successful results get poster frames and
+    short previews.
+    """
+    name = "video"
+    label = "Video model"
+    registry = VIDEO_MODEL_REGISTRY
+    response_model = VideoGenerationResponse
+    timeout_seconds = VIDEO_MODEL_TIMEOUT_SECONDS
+    
+    def build_input(self, model_name: str, request: VideoGenerationRequest) -> dict:
+        return build_video_input(self.registry[model_name], request)
+    
+    async def success_result(self, model_name: str, request: VideoGenerationRequest, urls: List[str]) -> VideoResult:
         return VideoResult(
             model_name=model_name,
-            video_urls=video_urls,
-            cost_usd=model_config["cost_usd"],
+            video_urls=urls,
+            **await video_previews(urls),
+            cost_usd=self.cost(model_name, request),
             status="success"
         )
-        
-    except Exception as e:
-        # Return error result if model fails
-        model_cost = VIDEO_MODEL_REGISTRY.get(model_name, {}).get("cost_usd", 0.0)
+    
+    def error_result(self, model_name: str, message: str, request: Optional[VideoGenerationRequest] = None) -> VideoResult:
+        """
+        Build the error result for a video model that raised or timed out.
+        Its price is credited back rather than charged.
+        """
+        model_cost = self.cost(model_name, request)
         return VideoResult(
             model_name=model_name,
             video_urls=[],
             cost_usd=model_cost,
+            credited_usd=model_cost,
             status="error",
-            error_message=str(e)
+            error_message=message
         )
 
-def run_video_inference(request: VideoGenerationRequest) -> VideoGenerationResponse:
+video_modality = VideoModality()
+
+def video_error_result(model_name: str, message: str, cost_usd: Optional[float] = None) -> VideoResult:
+    # `cost_usd` is the price the job was charged, for a model the registry may no longer list
+    result = video_modality.error_result(model_name, message)
+    if cost_usd is not None:
+        result.cost_usd = result.credited_usd = cost_usd
+    return result
+
+def summarize_video_results(results: List[VideoResult]) -> VideoGenerationResponse:
+    """
+    Combine per-model video results into a response with totals.
+    """
+    return summarize(video_modality, results)
+
+async def stream_video_inference(request: VideoGenerationRequest) -> AsyncIterator[VideoResult]:
+    """
+    Runs all selected video models concurrently and yields each result as it completes.
+    """
+    async for result in stream_all(video_modality, request):
+        yield result
+
+async def create_video_prediction(
+    model_name: str,
+    request: VideoGenerationRequest,
+    webhook: Optional[str] = None
+):
     """
-    Handles calls to Replicate with multiple video model support.
-    Runs all selected models and returns combined results.
+    Start a video model as an async Replicate prediction and return it immediately.
+    Completion is reported to `webhook` when given, otherwise the caller polls.
     """
-    results = []
+    model_config = VIDEO_MODEL_REGISTRY[model_name]
+    ref = model_ref(model_config)
     
-    # Run each model
-    for model_name in request.models:
-        result = run_single_video_model_inference(model_name, request)
-        results.append(result)
+    params = {"input": build_video_input(model_config, request)}
+    if webhook:
+        params["webhook"] = webhook
+        params["webhook_events_filter"] = ["completed"]
     
-    # Calculate totals
-    total_cost = sum(r.cost_usd for r in results)
-    successful = sum(1 for r in results if r.status == "success")
-    failed = sum(1 for r in results if r.status == "error")
+    # "owner/name:version" refs pin a version, bare "owner/name" refs use the latest
+    if ":" in ref:
+        params["version"] = ref.split(":", 1)[1]
+    else:
+        params["model"] = ref
     
-    return VideoGenerationResponse(
-        results=results,
-        total_cost_usd=total_cost,
-        total_models=len(results),
-        successful=successful,
-        failed=failed
-    )
\ No newline at end of file
+    # Starting a prediction returns in milliseconds, so it is scheduled apart from
+    # blocking runs of the same model to keep their latency statistics separate
+    return await scheduled(f"{ref} (create)", lambda: replicate.predictions.async_create(**params))
@@ -0,0 +1,100 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+from prometheus_client import Counter, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+# Buckets from 5 ms (cache, credits) up to 10 minutes (video runs)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_seconds", "Time until the response headers are sent",
+    ["route", "method", "status"], buckets=LATENCY_BUCKETS
+)
+PAYMENT_SECONDS = Histogram(
+    "payment_verification_seconds", "Charging a request, from headers to a recorded payment",
+    ["method", "outcome"], buckets=LATENCY_BUCKETS
+)
+RPC_CALL_SECONDS = Histogram(
+    "rpc_call_seconds", "Single JSON-RPC call to one endpoint (hedges included)",
+    ["endpoint", "outcome"], buckets=LATENCY_BUCKETS
+)
+REPLICATE_QUEUE_SECONDS = Histogram(
+    "replicate_queue_seconds", "Wait in the model scheduler before a Replicate call starts",
+    ["model"], buckets=LATENCY_BUCKETS
+)
+REPLICATE_RUN_SECONDS = Histogram(
+    "replicate_run_seconds", "Replicate call duration once started",
+    ["model", "outcome"], buckets=LATENCY_BUCKETS
+)
+RESULT_CACHE_LOOKUPS = Counter(
+    "result_cache_lookups_total", "Result cache lookups by outcome (hit, miss, coalesced)",
+    ["outcome"]
+)
+POSTPROCESS_SECONDS = Histogram(
+    "postprocess_seconds", "Output post-processing (mirror, preview, tts_stitch)",
+    ["stage"], buckets=LATENCY_BUCKETS
+)
+
+class RequestTimings:
+    """
+    Per-request stage durations for the Server-Timing header. Stages that run
+    in parallel (one per model) add up, so a stage can exceed the request's wall time.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.cost_units: Optional[int] = None
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.stages.items()]
+        entries.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(entries)
+
+_request_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+def begin_request() -> RequestTimings:
+    """
+    Start collecting timings for the current request. Tasks spawned from here
+    share the same object, so their stages land in this request's header.
+    """
+    timings = RequestTimings()
+    _request_timings.set(timings)
+    return timings
+
+def add_timing(stage: str, seconds: float) -> None:
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.stages[stage] = timings.stages.get(stage, 0.0) + seconds
+
+def record_cost(units: int) -> None:
+    """
+    Remember what the current request was charged, for the X-Cost header.
+    """
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.cost_units = units
+
+@contextmanager
+def timed(timing: str, histogram: Optional[Histogram] = None, /, **labels):
+    """
+    Time a block into `histogram` (with `labels`) and the request's Server-Timing entry `timing`.
+    Yields the labels dict, so the block can fill in e.g. its outcome before it ends.
+    """
+    started = time.perf_counter()
+    try:
+        yield labels
+    finally:
+        seconds = time.perf_counter() - started
+        if histogram is not None:
+            (histogram.labels(**labels) if labels else histogram).observe(seconds)
+        add_timing(timing, seconds)
+
+def metrics_payload() -> tuple:
+    """
+    (body, content type) of the Prometheus text exposition.
+    """
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,174 @@
+import os
+import shutil
+import asyncio
+import tempfile
+import subprocess
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, List, Dict
+from dotenv import load_dotenv
+from model.storage import output_storage, media_key, local_path, download_to_file, store_file
+from model.metrics import POSTPROCESS_SECONDS, timed
+
+load_dotenv()
+
+# --- CONFIGURATION ---
+# "on" adds WebP thumbnails (and video posters/previews) to results; needs OUTPUT_MIRROR
+OUTPUT_PREVIEWS = os.getenv("OUTPUT_PREVIEWS", "off").lower() == "on"
+# Worker processes for image and video encoding, kept off the API process
+PREVIEW_WORKERS = int(os.getenv("PREVIEW_WORKERS", "2"))
+THUMBNAIL_MAX_PIXELS = int(os.getenv("THUMBNAIL_MAX_PIXELS", "384"))
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "70"))
+# "on" makes image results wait for their thumbnails; by default they are encoded
+# in the background and the response carries the URLs they will be stored at
+THUMBNAILS_WAIT = os.getenv("THUMBNAILS_WAIT", "off").lower() == "on"
+VIDEO_PREVIEW_HEIGHT = int(os.getenv("VIDEO_PREVIEW_HEIGHT", "240"))
+VIDEO_PREVIEW_BITRATE = os.getenv("VIDEO_PREVIEW_BITRATE", "250k")
+VIDEO_PREVIEW_MAX_SECONDS = float(os.getenv("VIDEO_PREVIEW_MAX_SECONDS", "6"))
+FFMPEG_PATH = os.getenv("FFMPEG_PATH", "ffmpeg")
+
+if OUTPUT_PREVIEWS:
+    if output_storage is None:
+        raise RuntimeError("OUTPUT_PREVIEWS=on requires OUTPUT_MIRROR=local or s3 to host the previews")
+    if importlib.util.find_spec("PIL") is None:
+        raise RuntimeError("OUTPUT_PREVIEWS=on requires the 'Pillow' package (pip install Pillow)")
+
+# Video previews additionally need an ffmpeg binary; without one only images get previews
+VIDEO_PREVIEWS_ENABLED = OUTPUT_PREVIEWS and shutil.which(FFMPEG_PATH) is not None
+
+_pool: Optional[ProcessPoolExecutor] = None
+# Thumbnails being encoded in the background, by storage key
+_pending_thumbnails: Dict[str, asyncio.Task] = {}
+
+def _make_thumbnail(src_path: str, dst_path: str, max_pixels: int, quality: int) -> None:
+    # Runs in a worker process
+    from PIL import Image
+    with Image.open(src_path) as image:
+        image.thumbnail((max_pixels, max_pixels))
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        image.save(dst_path, "WEBP", quality=quality, method=4)
+
+def _make_video_previews(src_path: str, poster_path: str, preview_path: str) -> None:
+    # Runs in a worker process. The first frame is re-encoded to WebP by Pillow,
+    # since not every ffmpeg build ships a WebP encoder.
+    frame_path = poster_path + ".png"
+    try:
+        subprocess.run(
+            [FFMPEG_PATH, "-v", "error", "-y", "-i", src_path, "-frames:v", "1", frame_path],
+            check=True, timeout=60
+        )
+        _make_thumbnail(frame_path, poster_path, THUMBNAIL_MAX_PIXELS * 2, THUMBNAIL_QUALITY)
+    finally:
+        if os.path.exists(frame_path):
+            os.remove(frame_path)
+
+    subprocess.run(
+        [
+            FFMPEG_PATH, "-v", "error", "-y", "-i", src_path,
+            "-t", f"{VIDEO_PREVIEW_MAX_SECONDS:g}",
+            "-vf", f"scale=-2:{VIDEO_PREVIEW_HEIGHT}",
+            "-c:v", "libx264", "-preset", "veryfast",
+            "-b:v", VIDEO_PREVIEW_BITRATE, "-maxrate", VIDEO_PREVIEW_BITRATE,
+            "-bufsize", VIDEO_PREVIEW_BITRATE,
+            "-an", "-movflags", "+faststart", preview_path
+        ],
+        check=True, timeout=300
+    )
+
+async def _run_in_pool(func, *args) -> None:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=PREVIEW_WORKERS)
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(_pool, func, *args)
+
+def close_preview_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+async def _source_file(url: str, workdir: str) -> str:
+    # Mirrored local files are read in place; anything else is downloaded once
+    path = local_path(url)
+    if path is None:
+        path = os.path.join(workdir, "source")
+        await download_to_file(url, path)
+    return path
+
+def _thumbnail_key(url: str) -> str:
+    return media_key(url)[:64] + "-thumb.webp"
+
+async def _image_thumbnail(url: str) -> Optional[str]:
+    key = _thumbnail_key(url)
+    try:
+        if await output_storage.exists(key):
+            return output_storage.url(key)
+        with tempfile.TemporaryDirectory(prefix="preview-") as workdir:
+            src_path = await _source_file(url, workdir)
+            dst_path = os.path.join(workdir, "thumb.webp")
+            await _run_in_pool(_make_thumbnail, src_path, dst_path, THUMBNAIL_MAX_PIXELS, THUMBNAIL_QUALITY)
+            return await store_file(key, dst_path)
+    except Exception:
+        # A missing preview never fails the result; clients fall back to the original
+        return None
+
+async def _video_previews(url: str) -> Optional[tuple]:
+    base = media_key(url)[:64]
+    poster_key, preview_key = base + "-poster.webp", base + "-preview.mp4"
+    try:
+        if await output_storage.exists(preview_key) and await output_storage.exists(poster_key):
+            return output_storage.url(poster_key), output_storage.url(preview_key)
+        with tempfile.TemporaryDirectory(prefix="preview-") as workdir:
+            src_path = await _source_file(url, workdir)
+            poster_path = os.path.join(workdir, "poster.webp")
+            preview_path = os.path.join(workdir, "preview.mp4")
+            await _run_in_pool(_make_video_previews, src_path, poster_path, preview_path)
+            return await store_file(poster_key, poster_path), await store_file(preview_key, preview_path)
+    except Exception:
+        return None
+
+async def _timed_thumbnail(url: str) -> Optional[str]:
+    with timed("preview", POSTPROCESS_SECONDS, stage="preview"):
+        return await _image_thumbnail(url)
+
+def _thumbnail_in_background(url: str) -> str:
+    # The key is fixed by the source URL, so its URL is known before it exists
+    key = _thumbnail_key(url)
+    if key not in _pending_thumbnails:
+        task = asyncio.create_task(_timed_thumbnail(url))
+        _pending_thumbnails[key] = task
+        task.add_done_callback(lambda _: _pending_thumbnails.pop(key, None))
+    return output_storage.url(key)
+
+async def image_thumbnails(image_urls: List[str]) -> List[str]:
+    """
+    Small WebP thumbnails for a result's images, in order. Unless THUMBNAILS_WAIT
+    is on they are still being encoded when this returns, so a thumbnail URL may
+    answer 404 for a moment (or for good, if encoding fails); clients fall back
+    to the original image.
+    """
+    if not OUTPUT_PREVIEWS:
+        return []
+    if not THUMBNAILS_WAIT:
+        return [_thumbnail_in_background(url) for url in image_urls]
+    with timed("preview", POSTPROCESS_SECONDS, stage="preview"):
+        thumbnails = await asyncio.gather(*(_image_thumbnail(url) for url in image_urls))
+    return [url for url in thumbnails if url]
+
+async def video_previews(video_urls: List[str]) -> Dict[str, List[str]]:
+    """
+    A WebP poster frame and a short low-bitrate MP4 for each video, in order.
+    Returns {"poster_urls": [...], "preview_urls": [...]}.
+    """
+    previews = {"poster_urls": [], "preview_urls": []}
+    if not VIDEO_PREVIEWS_ENABLED:
+        return previews
+    with timed("preview", POSTPROCESS_SECONDS, stage="preview"):
+        made_previews = await asyncio.gather(*(_video_previews(url) for url in video_urls))
+    for made in made_previews:
+        if made:
+            previews["poster_urls"].append(made[0])
+            previews["preview_urls"].append(made[1])
+    return previews
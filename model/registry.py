@@ -0,0 +1,229 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+from collections.abc import Mapping
+from pydantic import BaseModel, model_validator, field_validator
+from typing import Optional, List, Dict, Any, Callable, Iterator, Literal
+from dotenv import load_dotenv
+from model.tokens import TOKEN_COUNTERS, DEFAULT_TOKEN_COUNTER
+
+load_dotenv()
+
+# --- CONFIGURATION ---
+# JSON or YAML file with the image, video and TTS models; by default the
+# models.json next to main.py, wherever the server is started from
+MODEL_REGISTRY_PATH = os.getenv(
+    "MODEL_REGISTRY_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models.json")
+)
+# How often the file is checked for changes (0 disables hot reload)
+MODEL_REGISTRY_RELOAD_SECONDS = float(os.getenv("MODEL_REGISTRY_RELOAD_SECONDS", "5"))
+
+class ModelEntry(BaseModel):
+    """
+    Fields shared by every registry entry. `inputs` maps request fields to the
+    model's Replicate input names; when omitted, the modality's default fields
+    are passed under their own names. `defaults` are fixed inputs sent on every call.
+    """
+    version: Optional[str] = None  # "owner/name:version", pinned
+    identifier: Optional[str] = None  # "owner/name", latest version
+    output_type: Literal["single", "array"] = "single"
+    cacheable: bool = True
+    inputs: Optional[Dict[str, str]] = None
+    defaults: Dict[str, Any] = {}
+
+    @model_validator(mode="after")
+    def one_reference(self):
+        if (self.version is None) == (self.identifier is None):
+            raise ValueError("set exactly one of 'version' or 'identifier'")
+        if self.version is not None and ":" not in self.version:
+            raise ValueError("'version' must look like 'owner/name:version'")
+        return self
+
+class ImageModelEntry(ModelEntry):
+    cost_usd: float
+
+class VideoModelEntry(ModelEntry):
+    cost_usd: float
+    type: Literal["text-to-video", "image-to-video"]
+
+class TTSModelEntry(ModelEntry):
+    cost_per_1000_tokens: float
+    token_counter: str = DEFAULT_TOKEN_COUNTER
+    output_format: Literal["wav", "mp3"]
+    # Request fields the spoken text is read from, first non-empty one wins
+    text_fields: List[str] = ["text"]
+    # Replicate input name the text is sent as
+    text_input: str = "text"
+    inputs: Dict[str, str] = {}  # TTS models take no optional fields unless listed
+
+    @field_validator("token_counter")
+    @classmethod
+    def known_counter(cls, counter: str) -> str:
+        if counter not in TOKEN_COUNTERS:
+            raise ValueError(f"unknown token counter '{counter}', use one of {sorted(TOKEN_COUNTERS)}")
+        return counter
+
+class RegistryConfig(BaseModel):
+    image: Dict[str, ImageModelEntry] = {}
+    video: Dict[str, VideoModelEntry] = {}
+    tts: Dict[str, TTSModelEntry] = {}
+
+class RegistrySnapshot:
+    """
+    One validated version of the registry. Never modified after it is built:
+    a reload builds a new snapshot and swaps it in, so requests holding an
+    entry of the old one finish with it undisturbed.
+    """
+    def __init__(self, config: RegistryConfig, version: str):
+        self.version = version
+        self.loaded_at = time.time()
+        # Plain dicts, the shape the generation modules have always read
+        self.image = {name: entry.model_dump() for name, entry in config.image.items()}
+        self.video = {name: entry.model_dump() for name, entry in config.video.items()}
+        self.tts = {name: entry.model_dump() for name, entry in config.tts.items()}
+        self._derived: Dict[str, Any] = {}
+
+    def derived(self, name: str, build: Callable[["RegistrySnapshot"], Any]) -> Any:
+        """
+        Value computed from this snapshot once (price tables, listings), so it
+        always matches the models it was computed from.
+        """
+        if name not in self._derived:
+            self._derived[name] = build(self)
+        return self._derived[name]
+
+def load_registry(path: str) -> RegistrySnapshot:
+    """
+    Read and validate a registry file. Raises on a missing, malformed or invalid file.
+    """
+    with open(path, "rb") as f:
+        raw = f.read()
+    if path.endswith((".yaml", ".yml")):
+        try:
+            import yaml
+        except ImportError:
+            raise RuntimeError("A YAML MODEL_REGISTRY_PATH requires the 'PyYAML' package (pip install pyyaml)")
+        data = yaml.safe_load(raw)
+    else:
+        data = json.loads(raw)
+    config = RegistryConfig.model_validate(data)
+    return RegistrySnapshot(config, hashlib.sha256(raw).hexdigest()[:16])
+
+class ModelRegistry:
+    """
+    Holds the current registry snapshot and swaps in a new one when the file
+    changes. A file that fails validation is reported in `stats` and the
+    running snapshot is kept.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._mtime = os.path.getmtime(path)
+        # An invalid registry at startup is fatal, like any other bad configuration
+        self.current = load_registry(path)
+        self.reloads = 0
+        self.last_error: Optional[str] = None
+        self._task = None
+        self._listeners: List[Callable[[RegistrySnapshot], None]] = []
+
+    def subscribe(self, listener: Callable[[RegistrySnapshot], None]) -> None:
+        """
+        Call `listener(snapshot)` with every new snapshot just before it is
+        swapped in, e.g. to precompute responses. A listener that raises
+        rejects the snapshot like a validation error.
+        """
+        self._listeners.append(listener)
+
+    def reload(self) -> bool:
+        """
+        Load the file again; returns True when a changed registry was swapped in.
+        """
+        self._mtime = os.path.getmtime(self.path)
+        snapshot = load_registry(self.path)
+        self.last_error = None
+        if snapshot.version == self.current.version:
+            return False
+        # Listeners run first, so whatever they precompute is ready at the swap
+        for listener in self._listeners:
+            listener(snapshot)
+        # A single reference assignment: readers see the old or the new snapshot, never a mix
+        self.current = snapshot
+        self.reloads += 1
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(MODEL_REGISTRY_RELOAD_SECONDS)
+            try:
+                if os.path.getmtime(self.path) != self._mtime:
+                    self.reload()
+            except Exception as e:
+                self.last_error = str(e)
+
+    def start(self) -> None:
+        if MODEL_REGISTRY_RELOAD_SECONDS > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "version": self.current.version,
+            "loaded_at": self.current.loaded_at,
+            "models": {"image": len(self.current.image), "video": len(self.current.video), "tts": len(self.current.tts)},
+            "reloads": self.reloads,
+            "hot_reload": self._task is not None and not self._task.done(),
+            "last_error": self.last_error
+        }
+
+model_registry = ModelRegistry(MODEL_REGISTRY_PATH)
+
+class RegistryView(Mapping):
+    """
+    Read-only mapping of one modality's models in whatever snapshot is current,
+    so `MODEL_REGISTRY[name]` keeps working across reloads.
+    """
+    def __init__(self, modality: str):
+        self.modality = modality
+
+    def _models(self) -> Dict[str, dict]:
+        return getattr(model_registry.current, self.modality)
+
+    def __getitem__(self, name: str) -> dict:
+        return self._models()[name]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._models())
+
+    def __len__(self) -> int:
+        return len(self._models())
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._models()
+
+def build_model_input(model_config: dict, request: BaseModel, default_fields: List[str], input_data: dict) -> dict:
+    """
+    Add a model's optional inputs to `input_data`: every request field in its
+    `inputs` mapping (or `default_fields`, when it has none) that was given,
+    under the model's own input name, then its fixed `defaults`.
+    """
+    mapping = model_config.get("inputs")
+    if mapping is None:
+        mapping = {field: field for field in default_fields}
+    for field, input_name in mapping.items():
+        value = getattr(request, field, None)
+        if value is not None and value != "" and value != []:
+            input_data[input_name] = value
+    for input_name, value in model_config.get("defaults", {}).items():
+        input_data.setdefault(input_name, value)
+    return input_data
@@ -0,0 +1,200 @@
+import os
+import time
+import asyncio
+from collections import deque
+from contextlib import contextmanager
+from pydantic import BaseModel
+from typing import Optional, List, Dict, Any, Awaitable, Callable, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- CONFIGURATION ---
+# Latency samples kept per model for its p90
+ROUTING_WINDOW = int(os.getenv("ROUTING_WINDOW", "200"))
+# Samples needed before a model's own p90 replaces the default estimate
+ROUTING_MIN_SAMPLES = int(os.getenv("ROUTING_MIN_SAMPLES", "10"))
+# Latency assumed for a model that has not been measured yet
+ROUTING_DEFAULT_LATENCY_SECONDS = float(os.getenv("ROUTING_DEFAULT_LATENCY_SECONDS", "15"))
+# Models failing more often than this are only picked when nothing else qualifies
+ROUTING_MAX_FAILURE_RATE = float(os.getenv("ROUTING_MAX_FAILURE_RATE", "0.5"))
+# Cheap model launched as a backup when a routed model runs past its p90
+ROUTING_HEDGE_MODEL = os.getenv("ROUTING_HEDGE_MODEL", "sdxl-lightning")
+
+# Weight of the newest call in the failure-rate average
+FAILURE_EWMA_ALPHA = 0.1
+
+class RouteOptions(BaseModel):
+    """
+    Let the server pick the models: the fastest `best_n` whose summed price fits
+    `max_cost_usd` and whose p90 latency is under `latency_target_seconds`.
+    """
+    max_cost_usd: Optional[float] = None  # Budget for the whole request
+    latency_target_seconds: Optional[float] = None
+    best_n: int = 1
+    hedge: bool = True  # Race a cheap backup model once a pick runs past its p90
+
+class ModelLatency:
+    """
+    Rolling latency samples and failure rate of one model.
+
+    Each model has its own instance, and it is only touched from the event loop
+    with no await between reading and writing, so it needs no lock. The p90 is
+    recomputed lazily, at most once per new sample.
+    """
+    def __init__(self):
+        self.samples = deque(maxlen=ROUTING_WINDOW)
+        self.failure_rate = 0.0
+        self.calls = 0
+        self._p90: Optional[float] = None
+        self._stale = False
+
+    def record(self, seconds: float, ok: bool) -> None:
+        self.calls += 1
+        self.failure_rate += FAILURE_EWMA_ALPHA * ((0.0 if ok else 1.0) - self.failure_rate)
+        if ok:
+            self.samples.append(seconds)
+            self._stale = True
+
+    def p90(self) -> Optional[float]:
+        if len(self.samples) < ROUTING_MIN_SAMPLES:
+            return None
+        if self._stale:
+            ordered = sorted(self.samples)
+            self._p90 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))]
+            self._stale = False
+        return self._p90
+
+    def expected_latency(self) -> float:
+        p90 = self.p90()
+        return ROUTING_DEFAULT_LATENCY_SECONDS if p90 is None else p90
+
+    def stats(self) -> Dict[str, Any]:
+        p90 = self.p90()
+        return {
+            "calls": self.calls,
+            "samples": len(self.samples),
+            "p90_ms": round(p90 * 1000, 1) if p90 is not None else None,
+            "failure_rate": round(self.failure_rate, 4)
+        }
+
+_latencies: Dict[str, ModelLatency] = {}
+_hedges = {"launched": 0, "won": 0}
+
+def model_latency(model_name: str) -> ModelLatency:
+    latency = _latencies.get(model_name)
+    if latency is None:
+        latency = _latencies[model_name] = ModelLatency()
+    return latency
+
+def record_model_call(model_name: str, seconds: float, ok: bool) -> None:
+    model_latency(model_name).record(seconds, ok)
+
+def routing_stats() -> Dict[str, Any]:
+    return {
+        "models": {name: l.stats() for name, l in sorted(_latencies.items())},
+        "hedges": dict(_hedges)
+    }
+
+def _units(usd: float) -> int:
+    # Compare prices in USDC units so float sums never nudge a pick over budget
+    return round(usd * 10**6)
+
+def choose_models(costs: Dict[str, float], route: RouteOptions) -> List[str]:
+    """
+    Pick models for a routed request from `costs` (model name -> price in USD).
+
+    Candidates are ranked by p90 latency (inflated by their failure rate), then by
+    price, and taken greedily while they fit the budget. Raises ValueError when
+    no model qualifies.
+    """
+    if route.best_n < 1:
+        raise ValueError("route.best_n must be at least 1")
+
+    healthy, unhealthy = [], []
+    for name, cost in costs.items():
+        latency = model_latency(name)
+        estimate = latency.expected_latency()
+        if route.latency_target_seconds is not None and estimate > route.latency_target_seconds:
+            continue
+        rank = (estimate * (1 + latency.failure_rate), cost, name)
+        (unhealthy if latency.failure_rate > ROUTING_MAX_FAILURE_RATE else healthy).append(rank)
+
+    budget = None if route.max_cost_usd is None else _units(route.max_cost_usd)
+    chosen, spent = [], 0
+    for _, cost, name in sorted(healthy) + sorted(unhealthy):
+        if budget is not None and spent + _units(cost) > budget:
+            continue
+        chosen.append(name)
+        spent += _units(cost)
+        if len(chosen) == route.best_n:
+            break
+
+    if not chosen:
+        raise ValueError("No model fits the budget and latency target")
+    return chosen
+
+def hedge_plan(model_name: str, costs: Dict[str, float], route: Optional[RouteOptions]) -> Optional[Tuple[str, float]]:
+    """
+    (backup model, delay in seconds) for a routed model, or None when it should
+    not be hedged. The backup must be cheaper, so hedging never costs the payer more.
+    """
+    backup = ROUTING_HEDGE_MODEL
+    if route is None or not route.hedge or backup == model_name or backup not in costs:
+        return None
+    if costs[backup] >= costs.get(model_name, 0.0):
+        return None
+    delay = model_latency(model_name).p90() or route.latency_target_seconds
+    if delay is None:
+        return None
+    return backup, delay
+
+async def hedged(
+    primary: Callable[[], Awaitable[Any]],
+    backup: Callable[[], Awaitable[Any]],
+    delay: float
+) -> Tuple[Any, bool]:
+    """
+    Run `primary()`; if it has not succeeded after `delay` seconds (or fails
+    sooner), start `backup()` as well. Returns (first successful result, whether
+    it came from the backup). The slower call is cancelled; if both fail, the
+    primary's error is raised.
+    """
+    primary_task = asyncio.ensure_future(primary())
+    tasks = {primary_task: False}
+    try:
+        done, _ = await asyncio.wait({primary_task}, timeout=delay)
+        if done and primary_task.exception() is None:
+            return primary_task.result(), False
+
+        tasks[asyncio.ensure_future(backup())] = True
+        _hedges["launched"] += 1
+        pending = {task for task in tasks if not task.done()}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if tasks[task]:
+                        _hedges["won"] += 1
+                    return task.result(), tasks[task]
+        raise primary_task.exception()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+@contextmanager
+def recorded_call(model_name: str):
+    """
+    Record how long a model call took, and whether it failed, into its rolling stats.
+    Cancelled calls (a lost hedge, a client gone) are not recorded.
+    """
+    started = time.monotonic()
+    try:
+        yield
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        record_model_call(model_name, time.monotonic() - started, ok=False)
+        raise
+    record_model_call(model_name, time.monotonic() - started, ok=True)
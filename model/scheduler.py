@@ -0,0 +1,244 @@
+import os
+import time
+import heapq
+import random
+import asyncio
+import itertools
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from dotenv import load_dotenv
+from model.metrics import REPLICATE_QUEUE_SECONDS, REPLICATE_RUN_SECONDS, add_timing
+
+load_dotenv()
+
+# --- CONFIGURATION ---
+# Token bucket per model: sustained calls per second and burst size
+REPLICATE_MODEL_RATE_PER_SECOND = float(os.getenv("REPLICATE_MODEL_RATE_PER_SECOND", "5"))
+REPLICATE_MODEL_BURST = float(os.getenv("REPLICATE_MODEL_BURST", "10"))
+# Adaptive concurrency window per model (AIMD)
+REPLICATE_MODEL_MIN_CONCURRENCY = int(os.getenv("REPLICATE_MODEL_MIN_CONCURRENCY", "1"))
+REPLICATE_MODEL_INITIAL_CONCURRENCY = int(os.getenv("REPLICATE_MODEL_INITIAL_CONCURRENCY", "4"))
+REPLICATE_MODEL_MAX_CONCURRENCY = int(os.getenv("REPLICATE_MODEL_MAX_CONCURRENCY", "16"))
+# A call slower than this multiple of the model's typical latency shrinks its window
+REPLICATE_LATENCY_BACKOFF_FACTOR = float(os.getenv("REPLICATE_LATENCY_BACKOFF_FACTOR", "3"))
+# Retries after a 429, with full-jitter exponential backoff
+REPLICATE_MAX_RETRIES = int(os.getenv("REPLICATE_MAX_RETRIES", "4"))
+REPLICATE_RETRY_BASE_SECONDS = float(os.getenv("REPLICATE_RETRY_BASE_SECONDS", "0.5"))
+REPLICATE_RETRY_MAX_SECONDS = float(os.getenv("REPLICATE_RETRY_MAX_SECONDS", "20"))
+# Seconds one admitted call may run before it is reported as an error; time spent
+# queued for a slot or backing off after a 429 does not count
+MODEL_TIMEOUT_SECONDS = float(os.getenv("REPLICATE_MODEL_TIMEOUT_SECONDS", "120"))
+
+# Lower runs first
+PRIORITY_INTERACTIVE = 0
+
+# Weight of the newest sample in the latency average
+LATENCY_EWMA_ALPHA = 0.2
+
+def is_rate_limited(error: Exception) -> bool:
+    """
+    True for a Replicate (or raw HTTP) 429 Too Many Requests.
+    """
+    status = getattr(error, "status", None)
+    response = getattr(error, "response", None)
+    if status is None and response is not None:
+        status = getattr(response, "status_code", None)
+    if status == 429:
+        return True
+    message = str(error).lower()
+    return "throttled" in message or "rate limit" in message or "too many requests" in message
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    # Honor a Retry-After header when the error carries the response
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+class ModelTimeoutError(TimeoutError):
+    pass
+
+class ModelScheduler:
+    """
+    Admission control for one model: a priority queue in front of an adaptive
+    concurrency window, and a token bucket on call starts.
+
+    The window grows by about one slot per window's worth of successful calls
+    and halves on a 429; a call far slower than usual (cold start, overload)
+    shrinks it by a quarter. Callers over the window wait in priority order
+    rather than failing.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        # Metrics label: the model without its version hash, e.g. "owner/model (create)"
+        ref, _, suffix = name.partition(" ")
+        self.label = ref.split(":", 1)[0] + (" " + suffix if suffix else "")
+        self.window = float(REPLICATE_MODEL_INITIAL_CONCURRENCY)
+        self.active = 0
+        self._waiters: List[tuple] = []  # (priority, seq, future) heap
+        self._seq = itertools.count()
+        self._tokens = REPLICATE_MODEL_BURST
+        self._refilled_at = time.monotonic()
+        self.latency_ewma: Optional[float] = None
+        self.calls = 0
+        self.throttled = 0
+        self.retries = 0
+
+    def _limit(self) -> int:
+        return max(REPLICATE_MODEL_MIN_CONCURRENCY, int(self.window))
+
+    async def _acquire_slot(self, priority: int) -> None:
+        if self.active < self._limit() and not self._waiters:
+            self.active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        # Entries of cancelled waiters may be all that is queued; let them be skipped
+        self._wake()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we were cancelled; pass it on
+                self._release_slot()
+            else:
+                future.cancel()
+            raise
+
+    def _release_slot(self) -> None:
+        self.active -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self.active < self._limit():
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self.active += 1
+            future.set_result(None)
+
+    async def _take_token(self) -> None:
+        while True:
+            now = time.monotonic()
+            self._tokens = min(
+                REPLICATE_MODEL_BURST,
+                self._tokens + (now - self._refilled_at) * REPLICATE_MODEL_RATE_PER_SECOND
+            )
+            self._refilled_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / REPLICATE_MODEL_RATE_PER_SECOND)
+
+    def _on_success(self, latency: float) -> None:
+        if self.latency_ewma is not None and latency > REPLICATE_LATENCY_BACKOFF_FACTOR * self.latency_ewma:
+            self.window = max(REPLICATE_MODEL_MIN_CONCURRENCY, self.window * 0.75)
+        else:
+            self.window = min(REPLICATE_MODEL_MAX_CONCURRENCY, self.window + 1 / self.window)
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma += LATENCY_EWMA_ALPHA * (latency - self.latency_ewma)
+        self._wake()
+
+    def _on_throttled(self) -> None:
+        self.throttled += 1
+        self.window = max(REPLICATE_MODEL_MIN_CONCURRENCY, self.window / 2)
+        # Stop starting new calls until the bucket refills
+        self._tokens = min(self._tokens, 0.0)
+
+    def _observe_queue(self, seconds: float) -> None:
+        REPLICATE_QUEUE_SECONDS.labels(model=self.label).observe(seconds)
+        add_timing("replicate_queue", seconds)
+
+    def _observe_run(self, seconds: float, outcome: str) -> None:
+        REPLICATE_RUN_SECONDS.labels(model=self.label, outcome=outcome).observe(seconds)
+        add_timing("replicate_run", seconds)
+
+    def _on_timeout(self) -> None:
+        # A call that never finished is the slowest kind; shrink like one
+        self.window = max(REPLICATE_MODEL_MIN_CONCURRENCY, self.window * 0.75)
+
+    async def run(
+        self,
+        call: Callable[[], Awaitable[Any]],
+        priority: int = PRIORITY_INTERACTIVE,
+        timeout: Optional[float] = None
+    ) -> Any:
+        """
+        Run `call()` once admitted, retrying 429s with jittered backoff.
+        Each attempt may run for `timeout` seconds (default MODEL_TIMEOUT_SECONDS),
+        counted from when it was admitted.
+        """
+        if timeout is None:
+            timeout = MODEL_TIMEOUT_SECONDS
+        attempt = 0
+        while True:
+            queued_at = time.monotonic()
+            await self._acquire_slot(priority)
+            retry_delay = None
+            try:
+                await self._take_token()
+                self.calls += 1
+                started = time.monotonic()
+                self._observe_queue(started - queued_at)
+                try:
+                    result = await asyncio.wait_for(call(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    self._observe_run(time.monotonic() - started, "timeout")
+                    self._on_timeout()
+                    raise ModelTimeoutError(f"Model timed out after {timeout:g} seconds")
+                except Exception as e:
+                    self._observe_run(time.monotonic() - started, "throttled" if is_rate_limited(e) else "error")
+                    if not is_rate_limited(e):
+                        raise
+                    self._on_throttled()
+                    if attempt >= REPLICATE_MAX_RETRIES:
+                        raise
+                    backoff = min(REPLICATE_RETRY_MAX_SECONDS, REPLICATE_RETRY_BASE_SECONDS * 2 ** attempt)
+                    retry_delay = max(retry_after_seconds(e) or 0.0, random.uniform(0, backoff))
+                else:
+                    latency = time.monotonic() - started
+                    self._observe_run(latency, "ok")
+                    self._on_success(latency)
+                    return result
+            finally:
+                self._release_slot()
+            # Back off outside the window so other callers keep its slot
+            attempt += 1
+            self.retries += 1
+            await asyncio.sleep(retry_delay)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "window": round(self.window, 2),
+            "active": self.active,
+            "queued": sum(1 for _, _, f in self._waiters if not f.done()),
+            "latency_ewma_ms": round(self.latency_ewma * 1000, 1) if self.latency_ewma is not None else None,
+            "calls": self.calls,
+            "throttled": self.throttled,
+            "retries": self.retries
+        }
+
+_schedulers: Dict[str, ModelScheduler] = {}
+
+def scheduler_for(model_ref: str) -> ModelScheduler:
+    scheduler = _schedulers.get(model_ref)
+    if scheduler is None:
+        scheduler = _schedulers[model_ref] = ModelScheduler(model_ref)
+    return scheduler
+
+async def scheduled(
+    model_ref: str,
+    call: Callable[[], Awaitable[Any]],
+    priority: int = PRIORITY_INTERACTIVE,
+    timeout: Optional[float] = None
+) -> Any:
+    """
+    Run a Replicate call for `model_ref` through that model's scheduler.
+    """
+    return await scheduler_for(model_ref).run(call, priority, timeout)
+
+def scheduler_stats() -> Dict[str, Any]:
+    return {name: s.stats() for name, s in sorted(_schedulers.items())}
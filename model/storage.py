@@ -0,0 +1,495 @@
+import os
+import re
+import time
+import uuid
+import asyncio
+import logging
+import hashlib
+import mimetypes
+from contextvars import ContextVar
+from typing import Optional, List, AsyncIterator
+from urllib.parse import urlparse
+import httpx
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+from model.fanout import run_blocking, LazySemaphore
+from model.metrics import POSTPROCESS_SECONDS, timed
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# The directory main.py lives in; relative paths below are resolved against it,
+# not against wherever the server was started
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# --- CONFIGURATION ---
+# "off" returns Replicate delivery URLs as-is; "local" or "s3" copies outputs to storage we own
+OUTPUT_MIRROR_BACKEND = os.getenv("OUTPUT_MIRROR", "off")
+# Downloads running at once across the process
+OUTPUT_MIRROR_CONCURRENCY = int(os.getenv("OUTPUT_MIRROR_CONCURRENCY", "8"))
+# Bytes read from the source and written to storage per step
+OUTPUT_MIRROR_CHUNK_BYTES = int(os.getenv("OUTPUT_MIRROR_CHUNK_BYTES", str(1024 * 1024)))
+OUTPUT_MIRROR_TIMEOUT_SECONDS = float(os.getenv("OUTPUT_MIRROR_TIMEOUT_SECONDS", "120"))
+# Local backend (and files this server makes, such as stitched TTS audio, when
+# the mirror is off): files live here and are served by GET /media/{key}
+OUTPUT_MIRROR_DIR = os.path.join(APP_ROOT, os.getenv("OUTPUT_MIRROR_DIR", "media"))
+# Local files older than this are deleted (0 keeps them for good)
+OUTPUT_MIRROR_MAX_AGE_SECONDS = float(os.getenv("OUTPUT_MIRROR_MAX_AGE_SECONDS", str(7 * 24 * 3600)))
+# Above this total size the oldest local files are deleted first (0 for no limit)
+OUTPUT_MIRROR_MAX_BYTES = int(os.getenv("OUTPUT_MIRROR_MAX_BYTES", str(10 * 1024**3)))
+OUTPUT_MIRROR_SWEEP_SECONDS = float(os.getenv("OUTPUT_MIRROR_SWEEP_SECONDS", "3600"))
+# Prefix for returned URLs; for "local" defaults to PUBLIC_BASE_URL + "/media".
+# Without PUBLIC_BASE_URL it is relative, and URLs made while serving a request
+# are completed with that request's own scheme and host
+OUTPUT_MIRROR_BASE_URL = os.getenv(
+    "OUTPUT_MIRROR_BASE_URL",
+    os.getenv("PUBLIC_BASE_URL", "").rstrip("/") + "/media"
+).rstrip("/")
+# S3 backend (AWS, or any S3-compatible server such as MinIO via S3_ENDPOINT_URL)
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+S3_REGION = os.getenv("S3_REGION") or None
+# Multipart part size; S3 requires at least 5 MiB for every part but the last
+S3_PART_BYTES = max(int(os.getenv("S3_PART_BYTES", str(8 * 1024 * 1024))), 5 * 1024 * 1024)
+
+# Mirrored objects never change, so clients and CDNs may keep them for good
+MEDIA_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# "<sha256>[-<variant>][.<ext>]", e.g. a mirrored output or one of its previews
+_KEY_PATTERN = re.compile(r"^[0-9a-f]{64}(-[a-z]{1,16})?(\.[a-z0-9]{1,8})?$")
+
+# "scheme://host" of the request being served, for completing relative media URLs
+_request_origin: ContextVar[str] = ContextVar("request_origin", default="")
+
+def set_request_origin(base_url: str) -> None:
+    _request_origin.set(base_url.rstrip("/"))
+
+def media_key(source_url: str) -> str:
+    """
+    Storage key for a model output: a hash of its source URL plus the file extension.
+    Replicate delivery URLs are unique per output, so a key is written at most once.
+    """
+    digest = hashlib.sha256(source_url.encode("utf-8")).hexdigest()
+    ext = os.path.splitext(urlparse(source_url).path)[1].lower()
+    if not re.fullmatch(r"\.[a-z0-9]{1,8}", ext):
+        ext = ""
+    return digest + ext
+
+def content_type_for(key: str) -> str:
+    return mimetypes.guess_type(key)[0] or "application/octet-stream"
+
+class OutputStorage:
+    """
+    Interface for a mirror backend. `store` consumes an async iterator of chunks,
+    so no backend ever holds a whole file in memory.
+    """
+    async def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    async def store(self, key: str, chunks: AsyncIterator[bytes]) -> None:
+        raise NotImplementedError
+
+    def url(self, key: str) -> str:
+        raise NotImplementedError
+
+class LocalOutputStorage(OutputStorage):
+    """
+    Files on local disk, served with range support by `media_response`.
+    """
+    def __init__(self, directory: str, base_url: str):
+        self.directory = directory
+        self.base_url = base_url
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    async def exists(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    async def store(self, key: str, chunks: AsyncIterator[bytes]) -> None:
+        # Write to a temp name and rename, so readers never see a partial file
+        tmp_path = f"{self.path(key)}.{uuid.uuid4().hex}.part"
+        f = await run_blocking(open, tmp_path, "wb")
+        try:
+            async for chunk in chunks:
+                await run_blocking(f.write, chunk)
+            await run_blocking(f.close)
+            os.replace(tmp_path, self.path(key))
+        except BaseException:
+            f.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def url(self, key: str) -> str:
+        url = f"{self.base_url}/{key}"
+        # A relative base (no PUBLIC_BASE_URL) is completed from the current request
+        return _request_origin.get() + url if url.startswith("/") else url
+
+    def key_for(self, url: str) -> Optional[str]:
+        """
+        The key of a URL this storage handed out, or None.
+        """
+        if self.base_url.startswith("/"):
+            origin = _request_origin.get()
+            if origin and url.startswith(origin + "/"):
+                url = url[len(origin):]
+        prefix = self.base_url + "/"
+        if not url.startswith(prefix):
+            return None
+        key = url[len(prefix):]
+        return key if _KEY_PATTERN.match(key) else None
+
+    def sweep(self, max_age_seconds: float, max_bytes: int) -> int:
+        """
+        Delete files older than `max_age_seconds`, then the oldest files until
+        the rest fit in `max_bytes` (0 disables either limit). Returns the count.
+        """
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        files.sort()
+        cutoff = time.time() - max_age_seconds if max_age_seconds > 0 else None
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for mtime, size, path in files:
+            too_old = cutoff is not None and mtime < cutoff
+            too_big = max_bytes > 0 and total > max_bytes
+            if not (too_old or too_big):
+                # Sorted oldest first: nothing later is older or needs to go for size
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+class S3OutputStorage(OutputStorage):
+    """
+    Objects in an S3-compatible bucket, uploaded part by part with multipart upload.
+    Needs the optional `boto3` package. Range requests are served by the bucket.
+    """
+    def __init__(self, bucket: str, endpoint_url: Optional[str], region: Optional[str], base_url: Optional[str]):
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("OUTPUT_MIRROR=s3 requires the 'boto3' package (pip install boto3)")
+        if not bucket:
+            raise RuntimeError("OUTPUT_MIRROR=s3 requires S3_BUCKET")
+        self.bucket = bucket
+        self._client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+        if base_url:
+            self.base_url = base_url
+        elif endpoint_url:
+            self.base_url = f"{endpoint_url.rstrip('/')}/{bucket}"
+        else:
+            self.base_url = f"https://{bucket}.s3.amazonaws.com"
+
+    def _exists(self, key: str) -> bool:
+        try:
+            self._client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except Exception:
+            return False
+
+    async def exists(self, key: str) -> bool:
+        return await run_blocking(self._exists, key)
+
+    async def store(self, key: str, chunks: AsyncIterator[bytes]) -> None:
+        upload = await run_blocking(lambda: self._client.create_multipart_upload(
+            Bucket=self.bucket, Key=key, ContentType=content_type_for(key), CacheControl=MEDIA_CACHE_CONTROL
+        ))
+        upload_id = upload["UploadId"]
+        parts = []
+
+        def upload_part(body: bytes) -> None:
+            part_number = len(parts) + 1
+            part = self._client.upload_part(
+                Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=part_number, Body=body
+            )
+            parts.append({"ETag": part["ETag"], "PartNumber": part_number})
+
+        try:
+            # Only one part is buffered at a time
+            buffer = bytearray()
+            async for chunk in chunks:
+                buffer += chunk
+                if len(buffer) >= S3_PART_BYTES:
+                    await run_blocking(upload_part, bytes(buffer))
+                    buffer.clear()
+            if buffer or not parts:
+                await run_blocking(upload_part, bytes(buffer))
+            await run_blocking(lambda: self._client.complete_multipart_upload(
+                Bucket=self.bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+            ))
+        except BaseException:
+            await run_blocking(lambda: self._client.abort_multipart_upload(
+                Bucket=self.bucket, Key=key, UploadId=upload_id
+            ))
+            raise
+
+    def url(self, key: str) -> str:
+        return f"{self.base_url}/{key}"
+
+def create_output_storage() -> Optional[OutputStorage]:
+    if OUTPUT_MIRROR_BACKEND == "off":
+        return None
+    if OUTPUT_MIRROR_BACKEND == "local":
+        return LocalOutputStorage(OUTPUT_MIRROR_DIR, OUTPUT_MIRROR_BASE_URL)
+    if OUTPUT_MIRROR_BACKEND == "s3":
+        return S3OutputStorage(S3_BUCKET, S3_ENDPOINT_URL, S3_REGION, os.getenv("OUTPUT_MIRROR_BASE_URL"))
+    raise ValueError(f"Unknown OUTPUT_MIRROR backend '{OUTPUT_MIRROR_BACKEND}'. Use 'off', 'local' or 's3'.")
+
+output_storage = create_output_storage()
+
+# Files the app makes itself (stitched TTS audio) need a home even with the
+# mirror off; they then go to local disk and are served by GET /media/{key}
+_hosted_fallback: Optional[LocalOutputStorage] = None
+
+def hosted_storage() -> OutputStorage:
+    """
+    Storage for files produced by this server: the mirror backend if one is
+    configured, otherwise local disk under OUTPUT_MIRROR_DIR.
+    """
+    global _hosted_fallback
+    if output_storage is not None:
+        return output_storage
+    if _hosted_fallback is None:
+        _hosted_fallback = LocalOutputStorage(OUTPUT_MIRROR_DIR, OUTPUT_MIRROR_BASE_URL)
+    return _hosted_fallback
+
+def _local_storage() -> Optional[LocalOutputStorage]:
+    # The local directory /media serves, if any; with the mirror off it holds
+    # files made by this or an earlier run of the server
+    if isinstance(output_storage, LocalOutputStorage):
+        return output_storage
+    if output_storage is None:
+        return hosted_storage()
+    return None
+
+async def sweep_local_media() -> int:
+    """
+    Apply OUTPUT_MIRROR_MAX_AGE_SECONDS and OUTPUT_MIRROR_MAX_BYTES to the
+    local media directory. S3 buckets expire objects with lifecycle rules instead.
+    """
+    local = _local_storage()
+    if local is None:
+        return 0
+    removed = await run_blocking(local.sweep, OUTPUT_MIRROR_MAX_AGE_SECONDS, OUTPUT_MIRROR_MAX_BYTES)
+    if removed:
+        logger.info("Deleted %d old media files from %s", removed, local.directory)
+    return removed
+
+_sweep_task: Optional[asyncio.Task] = None
+
+async def _sweep_periodically() -> None:
+    while True:
+        try:
+            await sweep_local_media()
+        except Exception:
+            logger.exception("Sweeping %s failed", OUTPUT_MIRROR_DIR)
+        await asyncio.sleep(OUTPUT_MIRROR_SWEEP_SECONDS)
+
+def start_media_sweeper() -> None:
+    global _sweep_task
+    if _local_storage() is None:
+        return
+    if OUTPUT_MIRROR_BASE_URL.startswith("/"):
+        logger.warning(
+            "PUBLIC_BASE_URL is not set: media URLs made outside a request (video jobs) will be relative"
+        )
+    if OUTPUT_MIRROR_SWEEP_SECONDS > 0 and (_sweep_task is None or _sweep_task.done()):
+        _sweep_task = asyncio.create_task(_sweep_periodically())
+
+async def stop_media_sweeper() -> None:
+    global _sweep_task
+    if _sweep_task is not None:
+        _sweep_task.cancel()
+        try:
+            await _sweep_task
+        except asyncio.CancelledError:
+            pass
+        _sweep_task = None
+
+_download_semaphore = LazySemaphore(OUTPUT_MIRROR_CONCURRENCY)
+_http_client: Optional[httpx.AsyncClient] = None
+
+def _client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            timeout=OUTPUT_MIRROR_TIMEOUT_SECONDS,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=OUTPUT_MIRROR_CONCURRENCY)
+        )
+    return _http_client
+
+async def close_output_mirror() -> None:
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+async def mirror_url(source_url: str) -> str:
+    """
+    Copy one output into storage and return its stable URL.
+    Falls back to the source URL if the copy fails.
+    """
+    if output_storage is None or not source_url.startswith(("http://", "https://")):
+        return source_url
+
+    key = media_key(source_url)
+    try:
+        if await output_storage.exists(key):
+            return output_storage.url(key)
+        async with _download_semaphore:
+            async with _client().stream("GET", source_url) as response:
+                response.raise_for_status()
+                await output_storage.store(key, response.aiter_bytes(OUTPUT_MIRROR_CHUNK_BYTES))
+        return output_storage.url(key)
+    except Exception:
+        return source_url
+
+async def iter_url_bytes(url: str) -> AsyncIterator[bytes]:
+    """
+    The bytes behind a URL in chunks: read from disk for locally mirrored
+    outputs, otherwise streamed over HTTP.
+    """
+    path = local_path(url)
+    if path is not None:
+        async for chunk in _file_chunks(path):
+            yield chunk
+        return
+    async with _client().stream("GET", url) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes(OUTPUT_MIRROR_CHUNK_BYTES):
+            yield chunk
+
+async def download_to_file(source_url: str, path: str) -> None:
+    """
+    Stream a URL to a local file in chunks, within the shared download limit.
+    """
+    await write_file(path, _limited(iter_url_bytes(source_url)))
+
+async def _limited(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    async with _download_semaphore:
+        async for chunk in chunks:
+            yield chunk
+
+async def write_file(path: str, chunks: AsyncIterator[bytes]) -> None:
+    """
+    Write chunks to a local file without blocking the event loop.
+    """
+    f = await run_blocking(open, path, "wb")
+    try:
+        async for chunk in chunks:
+            await run_blocking(f.write, chunk)
+    finally:
+        await run_blocking(f.close)
+
+def local_path(url: str) -> Optional[str]:
+    """
+    Path of a URL this server mirrored to local disk, or None.
+    """
+    local = _local_storage()
+    key = local.key_for(url) if local is not None else None
+    if key is None:
+        return None
+    path = local.path(key)
+    return path if os.path.exists(path) else None
+
+async def _file_chunks(path: str) -> AsyncIterator[bytes]:
+    with open(path, "rb") as f:
+        while True:
+            chunk = await run_blocking(f.read, OUTPUT_MIRROR_CHUNK_BYTES)
+            if not chunk:
+                return
+            yield chunk
+
+async def store_file(key: str, path: str) -> str:
+    """
+    Upload a local file to the configured storage (see `hosted_storage`) and return its URL.
+    """
+    storage = hosted_storage()
+    await storage.store(key, _file_chunks(path))
+    return storage.url(key)
+
+async def mirror_urls(urls: List[str]) -> List[str]:
+    """
+    Mirror every output URL of a successful prediction (in order).
+    """
+    if output_storage is None:
+        return urls
+    with timed("mirror", POSTPROCESS_SECONDS, stage="mirror"):
+        return list(await asyncio.gather(*(mirror_url(url) for url in urls)))
+
+def _parse_range(range_header: Optional[str], size: int) -> Optional[tuple]:
+    # Single "bytes=start-end" ranges only; anything else is served in full.
+    # Only a valid range that starts past the end is refused with 416.
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", (range_header or "").strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    if match.group(1) == "":
+        start, end = max(size - int(match.group(2)), 0), size - 1
+    else:
+        start = int(match.group(1))
+        if match.group(2) and int(match.group(2)) < start:
+            # A last position before the first makes the header invalid, and
+            # an invalid Range is ignored rather than refused (RFC 9110 14.2)
+            return None
+        end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+    if start > end or start >= size:
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+def media_response(key: str, range_header: Optional[str], if_none_match: Optional[str]) -> Response:
+    """
+    Serve a locally stored file with ETag, long-lived cache headers and byte ranges.
+    """
+    local = _local_storage()
+    if local is None or not _KEY_PATTERN.match(key):
+        raise HTTPException(status_code=404, detail="Not found")
+    path = local.path(key)
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        raise HTTPException(status_code=404, detail="Not found")
+
+    # The key is derived from the content's source, so it doubles as a strong ETag
+    etag = f'"{key}"'
+    headers = {"ETag": etag, "Cache-Control": MEDIA_CACHE_CONTROL, "Accept-Ranges": "bytes"}
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+
+    byte_range = _parse_range(range_header, size)
+    start, end = byte_range or (0, size - 1)
+    headers["Content-Length"] = str(end - start + 1)
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    def read_chunks():
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(OUTPUT_MIRROR_CHUNK_BYTES, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    return StreamingResponse(
+        read_chunks(),
+        status_code=206 if byte_range else 200,
+        media_type=content_type_for(key),
+        headers=headers
+    )
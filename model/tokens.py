@@ -0,0 +1,80 @@
+import re
+from typing import Callable, Dict
+
+# SSML tags are not spoken, so they are not billed. Only tags SSML defines (or a
+# vendor "prefix:name" extension) are stripped; other angle brackets are text,
+# as in "a < b and c > d", and are billed like any other characters. SSML is XML,
+# so tag names are case-sensitive and "<Speak>" is text too.
+_SSML_TAGS = (
+    "speak", "break", "prosody", "emphasis", "say-as", "phoneme", "sub", "audio",
+    "mark", "p", "s", "w", "voice", "lang", "lexicon", "meta", "metadata", "desc"
+)
+
+def _prefix_tree(words) -> str:
+    """
+    A regex alternation of `words` with shared prefixes factored out, e.g.
+    "p(?:h(?:oneme)|r(?:osody))?" for p, phoneme and prosody, so each "<" costs
+    one walk down the tree instead of a try of every tag name in turn.
+    """
+    by_first: Dict[str, list] = {}
+    for word in words:
+        by_first.setdefault(word[0], []).append(word[1:])
+    branches = []
+    for first, tails in sorted(by_first.items()):
+        rest = [tail for tail in tails if tail]
+        branch = re.escape(first)
+        if rest:
+            inner = re.escape(rest[0]) if len(rest) == 1 else _prefix_tree(rest)
+            branch += f"(?:{inner})" + ("?" if len(rest) < len(tails) else "")
+        branches.append(branch)
+    return "|".join(branches)
+
+# Starts with a literal "<" so the regex engine skips straight between candidates
+_MARKUP = re.compile(
+    r"<(?:\?xml[^<>]*\?"
+    r"|/?(?:" + _prefix_tree(_SSML_TAGS) + r"|[a-z][a-z0-9]*:[a-z][a-z0-9-]*)(?=[\s/>])[^<>]*)>"
+)
+
+# ASCII whitespace -> space; safe on UTF-8 since these bytes never occur inside a multi-byte character
+_WHITESPACE_TO_SPACE = bytes.maketrans(b"\t\n\x0b\x0c\r", b"     ")
+
+def normalize_text(text: str) -> str:
+    """
+    The billable form of a text: SSML tags removed and every run of whitespace
+    collapsed to a single space.
+    """
+    if "<" in text:
+        text = _MARKUP.sub(" ", text)
+    if not text.isascii():
+        text = text.replace("\u00a0", " ").replace("\u3000", " ")
+    # bytes.translate/replace are several times faster than str.split() or a regex,
+    # which keeps this within a few passes over the text even for 100 KB inputs
+    data = text.encode("utf-8").translate(_WHITESPACE_TO_SPACE)
+    while b"  " in data:
+        data = data.replace(b"  ", b" ")
+    return data.strip(b" ").decode("utf-8")
+
+def count_chars(normalized: str) -> int:
+    return len(normalized)
+
+def count_bytes(normalized: str) -> int:
+    # UTF-8 length, so multi-byte scripts cost more per character
+    return len(normalized.encode("utf-8"))
+
+def count_words(normalized: str) -> int:
+    # Normalized text has exactly one space between words
+    return normalized.count(" ") + 1 if normalized else 0
+
+# Registry entries pick one by name with "token_counter"
+TOKEN_COUNTERS: Dict[str, Callable[[str], int]] = {
+    "chars": count_chars,
+    "bytes": count_bytes,
+    "words": count_words,
+}
+
+DEFAULT_TOKEN_COUNTER = "chars"
+
+def count_tokens(normalized: str, counter: str = DEFAULT_TOKEN_COUNTER) -> int:
+    if counter not in TOKEN_COUNTERS:
+        raise ValueError(f"Unknown token counter '{counter}'. Use one of {sorted(TOKEN_COUNTERS)}.")
+    return TOKEN_COUNTERS[counter](normalized)
@@ -1,32 +1,40 @@
 import os
-import replicate
-from pydantic import BaseModel
-from typing import Optional, List
+import re
+import asyncio
+import hashlib
+import logging
+import tempfile
+from pydantic import BaseModel, PrivateAttr
+from typing import Optional, List, Dict, Any, AsyncIterator
 from dotenv import load_dotenv
+from model.fanout import run_blocking
+from model.scheduler import PRIORITY_INTERACTIVE
+from model.engine import Modality, run_model, summarize, generate_all, stream_all
+from model.storage import hosted_storage, iter_url_bytes, write_file, store_file
+from model.audio import stitch_audio, finalize_wav_file
+from model.tokens import normalize_text, count_tokens, DEFAULT_TOKEN_COUNTER
+from model.metrics import POSTPROCESS_SECONDS, timed
+from model.registry import RegistryView, build_model_input
 
 load_dotenv()
 
-# TTS Model Registry with pricing and configuration
-TTS_MODEL_REGISTRY = {
-    "minimax-speech-turbo": {
-        "identifier": "minimax/speech-02-turbo",
-        "cost_per_1000_tokens": 0.06,
-        "output_type": "single",
-        "output_format": "mp3"
-    },
-    "chatterbox": {
-        "identifier": "resemble-ai/chatterbox",
-        "cost_per_1000_tokens": 0.025,
-        "output_type": "single",
-        "output_format": "wav"
-    },
-    "kokoro-82m": {
-        "version": "jaaari/kokoro-82m:f559560eb822dc509045f3921a1921234918b91739db4bf3daab2169b71c7a13",
-        "cost_per_1000_tokens": 0.01,
-        "output_type": "single",
-        "output_format": "wav"
-    }
-}
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+# Longer text is split on sentence boundaries into chunks of at most this many characters
+TTS_CHUNK_MAX_CHARS = int(os.getenv("TTS_CHUNK_MAX_CHARS", "500"))
+# Chunks of one model synthesized at once
+TTS_CHUNK_CONCURRENCY = int(os.getenv("TTS_CHUNK_CONCURRENCY", "4"))
+# /generate-tts/stream keeps its first chunk short so audio starts sooner
+TTS_STREAM_FIRST_CHUNK_CHARS = int(os.getenv("TTS_STREAM_FIRST_CHUNK_CHARS", "150"))
+
+AUDIO_MEDIA_TYPES = {"wav": "audio/wav", "mp3": "audio/mpeg"}
+
+# End of a sentence: terminal punctuation followed by whitespace, or a line break
+_SENTENCE_END = re.compile(r"(?<=[.!?…。！？])\s+|\n+")
+
+# TTS models from the registry file (see model/registry.py); always the current version
+TTS_MODEL_REGISTRY = RegistryView("tts")
 
 class TTSRequest(BaseModel):
     text: str  # Text to convert to speech
@@ -39,31 +47,49 @@ class TTSRequest(BaseModel):
     language_boost: Optional[str] = None  # For minimax: "English", "Spanish", etc.
     english_normalization: Optional[bool] = None  # For minimax
     prompt: Optional[str] = None  # For chatterbox (uses 'prompt' instead of 'text')
+    
+    # Billing memo: normalized text and token count per counter, filled on first use
+    _normalized_text: Optional[str] = PrivateAttr(default=None)
+    _token_counts: Dict[str, int] = PrivateAttr(default_factory=dict)
+    
+    def token_count(self, counter: str = DEFAULT_TOKEN_COUNTER) -> int:
+        """
+        Billable tokens of `text` under a counter ("chars", "bytes" or "words").
+        Computed once per request, however many models or callers ask.
+        """
+        if counter not in self._token_counts:
+            if self._normalized_text is None:
+                self._normalized_text = normalize_text(self.text)
+            self._token_counts[counter] = count_tokens(self._normalized_text, counter)
+        return self._token_counts[counter]
 
 class TTSResult(BaseModel):
     model_name: str
     audio_urls: List[str]
     cost_usd: float
     tokens_used: int
+    credited_usd: float = 0.0  # Price of a failed model, credited back to the payer
     status: str  # "success" or "error"
     error_message: Optional[str] = None
 
 class TTSResponse(BaseModel):
     results: List[TTSResult]
-    total_cost_usd: float
+    total_cost_usd: float  # Charged minus credited
+    total_charged_usd: float = 0.0
+    total_credited_usd: float = 0.0
     total_models: int
     successful: int
     failed: int
     total_tokens: int
 
-def estimate_tokens(text: str) -> int:
+def count_request_tokens(model_name: str, request: TTSRequest) -> int:
     """
-    Estimate token count from text.
-    For TTS models, typically 1 character ≈ 1 token.
+    Billable tokens of a request for one model, using that model's token counter
+    on the normalized text (markup stripped, whitespace collapsed).
     """
-    return len(text)
+    return request.token_count(TTS_MODEL_REGISTRY[model_name].get("token_counter", DEFAULT_TOKEN_COUNTER))
 
-def calculate_tts_cost(model_name: str, text: str) -> tuple:
+def calculate_tts_cost(model_name: str, request: TTSRequest) -> tuple:
     """
     Calculate cost for TTS generation based on token count.
     Returns (cost_usd, token_count)
@@ -72,120 +98,233 @@ def calculate_tts_cost(model_name: str, text: str) -> tuple:
         return (0.0, 0)
     
     model_config = TTS_MODEL_REGISTRY[model_name]
-    token_count = estimate_tokens(text)
+    token_count = count_request_tokens(model_name, request)
     cost = (token_count / 1000) * model_config["cost_per_1000_tokens"]
     
     return (cost, token_count)
 
-def run_single_tts_inference(model_name: str, request: TTSRequest) -> TTSResult:
+def spoken_text(model_name: str, request: TTSRequest) -> str:
     """
-    Run inference for a single TTS model.
-    Returns TTSResult with success/error status.
+    The text a model will speak: the first non-empty request field of its
+    `text_fields` (chatterbox prefers `prompt` over `text`).
     """
-    try:
-        # Validate model selection
-        if model_name not in TTS_MODEL_REGISTRY:
-            return TTSResult(
-                model_name=model_name,
-                audio_urls=[],
-                cost_usd=0.0,
-                tokens_used=0,
-                status="error",
-                error_message=f"TTS model '{model_name}' not found"
-            )
-        
-        model_config = TTS_MODEL_REGISTRY[model_name]
-        
-        # Calculate cost based on text length
-        cost, tokens = calculate_tts_cost(model_name, request.text)
-        
-        # Build input data based on model requirements
-        input_data = {}
-        
-        # Different models use different field names
-        if model_name == "chatterbox":
-            # Chatterbox uses 'prompt' field
-            input_data["prompt"] = request.prompt if request.prompt else request.text
-        else:
-            # Most models use 'text' field
-            input_data["text"] = request.text
-        
-        # Add optional parameters for minimax
-        if model_name == "minimax-speech-turbo":
-            if request.voice_id:
-                input_data["voice_id"] = request.voice_id
-            if request.emotion:
-                input_data["emotion"] = request.emotion
-            if request.language_boost:
-                input_data["language_boost"] = request.language_boost
-            if request.english_normalization is not None:
-                input_data["english_normalization"] = request.english_normalization
-        
-        # Add voice parameter for kokoro
-        if model_name == "kokoro-82m" and request.voice:
-            input_data["voice"] = request.voice
-        
-        # Determine which identifier to use
-        model_ref = model_config.get("version") or model_config.get("identifier")
-        
-        # Run the model
-        output = replicate.run(model_ref, input=input_data)
-        
-        # Handle output (always single audio file for TTS)
-        if isinstance(output, str):
-            audio_urls = [output]
-        elif hasattr(output, 'url'):
-            url_attr = getattr(output, 'url')
-            if callable(url_attr):
-                audio_urls = [str(url_attr())]
-            else:
-                audio_urls = [str(url_attr)]
+    for field in TTS_MODEL_REGISTRY[model_name]["text_fields"]:
+        value = getattr(request, field, None)
+        if value:
+            return value
+    return request.text
+
+def build_tts_input(model_name: str, request: TTSRequest, text: str) -> dict:
+    """
+    Build the Replicate input dict for speaking `text` (the whole request text or one chunk).
+    Field names and optional parameters come from the model's registry entry.
+    """
+    model_config = TTS_MODEL_REGISTRY[model_name]
+    return build_model_input(model_config, request, [], {model_config["text_input"]: text})
+
+def split_text(text: str, max_chars: int = TTS_CHUNK_MAX_CHARS, first_max_chars: Optional[int] = None) -> List[str]:
+    """
+    Split text into chunks of at most `max_chars`, breaking between sentences.
+    A sentence longer than that is broken between words (or hard, if it has none).
+    `first_max_chars` optionally caps the first chunk lower than the rest.
+    """
+    text = text.strip()
+    first_max_chars = min(first_max_chars or max_chars, max_chars)
+    if len(text) <= first_max_chars:
+        return [text] if text else []
+    
+    pieces = []
+    for sentence in _SENTENCE_END.split(text):
+        sentence = sentence.strip()
+        while len(sentence) > (first_max_chars if not pieces else max_chars):
+            limit = first_max_chars if not pieces else max_chars
+            cut = sentence.rfind(" ", 0, limit + 1)
+            if cut <= 0:
+                cut = limit
+            pieces.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if sentence:
+            pieces.append(sentence)
+    
+    # Pack whole sentences into as few chunks as fit
+    chunks = []
+    for piece in pieces:
+        limit = first_max_chars if len(chunks) == 1 else max_chars
+        if chunks and len(chunks[-1]) + 1 + len(piece) <= limit:
+            chunks[-1] += " " + piece
         else:
-            audio_urls = [str(output)]
-        
+            chunks.append(piece)
+    return chunks
+
+async def synthesize_chunk(
+    model_name: str,
+    request: TTSRequest,
+    text: str,
+    priority: int = PRIORITY_INTERACTIVE
+) -> str:
+    """
+    Speak one chunk and return its audio URL. Each chunk is cached on its own,
+    so an edited document only re-synthesizes the chunks that changed.
+    """
+    input_data = build_tts_input(model_name, request, text)
+    
+    # Identical calls are served from the result cache (still billed per token)
+    return (await run_model(TTS_MODEL_REGISTRY[model_name], input_data, priority))[0]
+
+async def ordered_chunk_urls(model_name: str, request: TTSRequest, chunks: List[str]) -> AsyncIterator[str]:
+    """
+    Synthesize all chunks concurrently (at most TTS_CHUNK_CONCURRENCY at a time)
+    and yield their audio URLs in text order, each as soon as it and every
+    earlier chunk are done.
+    """
+    semaphore = asyncio.Semaphore(TTS_CHUNK_CONCURRENCY)
+    
+    async def run(index: int, text: str) -> str:
+        async with semaphore:
+            # Earlier chunks are heard first, so they queue ahead of later ones
+            return await synthesize_chunk(model_name, request, text, PRIORITY_INTERACTIVE + index)
+    
+    tasks = [asyncio.create_task(run(index, text)) for index, text in enumerate(chunks)]
+    try:
+        for task in tasks:
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def stitch_chunk_urls(model_name: str, chunk_urls: List[str]) -> List[str]:
+    """
+    Join chunk audio into one stored file. With the mirror off it is kept on
+    local disk and served from /media. Only if joining fails are the chunk
+    URLs returned, in order, for the client to play one after another.
+    """
+    audio_format = TTS_MODEL_REGISTRY[model_name]["output_format"]
+    if len(chunk_urls) == 1:
+        return chunk_urls
+    
+    storage = hosted_storage()
+    key = hashlib.sha256("\n".join(chunk_urls).encode("utf-8")).hexdigest() + "." + audio_format
+    if await storage.exists(key):
+        return [storage.url(key)]
+    
+    async def segments():
+        for url in chunk_urls:
+            yield iter_url_bytes(url)
+    
+    fd, path = tempfile.mkstemp(prefix="tts-", suffix="." + audio_format)
+    os.close(fd)
+    try:
+        with timed("tts_stitch", POSTPROCESS_SECONDS, stage="tts_stitch"):
+            await write_file(path, stitch_audio(audio_format, segments()))
+            if audio_format == "wav":
+                await run_blocking(finalize_wav_file, path)
+            return [await store_file(key, path)]
+    except Exception:
+        logger.exception("Stitching %d %s chunks failed; returning them separately", len(chunk_urls), model_name)
+        return chunk_urls
+    finally:
+        os.remove(path)
+
+async def stream_tts_audio(model_name: str, request: TTSRequest) -> tuple:
+    """
+    Start speaking `request` with one model for a progressive audio response.
+    Returns (media_type, async iterator of audio bytes) once the first chunk is
+    synthesized; a failure before that raises here. Later chunks are appended
+    in text order even when they finish out of order.
+    """
+    audio_format = TTS_MODEL_REGISTRY[model_name]["output_format"]
+    text = spoken_text(model_name, request)
+    chunks = split_text(text, first_max_chars=TTS_STREAM_FIRST_CHUNK_CHARS) or [text]
+    
+    chunk_urls = ordered_chunk_urls(model_name, request, chunks)
+    try:
+        first_url = await chunk_urls.__anext__()
+    except BaseException:
+        await chunk_urls.aclose()
+        raise
+    
+    async def segments():
+        yield iter_url_bytes(first_url)
+        async for url in chunk_urls:
+            yield iter_url_bytes(url)
+    
+    async def audio():
+        try:
+            # WAV goes out with open-ended sizes, which players treat as "until the end"
+            async for piece in stitch_audio(audio_format, segments()):
+                yield piece
+        finally:
+            await chunk_urls.aclose()
+    
+    return AUDIO_MEDIA_TYPES.get(audio_format, "application/octet-stream"), audio()
+
+class TTSModality(Modality):
+    """
+    Text-to-speech models, billed per token. Long text is split into sentence
+    chunks that are synthesized in parallel and stitched back into one file.
+    """
+    name = "tts"
+    label = "TTS model"
+    registry = TTS_MODEL_REGISTRY
+    response_model = TTSResponse
+    
+    def cost(self, model_name: str, request: TTSRequest) -> float:
+        return calculate_tts_cost(model_name, request)[0]
+    
+    async def generate(self, model_name: str, request: TTSRequest) -> TTSResult:
+        text = spoken_text(model_name, request)
+        chunks = split_text(text) or [text]
+        chunk_urls = [url async for url in ordered_chunk_urls(model_name, request, chunks)]
+        return await self.success_result(model_name, request, await stitch_chunk_urls(model_name, chunk_urls))
+    
+    async def success_result(self, model_name: str, request: TTSRequest, urls: List[str]) -> TTSResult:
+        # Cost from the request's (memoized) token count
+        cost, tokens = calculate_tts_cost(model_name, request)
         return TTSResult(
             model_name=model_name,
-            audio_urls=audio_urls,
+            audio_urls=urls,
             cost_usd=cost,
             tokens_used=tokens,
             status="success"
         )
-        
-    except Exception as e:
-        # Return error result if model fails
-        cost, tokens = calculate_tts_cost(model_name, request.text)
+    
+    def error_result(self, model_name: str, message: str, request: TTSRequest) -> TTSResult:
+        """
+        Build the error result for a TTS model that raised or timed out.
+        Its price is credited back rather than charged.
+        """
+        cost, tokens = calculate_tts_cost(model_name, request)
         return TTSResult(
             model_name=model_name,
             audio_urls=[],
             cost_usd=cost,
             tokens_used=tokens,
+            credited_usd=cost,
             status="error",
-            error_message=str(e)
+            error_message=message
         )
+    
+    def totals(self, results: List[TTSResult]) -> Dict[str, Any]:
+        return {"total_tokens": sum(r.tokens_used for r in results)}
+
+tts_modality = TTSModality()
 
-def run_tts_inference(request: TTSRequest) -> TTSResponse:
+def summarize_tts_results(results: List[TTSResult]) -> TTSResponse:
+    """
+    Combine per-model TTS results into a response with totals.
+    """
+    return summarize(tts_modality, results)
+
+async def run_tts_inference(request: TTSRequest) -> TTSResponse:
     """
     Handles calls to Replicate with multiple TTS model support.
-    Runs all selected models and returns combined results.
-    """
-    results = []
-    
-    # Run each model
-    for model_name in request.models:
-        result = run_single_tts_inference(model_name, request)
-        results.append(result)
-    
-    # Calculate totals
-    total_cost = sum(r.cost_usd for r in results)
-    total_tokens = sum(r.tokens_used for r in results)
-    successful = sum(1 for r in results if r.status == "success")
-    failed = sum(1 for r in results if r.status == "error")
-    
-    return TTSResponse(
-        results=results,
-        total_cost_usd=total_cost,
-        total_models=len(results),
-        successful=successful,
-        failed=failed,
-        total_tokens=total_tokens
-    )
\ No newline at end of file
+    Runs all selected models concurrently and returns combined results.
+    """
+    return await generate_all(tts_modality, request)
+
+async def stream_tts_inference(request: TTSRequest) -> AsyncIterator[TTSResult]:
+    """
+    Runs all selected TTS models concurrently and yields each result as it completes.
+    """
+    async for result in stream_all(tts_modality, request):
+        yield result
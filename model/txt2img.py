@@ -1,99 +1,22 @@
 import os
-import replicate
 from pydantic import BaseModel
-from typing import Optional, List, Any
+from typing import Optional, List, Dict, AsyncIterator
 from dotenv import load_dotenv
+from model.engine import Modality, run_model, summarize, generate_all, stream_all
+from model.previews import image_thumbnails
+from model.routing import RouteOptions, choose_models, hedge_plan, hedged, recorded_call
+from model.registry import RegistryView, build_model_input
 
 load_dotenv()
 
-# Model Registry with pricing and configuration
-MODEL_REGISTRY = {
-    "sdxl": {
-        "version": "stability-ai/sdxl:7762fd07cf82c948538e41f63f77d685e02b063e37e496e96eefd46c929f9bdc",
-        "cost_usd": 0.03,
-        "output_type": "array"
-    },
-    "luma-photon": {
-        "identifier": "luma/photon",
-        "cost_usd": 0.03,
-        "output_type": "single"
-    },
-    "sdxl-lightning": {
-        "version": "bytedance/sdxl-lightning-4step:6f7a773af6fc3e8de9d5a3c00be77c17308914bf67772726aff83496ba1e3bbe",
-        "cost_usd": 0.0016,
-        "output_type": "array"
-    },
-    "luma-photon-flash": {
-        "identifier": "luma/photon-flash",
-        "cost_usd": 0.01,
-        "output_type": "single"
-    },
-    "minimax-image-01": {
-        "identifier": "minimax/image-01",
-        "cost_usd": 0.01,
-        "output_type": "array"
-    },
-    "ideogram-v2-turbo": {
-        "identifier": "ideogram-ai/ideogram-v2a-turbo",
-        "cost_usd": 0.025,
-        "output_type": "single"
-    },
-    "recraft-v3": {
-        "identifier": "recraft-ai/recraft-v3",
-        "cost_usd": 0.04,
-        "output_type": "single"
-    },
-    "phoenix-1.0": {
-        "identifier": "leonardoai/phoenix-1.0",
-        "cost_usd": 0.002,
-        "output_type": "array"
-    },
-    "flux-fast": {
-        "identifier": "prunaai/flux-fast",
-        "cost_usd": 0.005,
-        "output_type": "single"
-    },
-    "seedream-3": {
-        "identifier": "bytedance/seedream-3",
-        "cost_usd": 0.03,
-        "output_type": "single"
-    },
-    "flux-kontext-pro": {
-        "identifier": "black-forest-labs/flux-kontext-pro",
-        "cost_usd": 0.04,
-        "output_type": "single"
-    },
-    "imagen-3-fast": {
-        "identifier": "google/imagen-3-fast",
-        "cost_usd": 0.025,
-        "output_type": "single"
-    },
-    "nano-banana": {
-        "identifier": "google/nano-banana",
-        "cost_usd": 0.039,
-        "output_type": "single"
-    },
-    "flux-schnell": {
-        "identifier": "black-forest-labs/flux-schnell",
-        "cost_usd": 0.003,
-        "output_type": "array"
-    },
-    "ideogram-v3-turbo": {
-        "identifier": "ideogram-ai/ideogram-v3-turbo",
-        "cost_usd": 0.03,
-        "output_type": "single"
-    },
-    "seedream-4": {
-        "identifier": "bytedance/seedream-4",
-        "cost_usd": 0.03,
-        "output_type": "array"
-    },
-    "imagen-4-fast": {
-        "identifier": "google/imagen-4-fast",
-        "cost_usd": 0.02,
-        "output_type": "single"
-    }
-}
+# Image models from the registry file (see model/registry.py); always the current version
+MODEL_REGISTRY = RegistryView("image")
+
+# Optional request fields passed to models whose registry entry has no "inputs" mapping
+IMAGE_INPUT_FIELDS = [
+    "negative_prompt", "width", "height", "aspect_ratio", "size", "num_inference_steps",
+    "style", "safety_filter_level", "output_format", "input_image", "image_input"
+]
 
 class ImageGenerationRequest(BaseModel):
     prompt: str
@@ -111,149 +34,130 @@ class ImageGenerationRequest(BaseModel):
     output_format: Optional[str] = None  # jpg, png, webp
     input_image: Optional[str] = None  # For image-to-image models
     image_input: Optional[List[str]] = None  # For multi-image input models
+    
+    # Let the server pick the models (from `models` if given, else the whole registry)
+    route: Optional[RouteOptions] = None
 
 class ModelResult(BaseModel):
     model_name: str
     image_urls: List[str]
+    thumbnail_urls: List[str] = []  # Small WebP versions of image_urls (OUTPUT_PREVIEWS=on)
     cost_usd: float
+    credited_usd: float = 0.0  # Price of a failed model, credited back to the payer
     status: str  # "success" or "error"
     error_message: Optional[str] = None
+    hedge_for: Optional[str] = None  # Routed model this backup stood in for (it was slower)
 
 class ImageGenerationResponse(BaseModel):
     results: List[ModelResult]
-    total_cost_usd: float
+    total_cost_usd: float  # Charged minus credited
+    total_charged_usd: float = 0.0
+    total_credited_usd: float = 0.0
     total_models: int
     successful: int
     failed: int
 
-def run_single_model_inference(model_name: str, request: ImageGenerationRequest) -> ModelResult:
+def model_costs() -> Dict[str, float]:
+    return {name: config["cost_usd"] for name, config in MODEL_REGISTRY.items()}
+
+def route_request(request: ImageGenerationRequest) -> ImageGenerationRequest:
     """
-    Run inference for a single model.
-    Returns ModelResult with success/error status.
+    Resolve `request.route` into concrete `models` using live latency and failure
+    statistics. The statistics move between calls, so routing the same request
+    twice may pick different models; a quote records its pick for that reason.
+    Raises ValueError when no model fits.
     """
-    try:
-        # Validate model selection
-        if model_name not in MODEL_REGISTRY:
-            return ModelResult(
-                model_name=model_name,
-                image_urls=[],
-                cost_usd=0.0,
-                status="error",
-                error_message=f"Model '{model_name}' not found"
-            )
-        
-        model_config = MODEL_REGISTRY[model_name]
-        
-        # Build input data based on what's provided
-        input_data = {"prompt": request.prompt}
-        
-        # Add optional parameters if they exist
-        if request.negative_prompt:
-            input_data["negative_prompt"] = request.negative_prompt
-        
-        if request.width:
-            input_data["width"] = request.width
-        
-        if request.height:
-            input_data["height"] = request.height
-        
-        if request.aspect_ratio:
-            input_data["aspect_ratio"] = request.aspect_ratio
-        
-        if request.size:
-            input_data["size"] = request.size
-        
-        if request.num_inference_steps:
-            input_data["num_inference_steps"] = request.num_inference_steps
-        
-        if request.style:
-            input_data["style"] = request.style
-        
-        if request.safety_filter_level:
-            input_data["safety_filter_level"] = request.safety_filter_level
-        
-        if request.output_format:
-            input_data["output_format"] = request.output_format
-        
-        if request.input_image:
-            input_data["input_image"] = request.input_image
-        
-        if request.image_input:
-            input_data["image_input"] = request.image_input
-        
-        # Determine which identifier to use (version or identifier)
-        model_ref = model_config.get("version") or model_config.get("identifier")
-        
-        # Run the model
-        output = replicate.run(model_ref, input=input_data)
-        
-        # Handle different output types
-        if model_config["output_type"] == "single":
-            # Single output - handle all possible formats
-            if isinstance(output, str):
-                image_urls = [output]
-            elif hasattr(output, 'url'):
-                url_attr = getattr(output, 'url')
-                if callable(url_attr):
-                    image_urls = [str(url_attr())]
-                else:
-                    image_urls = [str(url_attr)]
-            else:
-                image_urls = [str(output)]
-        else:
-            # Array output - handle each item
-            image_urls = []
-            for item in output:
-                if isinstance(item, str):
-                    image_urls.append(item)
-                elif hasattr(item, 'url'):
-                    url_attr = getattr(item, 'url')
-                    if callable(url_attr):
-                        image_urls.append(str(url_attr()))
-                    else:
-                        image_urls.append(str(url_attr))
-                else:
-                    image_urls.append(str(item))
-        
+    if request.route is None:
+        return request
+    costs = model_costs()
+    if "models" in request.model_fields_set:
+        costs = {m: cost for m, cost in costs.items() if m in request.models}
+    return request.model_copy(update={"models": choose_models(costs, request.route)})
+
+class ImageModality(Modality):
+    """
+    Text-to-image models. Routed requests may race a cheap backup model
+    (see model/routing.py), and successful results get WebP thumbnails.
+    """
+    name = "image"
+    label = "Model"
+    registry = MODEL_REGISTRY
+    response_model = ImageGenerationResponse
+    
+    def build_input(self, model_name: str, request: ImageGenerationRequest) -> dict:
+        # Prompt plus the optional fields this model takes, per its registry entry
+        return build_model_input(self.registry[model_name], request, IMAGE_INPUT_FIELDS, {"prompt": request.prompt})
+    
+    async def image_urls(self, model_name: str, request: ImageGenerationRequest) -> List[str]:
+        # Real runs (not cache hits) feed the latency stats used for routing
+        return await run_model(
+            self.registry[model_name],
+            self.build_input(model_name, request),
+            call_context=lambda: recorded_call(model_name)
+        )
+    
+    async def generate(self, model_name: str, request: ImageGenerationRequest) -> ModelResult:
+        plan = hedge_plan(model_name, model_costs(), request.route)
+        if plan is None:
+            return await self.success_result(model_name, request, await self.image_urls(model_name, request))
+        
+        # Routed requests race a cheap backup once the model runs past its p90
+        backup, delay = plan
+        image_urls, used_backup = await hedged(
+            lambda: self.image_urls(model_name, request),
+            lambda: self.image_urls(backup, request),
+            delay
+        )
+        result = await self.success_result(model_name, request, image_urls)
+        if used_backup:
+            # The payer was charged for the routed model; the difference is credited back
+            result.model_name = backup
+            result.hedge_for = model_name
+            result.credited_usd = result.cost_usd - self.cost(backup, request)
+        return result
+    
+    async def success_result(self, model_name: str, request: ImageGenerationRequest, urls: List[str]) -> ModelResult:
         return ModelResult(
             model_name=model_name,
-            image_urls=image_urls,
-            cost_usd=model_config["cost_usd"],
+            image_urls=urls,
+            thumbnail_urls=await image_thumbnails(urls),
+            cost_usd=self.cost(model_name, request),
             status="success"
         )
-        
-    except Exception as e:
-        # Return error result if model fails
-        model_cost = MODEL_REGISTRY.get(model_name, {}).get("cost_usd", 0.0)
+    
+    def error_result(self, model_name: str, message: str, request: Optional[ImageGenerationRequest] = None) -> ModelResult:
+        """
+        Build the error result for a model that raised or timed out.
+        Its price is credited back rather than charged.
+        """
+        model_cost = self.cost(model_name, request)
         return ModelResult(
             model_name=model_name,
             image_urls=[],
             cost_usd=model_cost,
+            credited_usd=model_cost,
             status="error",
-            error_message=str(e)
+            error_message=message
         )
 
-def run_replicate_inference(request: ImageGenerationRequest) -> ImageGenerationResponse:
+image_modality = ImageModality()
+
+def summarize_results(results: List[ModelResult]) -> ImageGenerationResponse:
+    """
+    Combine per-model results into a response with totals.
+    """
+    return summarize(image_modality, results)
+
+async def run_replicate_inference(request: ImageGenerationRequest) -> ImageGenerationResponse:
     """
     Handles calls to Replicate with multiple model support.
-    Runs all selected models and returns combined results.
+    Runs all selected models concurrently and returns combined results.
     """
-    results = []
-    
-    # Run each model
-    for model_name in request.models:
-        result = run_single_model_inference(model_name, request)
-        results.append(result)
-    
-    # Calculate totals
-    total_cost = sum(r.cost_usd for r in results)
-    successful = sum(1 for r in results if r.status == "success")
-    failed = sum(1 for r in results if r.status == "error")
-    
-    return ImageGenerationResponse(
-        results=results,
-        total_cost_usd=total_cost,
-        total_models=len(results),
-        successful=successful,
-        failed=failed
-    )
\ No newline at end of file
+    return await generate_all(image_modality, request)
+
+async def stream_replicate_inference(request: ImageGenerationRequest) -> AsyncIterator[ModelResult]:
+    """
+    Runs all selected models concurrently and yields each result as it completes.
+    """
+    async for result in stream_all(image_modality, request):
+        yield result
@@ -0,0 +1,44 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import pytest
+
+# Settings the modules read at import; real deployments take them from .env
+_state_dir = tempfile.mkdtemp(prefix="x402-tests-")
+os.environ.setdefault("RECEIVING_WALLET_ADDRESS", "0x000000000000000000000000000000000000dEaD")
+os.environ.setdefault("USDC_CONTRACT_ADDRESS", "0x5425890298aed601595a70AB815c96711a31Bc65")
+os.environ.setdefault("CREDIT_LEDGER_PATH", os.path.join(_state_dir, "credits.sqlite3"))
+os.environ.setdefault("SPENT_HASH_STORE", "memory")
+os.environ.setdefault("JOB_STORE", "memory")
+os.environ.setdefault("RESULT_CACHE", "memory")
+os.environ.setdefault("OUTPUT_MIRROR", "off")
+os.environ.setdefault("MODEL_REGISTRY_RELOAD_SECONDS", "0")
+os.environ.setdefault("PUBLIC_BASE_URL", "")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def registry_file(tmp_path, monkeypatch):
+    """
+    Point the live model registry at a copy of models.json and return an
+    `edit(change)` that rewrites the copy with `change(data)` applied. The
+    original snapshot is restored afterwards.
+    """
+    from model.registry import model_registry
+    path = tmp_path / "models.json"
+    shutil.copy(model_registry.path, path)
+    for attribute in ("path", "current", "reloads", "last_error", "_mtime"):
+        monkeypatch.setattr(model_registry, attribute, getattr(model_registry, attribute))
+    model_registry.path = str(path)
+
+    def edit(change):
+        data = json.loads(path.read_text())
+        change(data)
+        path.write_text(json.dumps(data))
+        # Move the mtime on even when the edit lands within the same clock tick
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    return edit
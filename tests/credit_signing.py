@@ -0,0 +1,23 @@
+"""
+Client side of prepaid-credit auth, shared by the tests.
+"""
+import time
+import hashlib
+import secrets
+from eth_account import Account
+from eth_account.messages import encode_defunct
+from x402.credits import credit_auth_message
+
+def credit_headers(account, method: str, path: str, body: bytes = b"", expires_in: int = 60, nonce: str = None) -> dict:
+    # What a client does: hash the exact request, sign it with a fresh nonce
+    digest = hashlib.sha256(f"{method} {path}\n".encode() + body).hexdigest()
+    nonce = nonce or secrets.token_hex(16)
+    expires = int(time.time()) + expires_in
+    message = credit_auth_message(account.address, digest, nonce, expires)
+    signature = Account.sign_message(encode_defunct(text=message), account.key).signature.hex()
+    return {
+        "X-Credit-Address": account.address,
+        "X-Credit-Signature": "0x" + signature.removeprefix("0x"),
+        "X-Credit-Nonce": nonce,
+        "X-Credit-Expires": str(expires)
+    }
@@ -0,0 +1,73 @@
+"""
+A local stand-in for the Replicate HTTP API, enough for `replicate.async_run`
+on "owner/name" models: each prediction takes `run_seconds` and answers in
+sync mode, and more than `capacity` predictions at once get a 429.
+"""
+import uuid
+import asyncio
+from typing import Optional
+from aiohttp import web
+
+class FakeReplicate:
+    def __init__(self, capacity: int = 2, run_seconds: float = 0.05):
+        self.capacity = capacity
+        self.run_seconds = run_seconds
+        self.running = 0
+        self.peak = 0
+        self.completed = 0
+        self.throttled = 0
+        self.url: Optional[str] = None
+        self._runner: Optional[web.AppRunner] = None
+
+    def _prediction(self, model: str, body: dict, status: str, output=None) -> dict:
+        prediction_id = uuid.uuid4().hex
+        return {
+            "id": prediction_id,
+            "model": model,
+            "version": "0" * 64,
+            "status": status,
+            "input": body.get("input", {}),
+            "output": output,
+            "error": None,
+            "logs": "",
+            "metrics": {},
+            "created_at": "2026-01-01T00:00:00Z",
+            "urls": {
+                "get": f"{self.url}v1/predictions/{prediction_id}",
+                "cancel": f"{self.url}v1/predictions/{prediction_id}/cancel"
+            }
+        }
+
+    async def _create(self, request: web.Request) -> web.Response:
+        model = f"{request.match_info['owner']}/{request.match_info['name']}"
+        body = await request.json()
+        if self.running >= self.capacity:
+            self.throttled += 1
+            return web.json_response(
+                {"title": "Request was throttled", "detail": "Request was throttled.", "status": 429},
+                status=429
+            )
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            await asyncio.sleep(self.run_seconds)
+        finally:
+            self.running -= 1
+        self.completed += 1
+        output = f"https://replicate.delivery/{uuid.uuid4().hex}.png"
+        return web.json_response(self._prediction(model, body, "succeeded", output), status=201)
+
+    async def start(self) -> "FakeReplicate":
+        app = web.Application()
+        app.router.add_post("/v1/models/{owner}/{name}/predictions", self._create)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/"
+        return self
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
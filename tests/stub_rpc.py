@@ -0,0 +1,92 @@
+"""
+A local JSON-RPC node for tests: answers eth_getTransactionReceipt with a
+receipt holding one USDC transfer to the receiving wallet, after an injected
+delay, or fails on demand (HTTP 500, or a JSON-RPC error answer).
+"""
+import asyncio
+from typing import Dict, Optional
+from aiohttp import web
+from x402.payment import USDC_CONTRACT_ADDRESS, RECEIVING_WALLET_ADDRESS
+
+TRANSFER_TOPIC = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+
+def _topic(address: str) -> str:
+    return "0x" + address.lower().removeprefix("0x").rjust(64, "0")
+
+def transfer_receipt(tx_hash: str, payer: str, value: int, block_number: int = 1000) -> dict:
+    block_hash = "0x" + "11" * 32
+    return {
+        "transactionHash": tx_hash,
+        "transactionIndex": "0x0",
+        "blockHash": block_hash,
+        "blockNumber": hex(block_number),
+        "from": payer,
+        "to": USDC_CONTRACT_ADDRESS,
+        "cumulativeGasUsed": "0xc350",
+        "gasUsed": "0xc350",
+        "effectiveGasPrice": "0x1",
+        "contractAddress": None,
+        "logsBloom": "0x" + "00" * 256,
+        "status": "0x1",
+        "type": "0x2",
+        "logs": [{
+            "address": USDC_CONTRACT_ADDRESS,
+            "topics": [TRANSFER_TOPIC, _topic(payer), _topic(RECEIVING_WALLET_ADDRESS)],
+            "data": "0x" + hex(value)[2:].rjust(64, "0"),
+            "blockNumber": hex(block_number),
+            "blockHash": block_hash,
+            "transactionHash": tx_hash,
+            "transactionIndex": "0x0",
+            "logIndex": "0x0",
+            "removed": False
+        }]
+    }
+
+class StubRpcNode:
+    """
+    Start with `await node.start()`; `url` is then the endpoint to hand to an RpcPool.
+    Set `delay` (seconds), `fail` (HTTP 500) or `error` (a JSON-RPC error object
+    answered to receipt lookups) at any time; `calls` counts requests.
+    """
+    def __init__(self, delay: float = 0.0, fail: bool = False, error: Optional[dict] = None):
+        self.delay = delay
+        self.fail = fail
+        self.error = error
+        self.calls = 0
+        self.receipts: Dict[str, dict] = {}
+        self.url: Optional[str] = None
+        self._runner: Optional[web.AppRunner] = None
+
+    def add_transfer(self, tx_hash: str, payer: str, value: int) -> None:
+        self.receipts[tx_hash] = transfer_receipt(tx_hash, payer, value)
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.calls += 1
+        body = await request.json()
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            return web.Response(status=500, text="node unavailable")
+        if body["method"] == "eth_getTransactionReceipt" and self.error is not None:
+            return web.json_response({"jsonrpc": "2.0", "id": body["id"], "error": self.error})
+        if body["method"] == "eth_getTransactionReceipt":
+            result = self.receipts.get(body["params"][0])
+        elif body["method"] == "eth_chainId":
+            result = "0xa869"
+        else:
+            return web.json_response({"jsonrpc": "2.0", "id": body["id"], "error": {"code": -32601, "message": "not stubbed"}})
+        return web.json_response({"jsonrpc": "2.0", "id": body["id"], "result": result})
+
+    async def start(self) -> "StubRpcNode":
+        app = web.Application()
+        app.router.add_post("/", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/"
+        return self
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
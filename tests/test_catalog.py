@@ -0,0 +1,41 @@
+import pytest
+from fastapi.testclient import TestClient
+from model.registry import model_registry
+from main import app
+
+client = TestClient(app)
+
+@pytest.mark.parametrize("path", ["/catalog", "/models", "/video-models", "/tts-models"])
+def test_current_etag_is_not_modified(path):
+    first = client.get(path)
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    revalidated = client.get(path, headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+    assert revalidated.headers["ETag"] == etag
+
+def test_weak_and_listed_etags_match():
+    etag = client.get("/catalog").headers["ETag"]
+    assert client.get("/catalog", headers={"If-None-Match": f'"stale", W/{etag}'}).status_code == 304
+
+def test_stale_etag_gets_the_listing():
+    response = client.get("/catalog", headers={"If-None-Match": '"0123456789abcdef0123456789abcdef"'})
+    assert response.status_code == 200
+    assert response.json()["registry_version"] == model_registry.current.version
+
+def test_etag_changes_after_a_registry_reload(registry_file):
+    before = client.get("/models")
+    name = next(iter(before.json()["available_models"]))
+
+    def reprice(data):
+        data["image"][name]["cost_usd"] += 0.01
+
+    registry_file(reprice)
+    assert model_registry.reload()
+    after = client.get("/models", headers={"If-None-Match": before.headers["ETag"]})
+    assert after.status_code == 200
+    assert after.headers["ETag"] != before.headers["ETag"]
+    assert after.json()["available_models"][name]["cost_usd"] == pytest.approx(
+        before.json()["available_models"][name]["cost_usd"] + 0.01
+    )
@@ -0,0 +1,54 @@
+from eth_account import Account
+from eth_account.messages import encode_defunct
+from fastapi.testclient import TestClient
+from credit_signing import credit_headers
+from main import app
+
+client = TestClient(app)
+
+def test_signed_request_reads_balance():
+    account = Account.create()
+    response = client.get("/balance", headers=credit_headers(account, "GET", "/balance"))
+    assert response.status_code == 200
+    assert response.json()["address"] == account.address
+
+def test_signature_is_single_use():
+    account = Account.create()
+    headers = credit_headers(account, "GET", "/balance")
+    assert client.get("/balance", headers=headers).status_code == 200
+    replay = client.get("/balance", headers=headers)
+    assert replay.status_code == 401
+    assert "already been used" in replay.json()["detail"]
+
+def test_expired_signature_is_rejected():
+    account = Account.create()
+    response = client.get("/balance", headers=credit_headers(account, "GET", "/balance", expires_in=-1))
+    assert response.status_code == 401
+    assert "expired" in response.json()["detail"]
+
+def test_long_lived_signature_is_rejected():
+    account = Account.create()
+    response = client.get("/balance", headers=credit_headers(account, "GET", "/balance", expires_in=86400))
+    assert response.status_code == 401
+
+def test_signature_is_bound_to_its_request():
+    account = Account.create()
+    # Signed for a cheap request, replayed against a different body
+    body = b'{"prompt":"a cat","models":["flux-schnell"]}'
+    headers = credit_headers(account, "POST", "/generate", body)
+    response = client.post(
+        "/generate",
+        content=b'{"prompt":"a cat","models":["recraft-v3","flux-kontext-pro"]}',
+        headers={**headers, "Content-Type": "application/json"}
+    )
+    assert response.status_code == 401
+    assert "does not match" in response.json()["detail"]
+
+def test_legacy_constant_signature_is_rejected():
+    account = Account.create()
+    legacy = Account.sign_message(
+        encode_defunct(text=f"x402 prepaid credits for {account.address} at 0x000000000000000000000000000000000000dEaD"),
+        account.key
+    ).signature.hex()
+    response = client.get("/balance", headers={"X-Credit-Address": account.address, "X-Credit-Signature": legacy})
+    assert response.status_code == 401
@@ -0,0 +1,49 @@
+import asyncio
+import uuid
+import replicate
+from replicate.helpers import FileOutput
+from model import engine
+
+def _config(output_type: str) -> dict:
+    # A fresh ref per test keeps the result cache and scheduler state apart
+    return {"identifier": f"test/{uuid.uuid4().hex[:8]}", "output_type": output_type}
+
+def _run(monkeypatch, config: dict, output) -> list:
+    async def fake_async_run(ref, input=None, **params):
+        return output() if callable(output) else output
+
+    monkeypatch.setattr(replicate, "async_run", fake_async_run)
+    return asyncio.run(engine.run_model(config, {"prompt": uuid.uuid4().hex}))
+
+def test_single_file_output_is_its_url(monkeypatch):
+    # FileOutput is async-iterable over its bytes; it must not be drained
+    output = FileOutput("https://replicate.delivery/a/out.png", client=None)
+    assert _run(monkeypatch, _config("single"), output) == ["https://replicate.delivery/a/out.png"]
+
+def test_list_of_file_outputs(monkeypatch):
+    output = [
+        FileOutput("https://replicate.delivery/a/0.png", client=None),
+        FileOutput("https://replicate.delivery/a/1.png", client=None)
+    ]
+    assert _run(monkeypatch, _config("array"), output) == [
+        "https://replicate.delivery/a/0.png",
+        "https://replicate.delivery/a/1.png"
+    ]
+
+def test_iterator_output_is_drained(monkeypatch):
+    async def stream():
+        for i in range(3):
+            yield FileOutput(f"https://replicate.delivery/a/{i}.mp4", client=None)
+
+    urls = _run(monkeypatch, _config("array"), stream)
+    assert urls == [f"https://replicate.delivery/a/{i}.mp4" for i in range(3)]
+
+def test_plain_string_output(monkeypatch):
+    assert _run(monkeypatch, _config("single"), "https://example.com/x.wav") == ["https://example.com/x.wav"]
+
+def test_output_url_accepts_url_method():
+    class Legacy:
+        def url(self):
+            return "https://example.com/legacy.png"
+
+    assert engine.output_url(Legacy()) == "https://example.com/legacy.png"
@@ -0,0 +1,68 @@
+"""
+Engine benchmark: what the shared generation engine adds around Replicate,
+per request, for each modality. Replicate is stubbed to answer at once, so
+the time measured is fan-out, scheduling, caching and result building.
+"""
+import time
+import uuid
+import asyncio
+import statistics
+import pytest
+import replicate
+from model import scheduler
+from model.engine import generate_all
+from model.txt2img import image_modality, ImageGenerationRequest
+from model.img2vid import video_modality, VideoGenerationRequest
+from model.tts import tts_modality, TTSRequest
+
+REQUESTS = 200
+
+@pytest.fixture
+def instant_replicate(monkeypatch):
+    calls = []
+
+    async def async_run(ref, input):
+        calls.append(ref)
+        return f"https://replicate.delivery/{uuid.uuid4().hex}.out"
+
+    monkeypatch.setattr(replicate, "async_run", async_run)
+    # Keep the per-model token bucket out of a benchmark of the engine itself
+    monkeypatch.setattr(scheduler, "REPLICATE_MODEL_RATE_PER_SECOND", 1e6)
+    return calls
+
+def _bench(modality, make_request):
+    async def scenario():
+        samples = []
+        for i in range(REQUESTS):
+            request = make_request(i)
+            started = time.perf_counter()
+            response = await generate_all(modality, request)
+            samples.append(time.perf_counter() - started)
+            assert response.successful == len(request.models)
+        return samples
+
+    ordered = sorted(asyncio.run(scenario()))
+    return statistics.median(ordered) * 1000, ordered[int(len(ordered) * 0.99)] * 1000
+
+CASES = {
+    "image": (image_modality, lambda p: ImageGenerationRequest(prompt=p, models=["sdxl", "luma-photon", "recraft-v3"])),
+    "video": (video_modality, lambda p: VideoGenerationRequest(prompt=p, models=["ltx-video"])),
+    "tts": (tts_modality, lambda p: TTSRequest(text=p, models=["kokoro-82m", "chatterbox"])),
+}
+
+@pytest.mark.parametrize("name", list(CASES))
+def test_engine_overhead_per_request(instant_replicate, name):
+    modality, make_request = CASES[name]
+    run_id = uuid.uuid4().hex
+
+    # Every prompt new: a real (stubbed) call per model
+    miss_p50, miss_p99 = _bench(modality, lambda i: make_request(f"{run_id} {i}"))
+    calls = len(instant_replicate)
+    # The same prompts again: answered by the result cache
+    hit_p50, hit_p99 = _bench(modality, lambda i: make_request(f"{run_id} {i}"))
+
+    print(f"\n{name}: miss p50 {miss_p50:.2f} ms, p99 {miss_p99:.2f} ms; "
+          f"cache hit p50 {hit_p50:.2f} ms, p99 {hit_p99:.2f} ms")
+    assert len(instant_replicate) == calls
+    assert miss_p50 < 10
+    assert hit_p50 < miss_p50 * 1.5
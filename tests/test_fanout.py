@@ -0,0 +1,45 @@
+import asyncio
+import threading
+from model import fanout
+from x402.ledger import CreditLedger
+
+def test_sqlite_work_does_not_wait_for_busy_blocking_threads(tmp_path):
+    release = threading.Event()
+
+    async def scenario():
+        # Every general-purpose thread is stuck on a slow media write
+        stuck = [
+            asyncio.ensure_future(fanout.run_blocking(release.wait))
+            for _ in range(fanout.GLOBAL_MAX_CONCURRENCY)
+        ]
+        try:
+            ledger = CreditLedger(str(tmp_path / "credits.sqlite3"))
+            await asyncio.wait_for(ledger.credit("0xabc", 5, "deposit", "tx-1"), timeout=5)
+            return await asyncio.wait_for(ledger.balance("0xabc"), timeout=5)
+        finally:
+            release.set()
+            await asyncio.gather(*stuck)
+
+    assert asyncio.run(scenario()) == 5
+
+def test_sqlite_threads_are_named_apart():
+    name = asyncio.run(fanout.run_sqlite(lambda: threading.current_thread().name))
+    assert name.startswith("sqlite")
+
+def test_semaphore_works_across_event_loops():
+    limit = fanout.LazySemaphore(1)
+    order = []
+
+    async def hold(tag: str):
+        async with limit:
+            order.append(f"{tag}-in")
+            await asyncio.sleep(0.01)
+            order.append(f"{tag}-out")
+
+    async def scenario():
+        await asyncio.gather(hold("a"), hold("b"))
+
+    # A semaphore made at import would be bound to the first loop only
+    asyncio.run(scenario())
+    asyncio.run(scenario())
+    assert order == ["a-in", "a-out", "b-in", "b-out"] * 2
@@ -0,0 +1,87 @@
+import asyncio
+import secrets
+import pytest
+from hexbytes import HexBytes
+from x402 import indexer
+from x402.indexer import PaymentIndexer, TRANSFER_TOPIC
+
+TOKEN = "0x5425890298aed601595a70AB815c96711a31Bc65"
+RECEIVER = "0x000000000000000000000000000000000000dEaD"
+PAYER = "0x00000000000000000000000000000000000000C3"
+
+def _log(tx_hash: str, block_number: int, value: int, removed: bool = False) -> dict:
+    return {
+        "address": TOKEN,
+        "transactionHash": HexBytes(tx_hash),
+        "blockNumber": block_number,
+        "topics": [
+            HexBytes(TRANSFER_TOPIC),
+            HexBytes("0x" + PAYER[2:].lower().rjust(64, "0")),
+            HexBytes("0x" + RECEIVER[2:].lower().rjust(64, "0"))
+        ],
+        "data": HexBytes(value.to_bytes(32, "big")),
+        "logIndex": 0,
+        "removed": removed
+    }
+
+class FakeChain:
+    """
+    Stands in for the RPC pool: eth_getLogs answers with the logs queued for
+    the requested range.
+    """
+    def __init__(self):
+        self.logs = {}
+        self.eth = self
+
+    async def get_logs(self, params: dict) -> list:
+        return self.logs.get((params["fromBlock"], params["toBlock"]), [])
+
+    async def call(self, method):
+        return await method(self)
+
+@pytest.fixture
+def chain(monkeypatch):
+    fake = FakeChain()
+    monkeypatch.setattr(indexer, "rpc_pool", fake)
+    return fake
+
+def _tx() -> str:
+    return "0x" + secrets.token_hex(32)
+
+def test_indexed_transfer_reads_like_a_receipt(chain):
+    payments = PaymentIndexer(TOKEN, RECEIVER)
+    tx_hash = _tx()
+    chain.logs[(100, 199)] = [_log(tx_hash, 150, 30000)]
+    asyncio.run(payments._index_range(100, 199))
+    assert payments.lookup(tx_hash) == {
+        "status": 1,
+        "block_number": 150,
+        "transfers": [{"from": PAYER, "to": RECEIVER, "value": 30000}]
+    }
+
+def test_removed_log_evicts_the_payment(chain):
+    payments = PaymentIndexer(TOKEN, RECEIVER)
+    dropped, kept = _tx(), _tx()
+    chain.logs[(100, 199)] = [_log(dropped, 150, 30000), _log(kept, 160, 1000)]
+    # A reorg takes the first transfer's block back out
+    chain.logs[(200, 299)] = [_log(dropped, 150, 30000, removed=True)]
+
+    async def scenario():
+        await payments._index_range(100, 199)
+        indexed = payments.lookup(dropped) is not None
+        await payments._index_range(200, 299)
+        return indexed
+
+    assert asyncio.run(scenario())
+    assert payments.lookup(dropped) is None
+    assert payments.lookup(kept)["transfers"][0]["value"] == 1000
+
+def test_old_blocks_are_pruned(chain, monkeypatch):
+    monkeypatch.setattr(indexer, "PAYMENT_INDEXER_RETAIN_BLOCKS", 100)
+    payments = PaymentIndexer(TOKEN, RECEIVER)
+    old, recent = _tx(), _tx()
+    chain.logs[(100, 299)] = [_log(old, 150, 1000), _log(recent, 250, 1000)]
+    asyncio.run(payments._index_range(100, 299))
+    payments._prune(head=300)
+    assert payments.lookup(old) is None
+    assert payments.lookup(recent) is not None
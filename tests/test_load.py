@@ -0,0 +1,85 @@
+"""
+Load tests: many paid generations in flight at once against a stub Replicate
+that takes MODEL_SECONDS per call, driven over ASGI in one event loop.
+"""
+import time
+import uuid
+import asyncio
+import statistics
+import httpx
+import pytest
+import replicate
+from x402.payment import Payment
+import main
+
+MODEL_SECONDS = 0.5
+MODELS = ["sdxl", "luma-photon", "sdxl-lightning"]
+
+@pytest.fixture
+def slow_replicate(monkeypatch):
+    calls = []
+
+    async def async_run(ref, input):
+        calls.append(ref)
+        await asyncio.sleep(MODEL_SECONDS)
+        return f"https://replicate.delivery/{uuid.uuid4().hex}.png"
+
+    async def collect(total_units, payment):
+        return Payment(method="credits", payer="0x0", reference=uuid.uuid4().hex, units=total_units, paid_units=total_units)
+
+    monkeypatch.setattr(replicate, "async_run", async_run)
+    monkeypatch.setattr(main, "collect_payment", collect)
+    return calls
+
+def _client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test")
+
+def _generate(client: httpx.AsyncClient):
+    # A fresh prompt each time, so the result cache never answers
+    return client.post("/generate", json={"prompt": uuid.uuid4().hex, "models": MODELS})
+
+def test_models_of_one_request_run_concurrently(slow_replicate):
+    async def scenario():
+        async with _client() as client:
+            started = time.monotonic()
+            response = await _generate(client)
+            return response, time.monotonic() - started
+
+    response, elapsed = asyncio.run(scenario())
+    assert response.status_code == 200
+    assert response.json()["successful"] == len(MODELS)
+    # Close to one model's time, not the sum of all three
+    assert elapsed < MODEL_SECONDS * 2
+
+def test_cheap_endpoints_stay_fast_under_load(slow_replicate):
+    concurrent_requests = 4
+
+    async def scenario():
+        async with _client() as client:
+            started = time.monotonic()
+            generations = [asyncio.create_task(_generate(client)) for _ in range(concurrent_requests)]
+            await asyncio.sleep(0.05)
+
+            # Cheap reads while every generation is still waiting on Replicate
+            latencies = []
+            for _ in range(20):
+                t = time.monotonic()
+                response = await client.get("/models")
+                assert response.status_code == 200
+                latencies.append(time.monotonic() - t)
+            in_flight = sum(not g.done() for g in generations)
+
+            responses = await asyncio.gather(*generations)
+            return latencies, in_flight, responses, time.monotonic() - started
+
+    latencies, in_flight, responses, elapsed = asyncio.run(scenario())
+    assert in_flight == concurrent_requests
+    assert all(r.status_code == 200 and r.json()["successful"] == len(MODELS) for r in responses)
+    assert len(slow_replicate) == concurrent_requests * len(MODELS)
+    # 12 model calls of 0.5 s finish together rather than one after another
+    assert elapsed < MODEL_SECONDS * 3
+    p50 = statistics.median(latencies)
+    p99 = max(latencies)
+    print(f"\nGET /models under load: p50 {p50 * 1000:.1f} ms, max {p99 * 1000:.1f} ms; "
+          f"{concurrent_requests} x /generate in {elapsed:.2f} s")
+    assert p99 < MODEL_SECONDS / 2
@@ -0,0 +1,51 @@
+import time
+import asyncio
+import pytest
+from fastapi import HTTPException
+from x402 import payment, receipts
+from x402.rpc import RpcPool
+from stub_rpc import StubRpcNode
+
+INVALID_PARAMS = {"code": -32602, "message": "invalid argument 0: hex string has length 8, want 64 for common.Hash"}
+
+async def _verify(node: StubRpcNode, tx_hash: str, monkeypatch):
+    await node.start()
+    pool = RpcPool([node.url])
+    monkeypatch.setattr(payment, "rpc_pool", pool)
+    try:
+        started = time.monotonic()
+        with pytest.raises(HTTPException) as refused:
+            await payment.verify_usdc_payment(1000, tx_hash, wait_seconds=15)
+        return refused.value, time.monotonic() - started
+    finally:
+        await pool.close()
+        await node.stop()
+
+@pytest.mark.parametrize("tx_hash", ["not-a-hash", "0xdeadbeef", "0x" + "g" * 64, "0x" + "ab" * 33])
+def test_malformed_hash_is_refused_without_rpc(tx_hash, monkeypatch):
+    node = StubRpcNode()
+    refused, elapsed = asyncio.run(_verify(node, tx_hash, monkeypatch))
+    assert refused.status_code == 402
+    assert refused.detail == "Invalid transaction hash."
+    assert node.calls == 0
+    assert elapsed < 0.5
+
+def test_node_rejecting_the_lookup_is_a_402_not_a_retry(monkeypatch):
+    node = StubRpcNode(error=INVALID_PARAMS)
+    refused, elapsed = asyncio.run(_verify(node, "0x" + "ab" * 32, monkeypatch))
+    assert refused.status_code == 402
+    # Answered at once rather than polled until the 15 s wait runs out
+    assert elapsed < 1
+
+def test_unreachable_node_is_a_503(monkeypatch):
+    refused, _ = asyncio.run(_verify(StubRpcNode(fail=True), "0x" + "ab" * 32, monkeypatch))
+    assert refused.status_code == 503
+
+@pytest.mark.parametrize("requested", [float("nan"), float("inf"), float("-inf"), "nan"])
+def test_non_finite_wait_falls_back_to_the_default(requested):
+    assert receipts.clamp_wait_seconds(requested) == receipts.PAYMENT_RECEIPT_WAIT_SECONDS
+
+def test_wait_is_clamped():
+    assert receipts.clamp_wait_seconds(-5) == 0
+    assert receipts.clamp_wait_seconds(10**6) == receipts.PAYMENT_MAX_RECEIPT_WAIT_SECONDS
+    assert receipts.clamp_wait_seconds(None) == receipts.PAYMENT_RECEIPT_WAIT_SECONDS
@@ -0,0 +1,63 @@
+import time
+import asyncio
+import secrets
+import pytest
+from eth_account import Account
+from eth_account.messages import encode_defunct
+from fastapi import HTTPException
+from x402 import payment
+from x402.ledger import ledger
+from x402.credits import CreditAuth, PaymentHeaders, credit_auth_message, _collect_payment
+
+REQUIRED_UNITS = 40000
+
+def signed(account, digest: str = "ab" * 32) -> CreditAuth:
+    nonce, expires = secrets.token_hex(16), int(time.time()) + 60
+    message = credit_auth_message(account.address, digest, nonce, expires)
+    signature = Account.sign_message(encode_defunct(text=message), account.key).signature.hex()
+    return CreditAuth(address=account.address, signature=signature, nonce=nonce, expires=expires, request_digest=digest)
+
+@pytest.fixture
+def short_transfer(monkeypatch):
+    """
+    A victim wallet with prepaid credits and a small, unspent transfer of theirs.
+    """
+    victim = Account.create()
+    tx_hash = "0x" + secrets.token_hex(32)
+    receipt = {
+        "status": 1,
+        "block_number": 1000,
+        "transfers": [{"from": victim.address, "to": payment.RECEIVING_WALLET_ADDRESS, "value": 1000}]
+    }
+
+    async def decoded_receipt(requested_hash):
+        assert requested_hash == tx_hash
+        return receipt
+
+    monkeypatch.setattr(payment, "get_decoded_receipt", decoded_receipt)
+    asyncio.run(ledger.credit(victim.address, 100000, "deposit", "test"))
+    return victim, tx_hash
+
+def test_short_transfer_without_signature_is_refused(short_transfer):
+    victim, tx_hash = short_transfer
+    with pytest.raises(HTTPException) as refused:
+        asyncio.run(_collect_payment(REQUIRED_UNITS, PaymentHeaders(tx=tx_hash)))
+    assert refused.value.status_code == 402
+    assert asyncio.run(ledger.balance(victim.address)) == 100000
+    # The hash was not spent, so its owner can still use it
+    assert not asyncio.run(payment.spent_hash_store.is_spent(tx_hash))
+
+def test_someone_elses_signature_cannot_draw_on_the_payer(short_transfer):
+    victim, tx_hash = short_transfer
+    attacker = Account.create()
+    with pytest.raises(HTTPException) as refused:
+        asyncio.run(_collect_payment(REQUIRED_UNITS, PaymentHeaders(tx=tx_hash, credit=signed(attacker))))
+    assert refused.value.status_code == 402
+    assert asyncio.run(ledger.balance(victim.address)) == 100000
+
+def test_payer_signature_tops_up_from_credits(short_transfer):
+    victim, tx_hash = short_transfer
+    charged = asyncio.run(_collect_payment(REQUIRED_UNITS, PaymentHeaders(tx=tx_hash, credit=signed(victim))))
+    assert charged.payer == victim.address
+    assert charged.paid_units == 1000
+    assert asyncio.run(ledger.balance(victim.address)) == 100000 - (REQUIRED_UNITS - 1000)
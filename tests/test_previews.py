@@ -0,0 +1,56 @@
+import os
+import asyncio
+import hashlib
+import pytest
+from model import previews, storage
+
+SOURCE_KEY = hashlib.sha256(b"https://replicate.delivery/a.png").hexdigest() + ".png"
+
+@pytest.fixture
+def mirrored_image(tmp_path, monkeypatch):
+    local = storage.LocalOutputStorage(str(tmp_path), "http://test/media")
+    (tmp_path / SOURCE_KEY).write_bytes(b"png")
+    monkeypatch.setattr(storage, "output_storage", local)
+    monkeypatch.setattr(previews, "output_storage", local)
+    monkeypatch.setattr(previews, "OUTPUT_PREVIEWS", True)
+    return local, local.url(SOURCE_KEY)
+
+def _slow_encoder(monkeypatch, release: asyncio.Event):
+    async def encode(func, src_path, dst_path, *args):
+        await release.wait()
+        with open(dst_path, "wb") as f:
+            f.write(b"webp")
+
+    monkeypatch.setattr(previews, "_run_in_pool", encode)
+
+def test_thumbnails_do_not_hold_the_response(mirrored_image, monkeypatch):
+    local, image_url = mirrored_image
+
+    async def scenario():
+        release = asyncio.Event()
+        _slow_encoder(monkeypatch, release)
+        # Returns while the encoder is still blocked
+        urls = await asyncio.wait_for(previews.image_thumbnails([image_url]), 1)
+        stored_early = os.path.exists(local.path(urls[0].rsplit("/", 1)[1]))
+        release.set()
+        await asyncio.gather(*previews._pending_thumbnails.values())
+        return urls, stored_early
+
+    urls, stored_early = asyncio.run(scenario())
+    key = urls[0].rsplit("/", 1)[1]
+    assert key == storage.media_key(local.url(SOURCE_KEY))[:64] + "-thumb.webp"
+    assert not stored_early
+    assert open(local.path(key), "rb").read() == b"webp"
+
+def test_waiting_for_thumbnails_is_opt_in(mirrored_image, monkeypatch):
+    local, image_url = mirrored_image
+    monkeypatch.setattr(previews, "THUMBNAILS_WAIT", True)
+
+    async def scenario():
+        release = asyncio.Event()
+        release.set()
+        _slow_encoder(monkeypatch, release)
+        return await previews.image_thumbnails([image_url])
+
+    urls = asyncio.run(scenario())
+    assert os.path.exists(local.path(urls[0].rsplit("/", 1)[1]))
@@ -0,0 +1,61 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from x402.credits import PaymentHeaders
+from x402.payment import Payment
+from model import txt2img
+from model.txt2img import ImageGenerationRequest
+import main
+
+client = TestClient(main.app)
+
+ROUTED = {"prompt": "a lighthouse at dusk", "route": {"best_n": 1, "max_cost_usd": 0.05}}
+
+@pytest.fixture
+def charges(monkeypatch):
+    charged = []
+
+    async def collect(total_units, payment):
+        charged.append(total_units)
+        return Payment(method="credits", payer="0x0", reference="test", units=total_units, paid_units=total_units)
+
+    monkeypatch.setattr(main, "collect_payment", collect)
+    return charged
+
+def _charge(body: dict, quote_id: str = None):
+    payment = PaymentHeaders(quote=quote_id)
+    return asyncio.run(main.charge_image_request(ImageGenerationRequest.model_validate(body), payment))
+
+def test_quote_runs_the_models_it_priced(charges, monkeypatch):
+    quote = client.post("/quote", json={"modality": "image", "request": ROUTED}).json()
+    assert quote["models"] == list(quote["breakdown_units"])
+
+    # Latency stats move between /quote and /generate, so routing would now pick another model
+    other = next(m for m in txt2img.MODEL_REGISTRY if m not in quote["models"])
+    monkeypatch.setattr(txt2img, "choose_models", lambda costs, route: [other])
+
+    request, _ = _charge(ROUTED, quote["quote_id"])
+    assert request.models == quote["models"]
+    assert charges == [quote["amount_units"]]
+
+def test_without_a_quote_the_request_is_routed(charges, monkeypatch):
+    monkeypatch.setattr(txt2img, "choose_models", lambda costs, route: ["sdxl"])
+    request, _ = _charge(ROUTED)
+    assert request.models == ["sdxl"]
+    assert charges == [main.image_price_units(["sdxl"])["sdxl"]]
+
+def test_quote_for_another_request_is_rejected(charges):
+    quote = client.post("/quote", json={"modality": "image", "request": ROUTED}).json()
+    with pytest.raises(HTTPException) as rejected:
+        _charge({**ROUTED, "prompt": "a different prompt"}, quote["quote_id"])
+    assert rejected.value.status_code == 400
+    assert charges == []
+
+def test_unrouted_quote(charges):
+    body = {"prompt": "a cat", "models": ["sdxl"]}
+    quote = client.post("/quote", json={"modality": "image", "request": body}).json()
+    assert quote["models"] is None
+    request, _ = _charge(body, quote["quote_id"])
+    assert request.models == ["sdxl"]
+    assert charges == [quote["amount_units"]]
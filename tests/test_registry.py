@@ -0,0 +1,93 @@
+import os
+import asyncio
+import subprocess
+import sys
+from model import registry
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_default_path_is_next_to_the_code():
+    assert registry.MODEL_REGISTRY_PATH == os.path.join(REPO_ROOT, "models.json")
+
+def test_loads_from_another_working_directory(tmp_path):
+    env = {k: v for k, v in os.environ.items() if k != "MODEL_REGISTRY_PATH"}
+    env["PYTHONPATH"] = REPO_ROOT
+    loaded = subprocess.run(
+        [sys.executable, "-c", "from model.registry import model_registry; print(len(model_registry.current.image))"],
+        cwd=tmp_path, env=env, capture_output=True, text=True, check=True
+    )
+    assert int(loaded.stdout) > 0
+
+def _first_image_model() -> str:
+    return next(iter(registry.model_registry.current.image))
+
+def _wait_for(condition, seconds: float = 2.0) -> bool:
+    async def poll():
+        for _ in range(int(seconds / 0.01)):
+            if condition():
+                return True
+            await asyncio.sleep(0.01)
+        return condition()
+    return poll()
+
+def test_changed_file_is_swapped_in_by_the_watcher(registry_file, monkeypatch):
+    monkeypatch.setattr(registry, "MODEL_REGISTRY_RELOAD_SECONDS", 0.01)
+    model_registry = registry.model_registry
+    before, reloads = model_registry.current, model_registry.reloads
+    name = _first_image_model()
+
+    def reprice(data):
+        data["image"][name]["cost_usd"] = 9.99
+
+    async def scenario():
+        model_registry.start()
+        try:
+            registry_file(reprice)
+            return await _wait_for(lambda: model_registry.current is not before)
+        finally:
+            await model_registry.stop()
+
+    assert asyncio.run(scenario())
+    assert model_registry.current.image[name]["cost_usd"] == 9.99
+    assert model_registry.current.version != before.version
+    assert model_registry.stats()["reloads"] == reloads + 1
+    # The old snapshot is untouched for requests still holding it
+    assert before.image[name]["cost_usd"] != 9.99
+
+def test_invalid_edit_keeps_the_running_snapshot(registry_file, monkeypatch):
+    monkeypatch.setattr(registry, "MODEL_REGISTRY_RELOAD_SECONDS", 0.01)
+    model_registry = registry.model_registry
+    before, reloads = model_registry.current, model_registry.reloads
+    name = _first_image_model()
+
+    def break_entry(data):
+        del data["image"][name]["cost_usd"]
+
+    async def scenario():
+        model_registry.start()
+        try:
+            registry_file(break_entry)
+            return await _wait_for(lambda: model_registry.last_error is not None)
+        finally:
+            await model_registry.stop()
+
+    assert asyncio.run(scenario())
+    assert "cost_usd" in model_registry.stats()["last_error"]
+    assert model_registry.current is before
+    assert model_registry.stats()["reloads"] == reloads
+
+def test_views_read_the_current_snapshot(registry_file):
+    view = registry.RegistryView("image")
+    name = _first_image_model()
+    held = view[name]
+
+    def rename(data):
+        data["image"]["renamed-model"] = data["image"].pop(name)
+
+    registry_file(rename)
+    assert registry.model_registry.reload()
+    assert "renamed-model" in view and name not in view
+    assert len(view) == len(registry.model_registry.current.image)
+    assert view["renamed-model"]["cost_usd"] == held["cost_usd"]
+    # An entry read before the swap stays usable
+    assert held["cost_usd"] > 0
@@ -0,0 +1,113 @@
+import os
+import uuid
+import asyncio
+import secrets
+import pytest
+from concurrent.futures import ProcessPoolExecutor
+from x402 import replay
+from x402.replay import (
+    InMemorySpentHashStore, SQLiteSpentHashStore, RedisSpentHashStore,
+    CLAIMED, ALREADY_SPENT, TOO_OLD
+)
+
+def _tx() -> str:
+    return "0x" + secrets.token_hex(32)
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def make_store(request, tmp_path):
+    """
+    A factory of stores sharing one backend, as separate workers would.
+    Redis runs only when REDIS_TEST_URL points at a server.
+    """
+    if request.param == "memory":
+        store = InMemorySpentHashStore()
+        return lambda: store
+    if request.param == "sqlite":
+        path = str(tmp_path / "spent.sqlite3")
+        return lambda: SQLiteSpentHashStore(path)
+    pytest.importorskip("redis")
+    url = os.getenv("REDIS_TEST_URL")
+    if not url:
+        pytest.skip("REDIS_TEST_URL is not set")
+    prefix = f"x402-test-{uuid.uuid4().hex}"
+    return lambda: RedisSpentHashStore(url, key_prefix=prefix)
+
+def test_concurrent_claims_have_one_winner(make_store):
+    stores = [make_store() for _ in range(4)]
+    tx_hash = _tx()
+
+    async def scenario():
+        return await asyncio.gather(*(
+            stores[i % len(stores)].claim(tx_hash, 1000) for i in range(32)
+        ))
+
+    outcomes = asyncio.run(scenario())
+    assert outcomes.count(CLAIMED) == 1
+    assert outcomes.count(ALREADY_SPENT) == 31
+    assert asyncio.run(stores[0].is_spent(tx_hash))
+
+def _claim_in_process(path: str, tx_hash: str) -> str:
+    return SQLiteSpentHashStore(path)._claim(tx_hash, 1000)
+
+def test_sqlite_claims_are_atomic_across_processes(tmp_path):
+    path = str(tmp_path / "spent.sqlite3")
+    SQLiteSpentHashStore(path)
+    tx_hash = _tx()
+    with ProcessPoolExecutor(max_workers=4) as pool:
+        outcomes = list(pool.map(_claim_in_process, [path] * 16, [tx_hash] * 16))
+    assert outcomes.count(CLAIMED) == 1
+    assert outcomes.count(ALREADY_SPENT) == 15
+
+def test_claims_below_the_watermark_are_too_old(make_store):
+    store = make_store()
+
+    async def scenario():
+        await store.prune(1000)
+        return await store.claim(_tx(), 999), await store.claim(_tx(), 1000)
+
+    assert asyncio.run(scenario()) == (TOO_OLD, CLAIMED)
+
+def test_pruning_keeps_hashes_above_the_watermark(make_store):
+    store = make_store()
+    old, recent = _tx(), _tx()
+
+    async def scenario():
+        await store.claim(old, 900)
+        await store.claim(recent, 1100)
+        removed = await store.prune(1000)
+        # The watermark never moves back
+        await store.prune(500)
+        return (
+            removed,
+            await store.is_spent(old),
+            await store.is_spent(recent),
+            await store.claim(old, 900),
+            await store.claim(recent, 1100)
+        )
+
+    removed, old_spent, recent_spent, old_again, recent_again = asyncio.run(scenario())
+    assert removed == 1
+    assert (old_spent, recent_spent) == (False, True)
+    # A forgotten hash is refused as too old, never accepted a second time
+    assert old_again == TOO_OLD
+    assert recent_again == ALREADY_SPENT
+
+def test_maybe_prune_runs_once_per_interval(monkeypatch):
+    pruned = []
+
+    class RecordingStore(InMemorySpentHashStore):
+        async def prune(self, below_block: int) -> int:
+            pruned.append(below_block)
+            return await super().prune(below_block)
+
+    monkeypatch.setattr(replay, "spent_hash_store", RecordingStore())
+    monkeypatch.setattr(replay, "_last_prune_block", None)
+    monkeypatch.setattr(replay, "PAYMENT_MAX_AGE_BLOCKS", 100)
+    monkeypatch.setattr(replay, "PRUNE_INTERVAL_BLOCKS", 10)
+
+    async def scenario():
+        for block in (1000, 1005, 1009, 1010, 1015, 1020):
+            await replay.maybe_prune(block)
+
+    asyncio.run(scenario())
+    assert pruned == [900, 910, 920]
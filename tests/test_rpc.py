@@ -0,0 +1,111 @@
+import time
+import asyncio
+import secrets
+import pytest
+from web3.exceptions import TransactionNotFound, Web3RPCError
+from x402 import rpc
+from x402.rpc import RpcPool
+from stub_rpc import StubRpcNode
+
+PAYER = "0x00000000000000000000000000000000000000A1"
+INVALID_PARAMS = {"code": -32602, "message": "invalid argument 0: hex string has length 8, want 64 for common.Hash"}
+
+def _tx() -> str:
+    return "0x" + secrets.token_hex(32)
+
+async def _pool(*nodes: StubRpcNode) -> RpcPool:
+    for node in nodes:
+        await node.start()
+    return RpcPool([node.url for node in nodes])
+
+async def _close(pool: RpcPool, *nodes: StubRpcNode) -> None:
+    await pool.close()
+    for node in nodes:
+        await node.stop()
+
+def _receipt(pool: RpcPool, tx_hash: str):
+    return pool.call(lambda w3: w3.eth.get_transaction_receipt(tx_hash))
+
+def test_fails_over_from_an_erroring_node():
+    async def scenario():
+        broken, healthy = StubRpcNode(fail=True), StubRpcNode()
+        pool = await _pool(broken, healthy)
+        tx_hash = _tx()
+        healthy.add_transfer(tx_hash, PAYER, 1000)
+        try:
+            receipt = await _receipt(pool, tx_hash)
+            return receipt, broken.calls, healthy.calls, pool.ranked()[0].url == healthy.url
+        finally:
+            await _close(pool, broken, healthy)
+
+    receipt, broken_calls, healthy_calls, healthy_ranked_first = asyncio.run(scenario())
+    assert receipt["status"] == 1
+    assert (broken_calls, healthy_calls) == (1, 1)
+    # The failure is remembered, so the next call goes to the healthy node first
+    assert healthy_ranked_first
+
+def test_hedges_a_slow_node(monkeypatch):
+    monkeypatch.setattr(rpc, "RPC_HEDGE_DELAY_SECONDS", 0.05)
+
+    async def scenario():
+        slow, fast = StubRpcNode(delay=1.0), StubRpcNode(delay=0.01)
+        pool = await _pool(slow, fast)
+        tx_hash = _tx()
+        slow.add_transfer(tx_hash, PAYER, 1000)
+        fast.add_transfer(tx_hash, PAYER, 1000)
+        try:
+            started = time.monotonic()
+            receipt = await _receipt(pool, tx_hash)
+            return receipt, time.monotonic() - started, slow.calls, fast.calls
+        finally:
+            await _close(pool, slow, fast)
+
+    receipt, elapsed, slow_calls, fast_calls = asyncio.run(scenario())
+    assert receipt["status"] == 1
+    assert (slow_calls, fast_calls) == (1, 1)
+    # Answered by the hedge after about 50 ms, not the slow node's full second
+    assert elapsed < 0.5
+
+def test_not_found_is_an_answer_not_a_failure():
+    async def scenario():
+        first, second = StubRpcNode(), StubRpcNode()
+        pool = await _pool(first, second)
+        try:
+            with pytest.raises(TransactionNotFound):
+                await _receipt(pool, _tx())
+            return first.calls + second.calls, pool.endpoints[0].failure_rate
+        finally:
+            await _close(pool, first, second)
+
+    calls, failure_rate = asyncio.run(scenario())
+    assert calls == 1
+    assert failure_rate == 0
+
+def test_every_node_down_raises():
+    async def scenario():
+        nodes = StubRpcNode(fail=True), StubRpcNode(fail=True)
+        pool = await _pool(*nodes)
+        try:
+            with pytest.raises(Exception):
+                await _receipt(pool, _tx())
+            return [node.calls for node in nodes]
+        finally:
+            await _close(pool, *nodes)
+
+    assert asyncio.run(scenario()) == [1, 1]
+
+def test_invalid_params_is_an_answer_not_a_failure():
+    async def scenario():
+        first, second = StubRpcNode(error=INVALID_PARAMS), StubRpcNode(error=INVALID_PARAMS)
+        pool = await _pool(first, second)
+        try:
+            with pytest.raises(Web3RPCError):
+                await _receipt(pool, "0xdeadbeef")
+            return first.calls + second.calls, [endpoint.failure_rate for endpoint in pool.endpoints]
+        finally:
+            await _close(pool, first, second)
+
+    calls, failure_rates = asyncio.run(scenario())
+    # A client's bad hash is answered by one node and does not count against any
+    assert calls == 1
+    assert failure_rates == [0, 0]
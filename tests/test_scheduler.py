@@ -0,0 +1,121 @@
+import uuid
+import asyncio
+import pytest
+import replicate
+from model import scheduler
+from model.engine import run_model
+from fake_replicate import FakeReplicate
+from model.scheduler import ModelScheduler, ModelTimeoutError
+
+def _scheduler(window: float = 1) -> ModelScheduler:
+    s = ModelScheduler("owner/model")
+    s.window = window
+    return s
+
+def test_queue_time_does_not_count_toward_the_timeout():
+    s = _scheduler()
+
+    async def call(seconds: float):
+        await asyncio.sleep(seconds)
+        return seconds
+
+    async def scenario():
+        # The second call waits 0.3 s for the only slot, then runs for 0.05 s
+        return await asyncio.gather(
+            s.run(lambda: call(0.3), timeout=1),
+            s.run(lambda: call(0.05), timeout=0.2)
+        )
+
+    assert asyncio.run(scenario()) == [0.3, 0.05]
+
+def test_slow_call_times_out_and_shrinks_the_window():
+    s = _scheduler(window=4)
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    with pytest.raises(ModelTimeoutError, match="timed out after 0.05 seconds"):
+        asyncio.run(s.run(hang, timeout=0.05))
+    assert s.window == 3
+    assert s.active == 0
+
+def test_default_timeout(monkeypatch):
+    monkeypatch.setattr(scheduler, "MODEL_TIMEOUT_SECONDS", 0.05)
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    with pytest.raises(ModelTimeoutError):
+        asyncio.run(_scheduler().run(hang))
+
+@pytest.fixture
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(scheduler, "REPLICATE_MODEL_RATE_PER_SECOND", 1000)
+    monkeypatch.setattr(scheduler, "REPLICATE_RETRY_BASE_SECONDS", 0.02)
+    monkeypatch.setattr(scheduler, "REPLICATE_RETRY_MAX_SECONDS", 0.2)
+    monkeypatch.setattr(scheduler, "REPLICATE_MAX_RETRIES", 8)
+
+def test_aimd_and_429_retries_against_fake_replicate(fast_backoff, monkeypatch):
+    model_config = {"identifier": f"test/model-{uuid.uuid4().hex[:8]}", "cost_usd": 0.01}
+    calls = 24
+
+    async def scenario():
+        fake = await FakeReplicate(capacity=2, run_seconds=0.05).start()
+        client = replicate.Client(api_token="test", base_url=fake.url.rstrip("/"))
+        monkeypatch.setattr(replicate, "async_run", client.async_run)
+        try:
+            outputs = await asyncio.gather(*(
+                run_model(model_config, {"prompt": f"p{i}"}) for i in range(calls)
+            ))
+            return outputs, fake
+        finally:
+            await fake.stop()
+
+    outputs, fake = asyncio.run(scenario())
+    stats = scheduler.scheduler_for(model_config["identifier"]).stats()
+    print(f"\nfake Replicate capacity 2: {fake.completed} done, {fake.throttled} throttled, "
+          f"peak {fake.peak}; scheduler window {stats['window']}, retries {stats['retries']}")
+
+    # Every call succeeds: 429s are retried, never surfaced
+    assert all(len(urls) == 1 and urls[0].startswith("https://replicate.delivery/") for urls in outputs)
+    assert fake.completed == calls
+    # The first burst overruns the capacity; the window then halves towards it
+    assert fake.throttled > 0
+    assert stats["throttled"] == fake.throttled
+    assert stats["retries"] == fake.throttled
+    assert stats["active"] == 0 and stats["queued"] == 0
+
+class Throttled(Exception):
+    status = 429
+
+def test_429_halves_the_window_and_retries(fast_backoff):
+    s = _scheduler(window=8)
+    attempts = []
+
+    async def call():
+        attempts.append(s.window)
+        if len(attempts) == 1:
+            raise Throttled("Request was throttled")
+        return "ok"
+
+    assert asyncio.run(s.run(call)) == "ok"
+    # Halved by the 429, then one additive step for the success
+    assert attempts == [8, 4]
+    assert s.window == 4.25
+    assert (s.throttled, s.retries) == (1, 1)
+
+def test_window_grows_back_after_successes(fast_backoff, monkeypatch):
+    # Instant calls have noisy latencies; keep them from counting as slow
+    monkeypatch.setattr(scheduler, "REPLICATE_LATENCY_BACKOFF_FACTOR", 1e9)
+    s = _scheduler(window=1)
+
+    async def quick():
+        return "ok"
+
+    async def scenario():
+        for _ in range(20):
+            await s.run(quick)
+
+    asyncio.run(scenario())
+    # Additive increase: about one slot per window's worth of successes
+    assert 5 < s.window <= scheduler.REPLICATE_MODEL_MAX_CONCURRENCY
@@ -0,0 +1,89 @@
+import uuid
+import asyncio
+import pytest
+import replicate
+from model import cache
+from model.engine import run_model
+
+MODEL = {"identifier": "test/coalesced", "cost_usd": 0.01}
+
+class GatedReplicate:
+    """
+    Counts async_run calls; each waits for `release` and then answers or raises.
+    """
+    def __init__(self, error: Exception = None):
+        self.calls = 0
+        self.release = asyncio.Event()
+        self.error = error
+
+    async def async_run(self, ref, input):
+        self.calls += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return f"https://replicate.delivery/{uuid.uuid4().hex}.png"
+
+@pytest.fixture
+def gated(monkeypatch):
+    def install(error: Exception = None) -> GatedReplicate:
+        fake = GatedReplicate(error)
+        monkeypatch.setattr(replicate, "async_run", fake.async_run)
+        return fake
+    return install
+
+def _input() -> dict:
+    return {"prompt": uuid.uuid4().hex}
+
+async def _started(count: int, input_data: dict) -> list:
+    tasks = [asyncio.create_task(run_model(MODEL, input_data)) for _ in range(count)]
+    # Let every caller reach the shared call
+    await asyncio.sleep(0.05)
+    return tasks
+
+def test_concurrent_callers_share_one_prediction(gated):
+    async def scenario():
+        fake = gated()
+        tasks = await _started(8, _input())
+        fake.release.set()
+        return await asyncio.gather(*tasks), fake.calls
+
+    results, calls = asyncio.run(scenario())
+    assert calls == 1
+    assert all(urls == results[0] for urls in results)
+    assert not cache._in_flight
+
+def test_cancelled_waiter_does_not_cancel_the_shared_call(gated):
+    async def scenario():
+        fake = gated()
+        tasks = await _started(3, _input())
+        tasks[0].cancel()
+        await asyncio.sleep(0)
+        fake.release.set()
+        outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+        return outcomes, fake.calls
+
+    outcomes, calls = asyncio.run(scenario())
+    assert isinstance(outcomes[0], asyncio.CancelledError)
+    assert outcomes[1] == outcomes[2] and outcomes[1][0].startswith("https://replicate.delivery/")
+    assert calls == 1
+
+def test_failure_reaches_every_waiter_and_is_not_cached(gated):
+    input_data = _input()
+
+    async def scenario():
+        failing = gated(RuntimeError("model crashed"))
+        tasks = await _started(4, input_data)
+        failing.release.set()
+        outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+        assert not cache._in_flight
+
+        # The same call afterwards runs again rather than replaying the error
+        working = gated()
+        working.release.set()
+        return outcomes, failing.calls, await run_model(MODEL, input_data), working.calls
+
+    outcomes, failing_calls, retried, working_calls = asyncio.run(scenario())
+    assert failing_calls == 1
+    assert all(isinstance(outcome, RuntimeError) and str(outcome) == "model crashed" for outcome in outcomes)
+    assert working_calls == 1
+    assert retried[0].startswith("https://replicate.delivery/")
@@ -0,0 +1,177 @@
+import os
+import time
+import sys
+import asyncio
+import hashlib
+from types import ModuleType
+import pytest
+from fastapi.testclient import TestClient
+from model import storage
+from main import app
+
+client = TestClient(app)
+
+KEY = hashlib.sha256(b"https://replicate.delivery/a.png").hexdigest() + ".png"
+BODY = bytes(range(256)) * 40
+
+@pytest.fixture
+def local_media(tmp_path, monkeypatch):
+    local = storage.LocalOutputStorage(str(tmp_path), "http://test/media")
+    (tmp_path / KEY).write_bytes(BODY)
+    monkeypatch.setattr(storage, "output_storage", local)
+    return local
+
+def test_range_request(local_media):
+    response = client.get(f"/media/{KEY}", headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == f"bytes 10-19/{len(BODY)}"
+    assert response.content == BODY[10:20]
+
+def test_suffix_range(local_media):
+    response = client.get(f"/media/{KEY}", headers={"Range": "bytes=-5"})
+    assert response.status_code == 206
+    assert response.content == BODY[-5:]
+
+@pytest.mark.parametrize("header", ["bytes=20-10", "bytes=-", "items=0-5", "bytes=0-1,4-5"])
+def test_invalid_range_is_ignored(local_media, header):
+    response = client.get(f"/media/{KEY}", headers={"Range": header})
+    assert response.status_code == 200
+    assert response.content == BODY
+
+def test_range_past_the_end_is_refused(local_media):
+    response = client.get(f"/media/{KEY}", headers={"Range": f"bytes={len(BODY)}-"})
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == f"bytes */{len(BODY)}"
+
+def test_etag_revalidation(local_media):
+    etag = client.get(f"/media/{KEY}").headers["ETag"]
+    assert client.get(f"/media/{KEY}", headers={"If-None-Match": etag}).status_code == 304
+
+class FakeS3:
+    """
+    Stands in for an S3-compatible server: keeps objects in memory and
+    enforces the multipart rule that every part but the last is >= 5 MiB.
+    """
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.aborted = []
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise KeyError(Key)
+        return {}
+
+    def create_multipart_upload(self, Bucket, Key, ContentType, CacheControl):
+        upload_id = f"upload-{len(self.uploads)}"
+        self.uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.uploads[UploadId][PartNumber] = Body
+        return {"ETag": hashlib.md5(Body).hexdigest()}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        numbers = [p["PartNumber"] for p in MultipartUpload["Parts"]]
+        assert numbers == sorted(parts)
+        assert all(len(parts[n]) >= 5 * 1024 * 1024 for n in numbers[:-1])
+        self.objects[(Bucket, Key)] = b"".join(parts[n] for n in numbers)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId, None)
+        self.aborted.append(UploadId)
+
+@pytest.fixture
+def s3(monkeypatch):
+    fake = FakeS3()
+    boto3 = ModuleType("boto3")
+    boto3.client = lambda service, endpoint_url=None, region_name=None: fake
+    monkeypatch.setitem(sys.modules, "boto3", boto3)
+    return fake, storage.S3OutputStorage("outputs", "http://minio:9000", None, None)
+
+async def _chunks(total: int, size: int = 1024 * 1024):
+    for offset in range(0, total, size):
+        yield bytes([offset // size % 256]) * min(size, total - offset)
+
+def test_s3_multipart_upload(s3):
+    fake, bucket = s3
+    total = 12 * 1024 * 1024 + 123
+    asyncio.run(bucket.store("k.mp4", _chunks(total)))
+    assert len(fake.objects[("outputs", "k.mp4")]) == total
+    assert asyncio.run(bucket.exists("k.mp4"))
+    assert bucket.url("k.mp4") == "http://minio:9000/outputs/k.mp4"
+
+def test_s3_empty_object(s3):
+    fake, bucket = s3
+    asyncio.run(bucket.store("empty.png", _chunks(0)))
+    assert fake.objects[("outputs", "empty.png")] == b""
+
+def test_s3_failed_upload_is_aborted(s3):
+    fake, bucket = s3
+
+    async def broken():
+        yield b"x" * (6 * 1024 * 1024)
+        raise ConnectionError("source went away")
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(bucket.store("k.mp4", broken()))
+    assert fake.aborted == ["upload-0"]
+    assert not asyncio.run(bucket.exists("k.mp4"))
+
+def test_default_directory_is_next_to_the_code():
+    assert storage.OUTPUT_MIRROR_DIR == os.path.join(storage.APP_ROOT, "media")
+
+def test_relative_urls_use_the_request_host(tmp_path, monkeypatch):
+    local = storage.LocalOutputStorage(str(tmp_path), "/media")
+    monkeypatch.setattr(storage, "output_storage", None)
+    monkeypatch.setattr(storage, "_hosted_fallback", local)
+    (tmp_path / KEY).write_bytes(BODY)
+
+    async def in_request():
+        storage.set_request_origin("http://api.example:8000/")
+        return local.url(KEY)
+
+    url = asyncio.run(in_request())
+    assert url == f"http://api.example:8000/media/{KEY}"
+    # Outside a request there is no host to use
+    assert local.url(KEY) == f"/media/{KEY}"
+
+    async def resolve():
+        storage.set_request_origin("http://api.example:8000")
+        return storage.local_path(url)
+
+    assert asyncio.run(resolve()) == str(tmp_path / KEY)
+
+def test_files_from_an_earlier_run_are_served(tmp_path, monkeypatch):
+    # With the mirror off, /media serves OUTPUT_MIRROR_DIR before anything is stitched
+    monkeypatch.setattr(storage, "output_storage", None)
+    monkeypatch.setattr(storage, "_hosted_fallback", None)
+    monkeypatch.setattr(storage, "OUTPUT_MIRROR_DIR", str(tmp_path))
+    (tmp_path / KEY).write_bytes(BODY)
+    assert client.get(f"/media/{KEY}").content == BODY
+
+def _write(directory, name: str, size: int, age_seconds: float) -> None:
+    path = directory / name
+    path.write_bytes(b"x" * size)
+    stamp = time.time() - age_seconds
+    os.utime(path, (stamp, stamp))
+
+def test_sweep_deletes_old_files(tmp_path):
+    _write(tmp_path, "old.wav", 10, 3600)
+    _write(tmp_path, "stale.part", 10, 3600)
+    _write(tmp_path, "new.wav", 10, 60)
+    local = storage.LocalOutputStorage(str(tmp_path), "/media")
+    assert local.sweep(max_age_seconds=600, max_bytes=0) == 2
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["new.wav"]
+
+def test_sweep_keeps_the_newest_files_within_the_size_limit(tmp_path):
+    for age in range(5):
+        _write(tmp_path, f"{age}.wav", 100, age * 10)
+    local = storage.LocalOutputStorage(str(tmp_path), "/media")
+    assert local.sweep(max_age_seconds=0, max_bytes=250) == 3
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["0.wav", "1.wav"]
+
+def test_sweep_leaves_s3_alone(monkeypatch):
+    monkeypatch.setattr(storage, "output_storage", object())
+    assert asyncio.run(storage.sweep_local_media()) == 0
@@ -0,0 +1,42 @@
+import asyncio
+from eth_account import Account
+from x402.ledger import ledger
+from x402.payment import Payment
+from x402.credits import FailedModelCredits
+from model.txt2img import ModelResult, summarize_results
+from main import sse_response
+
+def _charge(units: int) -> Payment:
+    payer = Account.create().address
+    return Payment(method="credits", payer=payer, reference=f"test:{payer}", units=units, paid_units=units)
+
+def test_refund_survives_client_disconnect():
+    charge = _charge(80000)
+    credits = FailedModelCredits(charge)
+
+    async def results():
+        yield ModelResult(model_name="a", image_urls=[], cost_usd=0.03, credited_usd=0.03, status="error")
+        yield ModelResult(model_name="b", image_urls=["https://x/b.png"], cost_usd=0.05, status="success")
+
+    async def scenario():
+        response = sse_response(results(), summarize_results, lambda result: credits.add(result.credited_usd))
+        events = response.body_iterator
+        first = await events.__anext__()
+        # The client goes away after the first event
+        await events.aclose()
+        return first, await ledger.balance(charge.payer)
+
+    first, balance = asyncio.run(scenario())
+    assert first.startswith("event: result")
+    assert balance == 30000
+
+def test_credits_never_exceed_the_charge():
+    charge = _charge(40000)
+    credits = FailedModelCredits(charge)
+
+    async def scenario():
+        await credits.add(0.03)
+        await credits.add(0.03)
+        return await ledger.balance(charge.payer)
+
+    assert asyncio.run(scenario()) == 40000
@@ -0,0 +1,59 @@
+import time
+from model import tts
+from model.tokens import normalize_text, count_tokens
+from x402.pricing import tts_price_units
+
+def test_literal_comparisons_are_billed():
+    assert normalize_text("a < b and c > d") == "a < b and c > d"
+    assert normalize_text("if x<y or y>z") == "if x<y or y>z"
+
+def test_ssml_is_not_billed():
+    text = '<?xml version="1.0"?><speak>Hello <break time="500ms"/> <prosody rate="slow">world</prosody></speak>'
+    assert normalize_text(text) == "Hello world"
+    assert normalize_text('<amazon:effect name="whispered">psst</amazon:effect>') == "psst"
+
+def test_whitespace_runs_count_once():
+    normalized = normalize_text("  one\t\ttwo\n\nthree  four ")
+    assert normalized == "one two three four"
+    assert count_tokens(normalized, "words") == 4
+    assert count_tokens(normalized, "bytes") == len(normalized)
+
+# A single C-level pass over the text: the floor for any normalization
+_ONE_PASS = str.maketrans("\t\n\x0b\x0c\r", "     ")
+
+def _best_ratio(text: str, runs: int = 50) -> float:
+    # Best of several interleaved runs, as timeit reports, so scheduler noise
+    # and CPU frequency changes hit both sides alike
+    best_normalize = best_baseline = float("inf")
+    for _ in range(runs):
+        started = time.perf_counter()
+        normalize_text(text)
+        best_normalize = min(best_normalize, time.perf_counter() - started)
+        started = time.perf_counter()
+        text.translate(_ONE_PASS)
+        best_baseline = min(best_baseline, time.perf_counter() - started)
+    return best_normalize / best_baseline
+
+def test_normalizing_100kb_benchmark():
+    prose = ("The quick brown fox jumps over the lazy dog.  \n" * 2200)[:100 * 1024]
+    ssml = ('Stay calm. <break time="1s"/> <prosody rate="slow">a < b and c > d</prosody>\n' * 1400)[:100 * 1024]
+    # Within a small multiple of one pass over the text; the SSML sample has a
+    # tag every 25 characters, far denser than real input
+    assert _best_ratio(prose) < 20
+    assert _best_ratio(ssml) < 40
+
+def test_token_count_is_computed_once_per_request(monkeypatch):
+    calls = []
+
+    def counting_normalize(text):
+        calls.append(text)
+        return normalize_text(text)
+
+    monkeypatch.setattr(tts, "normalize_text", counting_normalize)
+    request = tts.TTSRequest(text="Hello  world. " * 1000, models=list(tts.TTS_MODEL_REGISTRY))
+    # Pricing, the quote and every model's result all ask for the count
+    tts_price_units(request.models, request)
+    tts_price_units(request.models, request)
+    for model_name in request.models:
+        tts.calculate_tts_cost(model_name, request)
+    assert len(calls) == 1
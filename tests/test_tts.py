@@ -0,0 +1,63 @@
+import io
+import wave
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from model import tts, storage
+from main import app
+
+client = TestClient(app)
+
+def _wav(samples: bytes) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(24000)
+        w.writeframes(samples)
+    return buffer.getvalue()
+
+CHUNKS = {
+    "https://replicate.delivery/1.wav": _wav(b"\x01\x00" * 100),
+    "https://replicate.delivery/2.wav": _wav(b"\x02\x00" * 50),
+}
+
+@pytest.fixture
+def chunk_audio(tmp_path, monkeypatch):
+    async def fetch(url):
+        yield CHUNKS[url]
+
+    monkeypatch.setattr(tts, "iter_url_bytes", fetch)
+    # OUTPUT_MIRROR is off in tests; stitched audio lands in the app's own media dir
+    monkeypatch.setattr(storage, "_hosted_fallback", storage.LocalOutputStorage(str(tmp_path), "http://test/media"))
+
+def test_chunks_are_stitched_without_a_mirror(chunk_audio):
+    assert storage.output_storage is None
+    urls = asyncio.run(tts.stitch_chunk_urls("kokoro-82m", list(CHUNKS)))
+    assert len(urls) == 1
+
+    response = client.get("/media/" + urls[0].rsplit("/", 1)[1])
+    assert response.status_code == 200
+    with wave.open(io.BytesIO(response.content)) as w:
+        assert w.getnframes() == 150
+        assert w.readframes(150) == b"\x01\x00" * 100 + b"\x02\x00" * 50
+
+def test_stitch_failure_is_logged(chunk_audio, monkeypatch, caplog):
+    monkeypatch.setitem(CHUNKS, "https://replicate.delivery/2.wav", b"not audio")
+    urls = asyncio.run(tts.stitch_chunk_urls("kokoro-82m", list(CHUNKS)))
+    assert urls == list(CHUNKS)
+    assert "Stitching 2 kokoro-82m chunks failed" in caplog.text
+
+def test_first_chunk_cap_applies_to_mid_length_text():
+    # 328 characters: under TTS_CHUNK_MAX_CHARS, over the streaming first-chunk cap
+    text = " ".join(f"Sentence number {i} is here." for i in range(12)).strip()[:328]
+    assert tts.TTS_STREAM_FIRST_CHUNK_CHARS < len(text) <= tts.TTS_CHUNK_MAX_CHARS
+    chunks = tts.split_text(text, first_max_chars=tts.TTS_STREAM_FIRST_CHUNK_CHARS)
+    assert len(chunks) > 1
+    assert len(chunks[0]) <= tts.TTS_STREAM_FIRST_CHUNK_CHARS
+    assert all(len(chunk) <= tts.TTS_CHUNK_MAX_CHARS for chunk in chunks)
+    assert " ".join(chunks) == text
+
+def test_short_text_is_one_chunk():
+    assert tts.split_text("Hello there.", first_max_chars=150) == ["Hello there."]
+    assert tts.split_text("   ") == []
@@ -0,0 +1,59 @@
+"""
+Micro-benchmark of payment verification against a local stub RPC node with
+a fixed 20 ms latency: a cold verification costs one receipt call, and any
+later lookup of the same receipt is served from memory.
+"""
+import time
+import asyncio
+import secrets
+import statistics
+from x402 import payment
+from x402.rpc import RpcPool
+from stub_rpc import StubRpcNode
+
+RPC_DELAY_SECONDS = 0.02
+PAYER = "0x00000000000000000000000000000000000000B2"
+SAMPLES = 50
+
+def _percentiles(samples):
+    ordered = sorted(samples)
+    return statistics.median(ordered), ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+
+def test_verification_latency(monkeypatch):
+    monkeypatch.setattr(payment, "RECEIPT_CACHE", type(payment.RECEIPT_CACHE)())
+
+    async def scenario():
+        node = await StubRpcNode(delay=RPC_DELAY_SECONDS).start()
+        pool = RpcPool([node.url])
+        monkeypatch.setattr(payment, "rpc_pool", pool)
+        hashes = ["0x" + secrets.token_hex(32) for _ in range(SAMPLES)]
+        for tx_hash in hashes:
+            node.add_transfer(tx_hash, PAYER, 1000)
+        try:
+            cold = []
+            for tx_hash in hashes:
+                started = time.perf_counter()
+                charged = await payment.verify_usdc_payment(1000, tx_hash)
+                cold.append(time.perf_counter() - started)
+                assert charged.paid_units == 1000
+            warm = []
+            for tx_hash in hashes:
+                started = time.perf_counter()
+                await payment.get_decoded_receipt(tx_hash)
+                warm.append(time.perf_counter() - started)
+            return cold, warm, node.calls
+        finally:
+            await pool.close()
+            await node.stop()
+
+    cold, warm, rpc_calls = asyncio.run(scenario())
+    cold_p50, cold_p99 = _percentiles(cold)
+    warm_p50, warm_p99 = _percentiles(warm)
+    print(f"\nverify (cold, {RPC_DELAY_SECONDS * 1000:g} ms RPC): p50 {cold_p50 * 1000:.1f} ms, p99 {cold_p99 * 1000:.1f} ms; "
+          f"cached receipt: p50 {warm_p50 * 1e6:.0f} us, p99 {warm_p99 * 1e6:.0f} us")
+
+    # One RPC round trip per payment, none for repeats
+    assert rpc_calls == SAMPLES
+    # Verification adds little on top of the node's own latency
+    assert cold_p50 < RPC_DELAY_SECONDS + 0.03
+    assert warm_p99 < 0.002
@@ -0,0 +1,177 @@
+import time
+import uuid
+import asyncio
+import sqlite3
+import pytest
+from types import SimpleNamespace
+from urllib.parse import urlparse, parse_qs
+from jobs import video
+from jobs.store import Job, InMemoryJobStore, SQLiteJobStore, job_store
+from model.img2vid import VideoGenerationRequest
+
+def _request() -> VideoGenerationRequest:
+    return VideoGenerationRequest(prompt=uuid.uuid4().hex, models=["ltx-video"])
+
+def test_webhook_before_prediction_id_is_attached(monkeypatch):
+    monkeypatch.setattr(video, "PUBLIC_BASE_URL", "http://test")
+    monkeypatch.setattr(video, "start_poller", lambda job_id: None)
+
+    async def fast_prediction(model_name, request, webhook):
+        # Replicate finishes and calls back before async_create has even returned
+        query = parse_qs(urlparse(webhook).query)
+        job_id = urlparse(webhook).path.rsplit("/", 1)[1]
+        payload = {"id": "p1", "status": "succeeded", "output": ["https://replicate.delivery/v.mp4"]}
+        assert await video.handle_replicate_webhook(job_id, query["token"][0], payload, query["model"][0])
+        return SimpleNamespace(id="p1", status="starting")
+
+    monkeypatch.setattr(video, "create_video_prediction", fast_prediction)
+
+    async def scenario():
+        submitted = await video.submit_video_job(_request())
+        return await job_store.get(submitted.job_id)
+
+    job = asyncio.run(scenario())
+    state = job.predictions["ltx-video"]
+    assert state.prediction_id == "p1"
+    assert state.status == "succeeded"
+    assert job.status == "completed"
+    assert job.result["results"][0]["video_urls"] == ["https://replicate.delivery/v.mp4"]
+
+def test_update_for_model_removed_by_reload(monkeypatch):
+    monkeypatch.setattr(video, "start_poller", lambda job_id: None)
+
+    async def prediction(model_name, request, webhook):
+        return SimpleNamespace(id="p2", status="starting")
+
+    monkeypatch.setattr(video, "create_video_prediction", prediction)
+
+    async def scenario():
+        submitted = await video.submit_video_job(_request())
+        # The model disappears from the registry while its prediction runs
+        monkeypatch.setattr(video, "VIDEO_MODEL_REGISTRY", {})
+        return await video.apply_prediction_update(
+            submitted.job_id, "p2", "succeeded", ["https://replicate.delivery/w.mp4"]
+        )
+
+    job = asyncio.run(scenario())
+    result = job.result["results"][0]
+    assert result["status"] == "success"
+    assert result["video_urls"] == ["https://replicate.delivery/w.mp4"]
+    assert result["cost_usd"] == 0.08
+
+def _running_job() -> Job:
+    now = time.time()
+    return Job(
+        job_id=uuid.uuid4().hex, kind="video", status="running", created_at=now, updated_at=now,
+        request=_request().model_dump(), predictions={}, webhook_token="t"
+    )
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return InMemoryJobStore()
+    return SQLiteJobStore(str(tmp_path / "jobs.sqlite3"))
+
+def test_one_worker_holds_a_job_lease(store):
+    job = _running_job()
+
+    async def scenario():
+        await store.create(job)
+        first = await store.claim(job.job_id, "worker-a", 60)
+        second = await store.claim(job.job_id, "worker-b", 60)
+        renewed = await store.claim(job.job_id, "worker-a", 60)
+        return first, second, renewed
+
+    assert asyncio.run(scenario()) == (True, False, True)
+
+def test_expired_lease_is_taken_over(store):
+    job = _running_job()
+
+    async def scenario():
+        await store.create(job)
+        await store.claim(job.job_id, "worker-a", 0.01)
+        await asyncio.sleep(0.02)
+        return await store.claim(job.job_id, "worker-b", 60), await store.claim(job.job_id, "worker-a", 60)
+
+    assert asyncio.run(scenario()) == (True, False)
+
+def test_completed_job_cannot_be_claimed(store):
+    job = _running_job()
+
+    async def scenario():
+        await store.create(job)
+        await store.update(job.job_id, lambda j: setattr(j, "status", "completed"))
+        return await store.claim(job.job_id, "worker-a", 60)
+
+    assert asyncio.run(scenario()) is False
+
+def test_job_file_from_before_leases_is_upgraded(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE jobs (job_id TEXT PRIMARY KEY, status TEXT NOT NULL, data TEXT NOT NULL, updated_at REAL NOT NULL)")
+    job = _running_job()
+    conn.execute("INSERT INTO jobs VALUES (?, ?, ?, ?)", (job.job_id, job.status, job.model_dump_json(), job.updated_at))
+    conn.commit()
+    conn.close()
+    assert asyncio.run(SQLiteJobStore(path).claim(job.job_id, "worker-a", 60))
+
+def test_only_one_worker_polls_a_resumed_job(monkeypatch):
+    polled = []
+    monkeypatch.setattr(video, "start_poller", lambda job_id: polled.append((video.WORKER_ID, job_id)))
+    monkeypatch.setattr(video, "job_store", InMemoryJobStore())
+    job = _running_job()
+
+    async def scenario():
+        await video.job_store.create(job)
+        adopted = []
+        # Two workers start up against the same running job
+        for worker in ("worker-a", "worker-b"):
+            monkeypatch.setattr(video, "WORKER_ID", worker)
+            adopted.append(await video.adopt_video_jobs())
+        return adopted
+
+    assert asyncio.run(scenario()) == [1, 0]
+    assert polled == [("worker-a", job.job_id)]
+
+def test_poller_stops_when_another_worker_holds_the_lease(monkeypatch):
+    monkeypatch.setattr(video, "VIDEO_JOB_POLL_SECONDS", 0.01)
+    monkeypatch.setattr(video, "job_store", InMemoryJobStore())
+    job = _running_job()
+
+    async def scenario():
+        await video.job_store.create(job)
+        await video.job_store.claim(job.job_id, "another-worker", 60)
+        # Returns instead of polling Replicate, which is not reachable here
+        await asyncio.wait_for(video.poll_video_job(job.job_id), 1)
+
+    asyncio.run(scenario())
+
+def test_duplicate_webhook_is_not_mirrored_again(monkeypatch):
+    mirrored = []
+
+    async def mirror(urls):
+        mirrored.append(urls)
+        return [f"https://media.test/{len(mirrored)}.mp4"]
+
+    async def previews(urls):
+        return {}
+
+    async def prediction(model_name, request, webhook):
+        return SimpleNamespace(id="p3", status="starting")
+
+    monkeypatch.setattr(video, "output_storage", object())
+    monkeypatch.setattr(video, "mirror_urls", mirror)
+    monkeypatch.setattr(video, "video_previews", previews)
+    monkeypatch.setattr(video, "start_poller", lambda job_id: None)
+    monkeypatch.setattr(video, "create_video_prediction", prediction)
+
+    async def scenario():
+        submitted = await video.submit_video_job(_request())
+        output = ["https://replicate.delivery/x.mp4"]
+        await video.apply_prediction_update(submitted.job_id, "p3", "succeeded", output)
+        # Replicate retries the webhook
+        return await video.apply_prediction_update(submitted.job_id, "p3", "succeeded", output)
+
+    job = asyncio.run(scenario())
+    assert len(mirrored) == 1
+    assert job.result["results"][0]["video_urls"] == ["https://media.test/1.mp4"]
@@ -0,0 +1,272 @@
+import os
+import re
+import time
+import asyncio
+import uuid
+import hashlib
+from typing import Optional
+from pydantic import BaseModel
+from dotenv import load_dotenv
+from eth_account import Account
+from eth_account.messages import encode_defunct
+from eth_utils import to_checksum_address
+from fastapi import Header, HTTPException, Request, Depends
+from x402.ledger import ledger
+from x402.payment import (
+    Payment,
+    verify_usdc_payment,
+    verify_usdc_deposit,
+    usd_to_units,
+    RECEIVING_WALLET_ADDRESS
+)
+from model.metrics import PAYMENT_SECONDS, timed, record_cost
+
+load_dotenv()
+
+# --- CONFIGURATION ---
+# Longest a credit signature may stay valid; X-Credit-Expires must fall within this
+CREDIT_AUTH_MAX_AGE_SECONDS = int(os.getenv("CREDIT_AUTH_MAX_AGE_SECONDS", "300"))
+
+# The text a wallet signs (EIP-191 personal_sign) for one request that spends
+# or reads its credits; see `credit_auth_message`
+CREDIT_AUTH_MESSAGE_FORMAT = (
+    "x402 prepaid credits\n"
+    "wallet: {address}\n"
+    "receiver: {receiver}\n"
+    "request: {request_digest}\n"
+    "nonce: {nonce}\n"
+    "expires: {expires}"
+)
+
+_NONCE_PATTERN = re.compile(r"^[A-Za-z0-9_-]{16,128}$")
+
+class CreditAuth(BaseModel):
+    """
+    Credit headers of one request, plus the digest of the request they sign.
+    """
+    address: Optional[str] = None
+    signature: Optional[str] = None
+    nonce: Optional[str] = None
+    expires: Optional[int] = None
+    request_digest: str = ""
+
+class PaymentHeaders(BaseModel):
+    tx: Optional[str] = None
+    quote: Optional[str] = None
+    wait_seconds: Optional[float] = None
+    credit: CreditAuth = CreditAuth()
+
+    def uses_credits(self) -> bool:
+        return bool(self.credit.address or self.credit.signature)
+
+async def http_request_digest(request: Request) -> str:
+    """
+    What a credit signature is bound to: the hex sha256 of "<METHOD> <path>",
+    a newline, and the exact request body bytes.
+    """
+    body = await request.body()
+    return hashlib.sha256(f"{request.method} {request.url.path}\n".encode("utf-8") + body).hexdigest()
+
+async def credit_auth(
+    request: Request,
+    x_credit_address: Optional[str] = Header(None, alias="X-Credit-Address"),
+    x_credit_signature: Optional[str] = Header(None, alias="X-Credit-Signature"),
+    x_credit_nonce: Optional[str] = Header(None, alias="X-Credit-Nonce"),
+    x_credit_expires: Optional[int] = Header(None, alias="X-Credit-Expires")
+) -> CreditAuth:
+    """
+    Dependency collecting the credit headers of a request.
+    """
+    signed = bool(x_credit_address or x_credit_signature)
+    return CreditAuth(
+        address=x_credit_address,
+        signature=x_credit_signature,
+        nonce=x_credit_nonce,
+        expires=x_credit_expires,
+        request_digest=await http_request_digest(request) if signed else ""
+    )
+
+def payment_headers(
+    x_payment_tx: Optional[str] = Header(None, alias="X-Payment-Tx"),
+    x_payment_wait: Optional[float] = Header(None, alias="X-Payment-Wait"),
+    x_payment_quote: Optional[str] = Header(None, alias="X-Payment-Quote"),
+    credit: CreditAuth = Depends(credit_auth)
+) -> PaymentHeaders:
+    """
+    Dependency collecting the payment headers of a paid request: either an
+    on-chain `X-Payment-Tx`, or the `X-Credit-*` headers to spend prepaid
+    credits. `X-Payment-Quote` optionally carries a quote id from POST /quote.
+    """
+    return PaymentHeaders(
+        tx=x_payment_tx,
+        quote=x_payment_quote,
+        wait_seconds=x_payment_wait,
+        credit=credit
+    )
+
+def credit_auth_message(address: str, request_digest: str, nonce: str, expires: int) -> str:
+    """
+    The text a wallet signs to authorize one request: bound to that request's
+    digest, single-use (nonce) and short-lived (expiry, unix seconds).
+    """
+    return CREDIT_AUTH_MESSAGE_FORMAT.format(
+        address=to_checksum_address(address),
+        receiver=RECEIVING_WALLET_ADDRESS,
+        request_digest=request_digest,
+        nonce=nonce,
+        expires=expires
+    )
+
+async def authenticate_credit_wallet(auth: CreditAuth) -> str:
+    """
+    Check that the credit signature was made by its address over
+    `credit_auth_message` for this request, has not expired and was not used
+    before. Returns the checksum address; raises 401 otherwise.
+    """
+    if not auth.address or not auth.signature or not auth.nonce or auth.expires is None:
+        raise HTTPException(
+            status_code=401,
+            detail="X-Credit-Address, X-Credit-Signature, X-Credit-Nonce and X-Credit-Expires are required."
+        )
+    try:
+        address = to_checksum_address(auth.address)
+    except Exception:
+        raise HTTPException(status_code=401, detail="Invalid X-Credit-Address.")
+    if not _NONCE_PATTERN.match(auth.nonce):
+        raise HTTPException(status_code=401, detail="X-Credit-Nonce must be 16-128 characters of [A-Za-z0-9_-].")
+
+    now = time.time()
+    if auth.expires < now:
+        raise HTTPException(status_code=401, detail="X-Credit-Signature has expired; sign the request again.")
+    if auth.expires > now + CREDIT_AUTH_MAX_AGE_SECONDS:
+        raise HTTPException(
+            status_code=401,
+            detail=f"X-Credit-Expires may be at most {CREDIT_AUTH_MAX_AGE_SECONDS} seconds ahead."
+        )
+
+    message = credit_auth_message(address, auth.request_digest, auth.nonce, auth.expires)
+    try:
+        signer = Account.recover_message(encode_defunct(text=message), signature=auth.signature)
+    except Exception:
+        signer = None
+    if signer != address:
+        raise HTTPException(
+            status_code=401,
+            detail="X-Credit-Signature does not match X-Credit-Address for this request, nonce and expiry."
+        )
+
+    # Claimed only after the signature checks out, so nobody can burn another wallet's nonces
+    if not await ledger.claim_nonce(address, auth.nonce, auth.expires):
+        raise HTTPException(status_code=401, detail="X-Credit-Nonce has already been used.")
+    return address
+
+async def deposit_credits(x_payment_tx: str, wait_seconds: Optional[float] = None) -> dict:
+    """
+    Spend an on-chain transfer as a deposit; each sender is credited what it sent.
+    """
+    deposits = await verify_usdc_deposit(x_payment_tx, wait_seconds)
+    tx_hash = x_payment_tx.strip().lower()
+
+    balances = {}
+    for address, units in deposits.items():
+        balances[address] = await ledger.credit(address, units, "deposit", tx_hash)
+    return balances
+
+async def _collect_payment(required_units: int, payment: PaymentHeaders) -> Payment:
+    """
+    Charge a request either from an on-chain payment or, without one, from
+    prepaid credits (credit headers). Any on-chain overpayment is kept as credit.
+    An on-chain underpayment is made up from the sender's existing credit only
+    when the request also carries a valid credit signature from that sender.
+    """
+    if payment.tx:
+        return await _collect_onchain_payment(required_units, payment)
+
+    if not payment.uses_credits():
+        raise HTTPException(
+            status_code=402,
+            detail="Payment required: send X-Payment-Tx, or the X-Credit-* headers."
+        )
+
+    address = await authenticate_credit_wallet(payment.credit)
+    reference = f"request:{uuid.uuid4().hex}"
+    balance = await ledger.debit(address, required_units, "debit", reference)
+    if balance is None:
+        available = await ledger.balance(address)
+        raise HTTPException(
+            status_code=402,
+            detail=f"Insufficient credits. Required: {required_units} units, available: {available} units."
+        )
+    return Payment(
+        method="credits",
+        payer=address,
+        reference=reference,
+        units=required_units,
+        paid_units=required_units
+    )
+
+async def _collect_onchain_payment(required_units: int, payment: PaymentHeaders) -> Payment:
+    # Anyone can see a transfer and submit its hash, so a short transfer may only
+    # draw on the credits of a wallet that signed this very request
+    shortfall_payer = await authenticate_credit_wallet(payment.credit) if payment.uses_credits() else None
+
+    verified = await verify_usdc_payment(required_units, payment.tx, payment.wait_seconds, shortfall_payer)
+    surplus = verified.paid_units - verified.units
+    if surplus > 0:
+        await ledger.credit(verified.payer, surplus, "overpayment", verified.reference)
+    elif surplus < 0:
+        # Short transfers are topped up from the sender's credits (e.g. refunds for failed models)
+        shortfall = -surplus
+        if await ledger.debit(verified.payer, shortfall, "applied", verified.reference) is None:
+            # The transfer is already spent, so keep it as credit rather than losing it
+            balance = await ledger.credit(verified.payer, verified.paid_units, "deposit", verified.reference)
+            raise HTTPException(
+                status_code=402,
+                detail=f"Insufficient payment. Required: {required_units} units, transferred: "
+                       f"{verified.paid_units} units; the transfer was credited to {verified.payer} "
+                       f"(balance: {balance} units)."
+            )
+    return verified
+
+async def collect_payment(required_units: int, payment: PaymentHeaders) -> Payment:
+    """
+    Charge a request (see `_collect_payment`), recording how long it took and
+    what was charged for the metrics and response headers.
+    """
+    method = "onchain" if payment.tx else "credits"
+    with timed("payment", PAYMENT_SECONDS, method=method, outcome="rejected") as labels:
+        charged = await _collect_payment(required_units, payment)
+        labels["outcome"] = "ok"
+    record_cost(required_units)
+    return charged
+
+async def credit_failed_models(payment: Payment, credited_usd: float, reference: Optional[str] = None) -> int:
+    """
+    Credit the price of models that failed back to the payer; the balance is
+    applied to their next request. Returns the units credited.
+    """
+    # Never credit more than this request was charged
+    units = min(usd_to_units(credited_usd), payment.units)
+    if units <= 0:
+        return 0
+    # Shielded so a client disconnecting mid-write cannot cancel the refund
+    await asyncio.shield(ledger.credit(payment.payer, units, "refund", reference or payment.reference))
+    return units
+
+class FailedModelCredits:
+    """
+    Credits failed models back one at a time as their results are produced,
+    so a stream the client abandons keeps the refunds already earned. The
+    running total never exceeds what the request was charged.
+    """
+    def __init__(self, payment: Payment):
+        self.payment = payment
+        self.credited_units = 0
+
+    async def add(self, credited_usd: float) -> int:
+        units = min(usd_to_units(credited_usd), self.payment.units - self.credited_units)
+        if units <= 0:
+            return 0
+        self.credited_units += units
+        await asyncio.shield(ledger.credit(self.payment.payer, units, "refund", self.payment.reference))
+        return units
@@ -0,0 +1,118 @@
+import os
+import asyncio
+from collections import deque
+from typing import Optional, Dict
+from dotenv import load_dotenv
+from eth_utils import to_checksum_address
+from hexbytes import HexBytes
+from web3 import Web3
+from x402.rpc import rpc_pool
+
+load_dotenv()
+
+# --- CONFIGURATION ---
+PAYMENT_INDEXER_ENABLED = os.getenv("PAYMENT_INDEXER_ENABLED", "true").lower() == "true"
+# Blocks indexed behind the head on startup
+PAYMENT_INDEXER_BACKFILL_BLOCKS = int(os.getenv("PAYMENT_INDEXER_BACKFILL_BLOCKS", "2000"))
+# Blocks kept in memory; older payments fall back to a receipt lookup
+PAYMENT_INDEXER_RETAIN_BLOCKS = int(os.getenv("PAYMENT_INDEXER_RETAIN_BLOCKS", "20000"))
+# Widest eth_getLogs range per call (public Avalanche RPCs cap this at 2048)
+PAYMENT_INDEXER_MAX_RANGE = int(os.getenv("PAYMENT_INDEXER_MAX_RANGE", "2048"))
+PAYMENT_INDEXER_POLL_SECONDS = float(os.getenv("PAYMENT_INDEXER_POLL_SECONDS", "2"))
+
+# keccak("Transfer(address,address,uint256)")
+TRANSFER_TOPIC = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+
+class PaymentIndexer:
+    """
+    Tails USDC `Transfer` logs addressed to the receiving wallet with eth_getLogs
+    and keeps tx hash -> decoded payment in memory, in the same shape as a
+    decoded receipt. Verification then needs no RPC call for indexed payments.
+    """
+    def __init__(self, token_address: str, receiving_address: str):
+        self.token_address = token_address
+        self.receiving_address = receiving_address
+        # Topic filter value for an indexed `to` address: left-padded to 32 bytes
+        self._to_topic = "0x" + "0" * 24 + receiving_address[2:].lower()
+        self._payments: Dict[str, dict] = {}
+        self._by_block = deque()  # (block_number, tx_hash), oldest first
+        self._next_block: Optional[int] = None
+        self._task = None
+
+    def lookup(self, tx_hash: str) -> Optional[dict]:
+        return self._payments.get(tx_hash)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self._task is not None and not self._task.done(),
+            "indexed_transactions": len(self._payments),
+            "indexed_through_block": self._next_block - 1 if self._next_block is not None else None
+        }
+
+    def _add_log(self, log) -> None:
+        tx_hash = Web3.to_hex(HexBytes(log['transactionHash'])).lower()
+        if log.get('removed'):
+            # Dropped by a reorg: forget the payment, so a lookup falls back to
+            # the receipt, which is gone or in its new block if it was re-mined
+            self._payments.pop(tx_hash, None)
+            return
+        block_number = log['blockNumber']
+        transfer = {
+            "from": to_checksum_address(HexBytes(log['topics'][1])[-20:]),
+            "to": self.receiving_address,
+            "value": int.from_bytes(HexBytes(log['data']), "big")
+        }
+        payment = self._payments.get(tx_hash)
+        if payment is None:
+            # Logs only exist for successful transactions, so status is always 1
+            payment = {"status": 1, "block_number": block_number, "transfers": []}
+            self._payments[tx_hash] = payment
+            self._by_block.append((block_number, tx_hash))
+        payment["transfers"].append(transfer)
+
+    def _prune(self, head: int) -> None:
+        oldest_kept = head - PAYMENT_INDEXER_RETAIN_BLOCKS
+        while self._by_block and self._by_block[0][0] < oldest_kept:
+            _, tx_hash = self._by_block.popleft()
+            self._payments.pop(tx_hash, None)
+
+    async def _index_range(self, from_block: int, to_block: int) -> None:
+        logs = await rpc_pool.call(lambda rpc: rpc.eth.get_logs({
+            "address": self.token_address,
+            "fromBlock": from_block,
+            "toBlock": to_block,
+            "topics": [TRANSFER_TOPIC, None, self._to_topic]
+        }))
+        for log in logs:
+            self._add_log(log)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                head = await rpc_pool.call(lambda rpc: rpc.eth.block_number)
+                if self._next_block is None:
+                    self._next_block = max(0, head - PAYMENT_INDEXER_BACKFILL_BLOCKS)
+                while self._next_block <= head:
+                    to_block = min(head, self._next_block + PAYMENT_INDEXER_MAX_RANGE - 1)
+                    await self._index_range(self._next_block, to_block)
+                    self._next_block = to_block + 1
+                self._prune(head)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # RPC hiccup; the same range is retried on the next tick
+                pass
+            await asyncio.sleep(PAYMENT_INDEXER_POLL_SECONDS)
+
+    def start(self) -> None:
+        if PAYMENT_INDEXER_ENABLED and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,175 @@
+import os
+import time
+import sqlite3
+from typing import Optional, List
+from dotenv import load_dotenv
+from model.fanout import run_sqlite
+
+load_dotenv()
+
+# --- CONFIGURATION ---
+CREDIT_LEDGER_PATH = os.getenv("CREDIT_LEDGER_PATH", "credits.sqlite3")
+
+class CreditLedger:
+    """
+    Wallet-keyed prepaid USDC balances (integer units, 6 decimals) in SQLite WAL.
+
+    Every balance change is one transaction that updates `balances` and appends
+    to `ledger_entries`. Triggers make the entries table append-only, so it is a
+    complete audit log. Debits are conditional updates, so concurrent debits from
+    any number of workers can never overdraw a balance. `credit_nonces` holds the
+    single-use nonces of credit signatures until they expire.
+    """
+    def __init__(self, path: str):
+        self._path = path
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS balances (
+                    address TEXT PRIMARY KEY,
+                    units INTEGER NOT NULL CHECK (units >= 0)
+                );
+                CREATE TABLE IF NOT EXISTS ledger_entries (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    address TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    delta_units INTEGER NOT NULL,
+                    balance_units INTEGER NOT NULL,
+                    reference TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS ledger_entries_address ON ledger_entries (address, id);
+                CREATE TRIGGER IF NOT EXISTS ledger_entries_no_update BEFORE UPDATE ON ledger_entries
+                BEGIN SELECT RAISE(ABORT, 'ledger_entries is append-only'); END;
+                CREATE TRIGGER IF NOT EXISTS ledger_entries_no_delete BEFORE DELETE ON ledger_entries
+                BEGIN SELECT RAISE(ABORT, 'ledger_entries is append-only'); END;
+                CREATE TABLE IF NOT EXISTS credit_nonces (
+                    address TEXT NOT NULL,
+                    nonce TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (address, nonce)
+                );
+                CREATE INDEX IF NOT EXISTS credit_nonces_expiry ON credit_nonces (expires_at);
+                """
+            )
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self._path, timeout=30, isolation_level=None)
+        # WAL + NORMAL: durable across process crashes, no fsync on every commit
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _append(self, conn: sqlite3.Connection, address: str, kind: str, delta: int, reference: str) -> int:
+        balance = conn.execute("SELECT units FROM balances WHERE address = ?", (address,)).fetchone()[0]
+        conn.execute(
+            "INSERT INTO ledger_entries (address, kind, delta_units, balance_units, reference, created_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (address, kind, delta, balance, reference, time.time())
+        )
+        return balance
+
+    def _credit(self, address: str, units: int, kind: str, reference: str) -> int:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT INTO balances (address, units) VALUES (?, ?)"
+                " ON CONFLICT (address) DO UPDATE SET units = units + excluded.units",
+                (address, units)
+            )
+            balance = self._append(conn, address, kind, units, reference)
+            conn.execute("COMMIT")
+            return balance
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _debit(self, address: str, units: int, kind: str, reference: str) -> Optional[int]:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            updated = conn.execute(
+                "UPDATE balances SET units = units - ? WHERE address = ? AND units >= ?",
+                (units, address, units)
+            ).rowcount
+            if updated == 0:
+                conn.execute("ROLLBACK")
+                return None
+            balance = self._append(conn, address, kind, -units, reference)
+            conn.execute("COMMIT")
+            return balance
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _claim_nonce(self, address: str, nonce: str, expires_at: float) -> bool:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # Expired nonces can be forgotten: their signatures are refused on expiry alone
+            conn.execute("DELETE FROM credit_nonces WHERE expires_at < ?", (time.time(),))
+            inserted = conn.execute(
+                "INSERT OR IGNORE INTO credit_nonces (address, nonce, expires_at) VALUES (?, ?, ?)",
+                (address, nonce, expires_at)
+            ).rowcount
+            conn.execute("COMMIT")
+            return inserted == 1
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _balance(self, address: str) -> int:
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT units FROM balances WHERE address = ?", (address,)).fetchone()
+            return row[0] if row else 0
+        finally:
+            conn.close()
+
+    def _history(self, address: str, limit: int) -> List[dict]:
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT kind, delta_units, balance_units, reference, created_at FROM ledger_entries"
+                " WHERE address = ? ORDER BY id DESC LIMIT ?",
+                (address, limit)
+            ).fetchall()
+        finally:
+            conn.close()
+        return [
+            {"kind": r[0], "delta_units": r[1], "balance_units": r[2], "reference": r[3], "created_at": r[4]}
+            for r in rows
+        ]
+
+    async def credit(self, address: str, units: int, kind: str, reference: str) -> int:
+        """Add units to a balance; returns the new balance."""
+        return await run_sqlite(self._credit, address, units, kind, reference)
+
+    async def debit(self, address: str, units: int, kind: str, reference: str) -> Optional[int]:
+        """Take units from a balance; returns the new balance, or None if it is too low."""
+        return await run_sqlite(self._debit, address, units, kind, reference)
+
+    async def claim_nonce(self, address: str, nonce: str, expires_at: float) -> bool:
+        """Mark a credit signature nonce used; False if it already was (on any worker)."""
+        return await run_sqlite(self._claim_nonce, address, nonce, expires_at)
+
+    async def balance(self, address: str) -> int:
+        return await run_sqlite(self._balance, address)
+
+    async def history(self, address: str, limit: int = 20) -> List[dict]:
+        return await run_sqlite(self._history, address, limit)
+
+ledger = CreditLedger(CREDIT_LEDGER_PATH)
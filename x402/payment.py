@@ -1,23 +1,32 @@
 import os
+import re
+from collections import OrderedDict
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Optional, Dict
+from pydantic import BaseModel
 from dotenv import load_dotenv
-from web3 import Web3
 from eth_utils import to_checksum_address
 from fastapi import Header, HTTPException
+from web3.exceptions import TransactionNotFound, Web3RPCError
+from x402.rpc import rpc_pool
+from x402.indexer import PaymentIndexer
+from x402.receipts import wait_for_receipt, clamp_wait_seconds
+from x402.replay import spent_hash_store, maybe_prune, CLAIMED, TOO_OLD
 
 # Ensure env vars are loaded when this module is imported
 load_dotenv()
 
 # --- CONFIGURATION ---
-AVAX_RPC_URL = "https://api.avax-test.network/ext/bc/C/rpc"
-w3 = Web3(Web3.HTTPProvider(AVAX_RPC_URL))
+# RPC endpoints, failover and hedging are configured in x402/rpc.py (AVAX_RPC_URLS)
+w3 = rpc_pool.endpoints[0].w3
+
+# Decoded receipts kept in memory so retries skip the RPC round trip
+RECEIPT_CACHE_SIZE = int(os.getenv("RECEIPT_CACHE_SIZE", "4096"))
 
 # Accessing env vars safely with fallbacks or direct access
 RECEIVING_WALLET_ADDRESS = to_checksum_address(os.getenv("RECEIVING_WALLET_ADDRESS"))
 USDC_CONTRACT_ADDRESS = to_checksum_address(os.getenv("USDC_CONTRACT_ADDRESS"))
 
-# Store used hashes to prevent replay attacks
-USED_TRANSACTION_HASHES = set()
-
 # Minimal ABI to decode the "Transfer" event
 ERC20_TRANSFER_EVENT_ABI = {
     "anonymous": False,
@@ -30,51 +39,189 @@ ERC20_TRANSFER_EVENT_ABI = {
     "type": "event",
 }
 
-async def verify_usdc_payment(
-    required_amount_usd: float,
-    x_payment_tx: str = Header(..., alias="X-Payment-Tx")
-):
+# Built once at import; decoding a receipt needs no per-request contract setup
+USDC_TRANSFER_EVENT = w3.eth.contract(
+    address=USDC_CONTRACT_ADDRESS,
+    abi=[ERC20_TRANSFER_EVENT_ABI]
+).events.Transfer()
+
+# Background eth_getLogs tail of payments to us; started by the app on startup
+payment_indexer = PaymentIndexer(USDC_CONTRACT_ADDRESS, RECEIVING_WALLET_ADDRESS)
+
+# A transaction hash as sent in X-Payment-Tx, after lowercasing
+TX_HASH_PATTERN = re.compile(r"^0x[0-9a-f]{64}$")
+
+# tx hash -> decoded receipt, least recently used first
+RECEIPT_CACHE: "OrderedDict[str, dict]" = OrderedDict()
+
+def decode_receipt(tx_receipt) -> dict:
     """
-    Dependency function to verify USDC payment on Avalanche Fuji.
-    Now accepts dynamic amount based on model cost.
-    
-    Args:
-        required_amount_usd: Required payment in USD (e.g., 0.03 for SDXL)
-        x_payment_tx: Transaction hash from header
+    Reduce a receipt to the fields payment checks need.
+    """
+    transfers = USDC_TRANSFER_EVENT.process_receipt(tx_receipt)
+    return {
+        "status": tx_receipt['status'],
+        "block_number": tx_receipt['blockNumber'],
+        "transfers": [
+            {
+                "from": transfer['args']['from'],
+                "to": transfer['args']['to'],
+                "value": transfer['args']['value']
+            }
+            for transfer in transfers
+        ]
+    }
+
+async def get_decoded_receipt(tx_hash: str) -> dict:
+    """
+    Return the decoded receipt for a mined transaction, from cache when possible.
+    Raises if the transaction cannot be found.
+    """
+    decoded = RECEIPT_CACHE.get(tx_hash)
+    if decoded is not None:
+        RECEIPT_CACHE.move_to_end(tx_hash)
+        return decoded
+
+    # Hot path: payments already seen by the log indexer need no RPC call
+    decoded = payment_indexer.lookup(tx_hash)
+    if decoded is not None:
+        return decoded
+
+    # Hedged across the RPC pool: the fastest healthy endpoint answers
+    tx_receipt = await rpc_pool.call(lambda rpc: rpc.eth.get_transaction_receipt(tx_hash))
+    decoded = decode_receipt(tx_receipt)
+
+    # Mined receipts are final on Avalanche, so they never need refreshing
+    RECEIPT_CACHE[tx_hash] = decoded
+    while len(RECEIPT_CACHE) > RECEIPT_CACHE_SIZE:
+        RECEIPT_CACHE.popitem(last=False)
+    return decoded
+
+class Payment(BaseModel):
+    method: str  # "onchain" or "credits"
+    payer: str  # Checksum address that paid
+    reference: str  # Transaction hash, or ledger reference for credit debits
+    units: int  # USDC units (6 decimals) charged for this request
+    paid_units: int  # USDC units actually transferred (may exceed `units`)
+
+def usd_to_units(amount_usd: float) -> int:
+    # Convert USD to USDC units (6 decimals) via Decimal, so 0.0016 is exactly 1600
+    return int((Decimal(str(amount_usd)) * 10**6).to_integral_value(rounding=ROUND_HALF_UP))
+
+async def load_payment_receipt(x_payment_tx: str, wait_seconds: Optional[float] = None) -> tuple:
+    """
+    Fetch the decoded receipt of an unspent, successful payment transaction.
+    Returns (normalized_tx_hash, receipt); raises HTTPException otherwise.
     """
-    # Convert USD to USDC units (6 decimals)
-    required_usdc_units = int(required_amount_usd * 10**6)
+    # Hashes are hex; normalize so case variants cannot replay a payment
+    x_payment_tx = x_payment_tx.strip().lower()
+
+    # Malformed hashes can never be mined; reject them before any RPC call or wait
+    if not TX_HASH_PATTERN.match(x_payment_tx):
+        raise HTTPException(status_code=402, detail="Invalid transaction hash.")
     
-    if x_payment_tx in USED_TRANSACTION_HASHES:
+    # Cheap early exit before any RPC work
+    if await spent_hash_store.is_spent(x_payment_tx):
         raise HTTPException(status_code=402, detail="Payment hash already used.")
 
+    wait_seconds = clamp_wait_seconds(wait_seconds)
     try:
-        tx_receipt = w3.eth.get_transaction_receipt(x_payment_tx)
+        # Waits with backoff for unmined payments instead of failing straight away
+        receipt = await wait_for_receipt(x_payment_tx, get_decoded_receipt, wait_seconds)
+    except TransactionNotFound:
+        raise HTTPException(
+            status_code=402,
+            detail=f"Transaction not found (waited {wait_seconds:g}s for it to be mined)."
+        )
+    except Web3RPCError:
+        # The node answered and refused the lookup; retrying will not help
+        raise HTTPException(status_code=402, detail="Transaction lookup rejected by the payment network.")
     except Exception:
-        raise HTTPException(status_code=402, detail="Transaction not found.")
+        raise HTTPException(status_code=503, detail="Payment network unavailable, retry shortly.")
 
-    if tx_receipt['status'] != 1:
+    if receipt['status'] != 1:
         raise HTTPException(status_code=402, detail="Transaction failed on-chain.")
 
-    # Parse logs to find the Transfer event
-    contract = w3.eth.contract(address=USDC_CONTRACT_ADDRESS, abi=[ERC20_TRANSFER_EVENT_ABI])
-    transfers = contract.events.Transfer().process_receipt(tx_receipt)
+    return x_payment_tx, receipt
+
+async def claim_payment(tx_hash: str, receipt: dict) -> None:
+    """
+    Mark a verified payment as spent. Raises HTTPException if it already was.
+    """
+    # Atomic check-and-insert shared by every worker; only one request can spend a hash
+    claim = await spent_hash_store.claim(tx_hash, receipt['block_number'])
+    if claim == TOO_OLD:
+        raise HTTPException(status_code=402, detail="Payment transaction is too old to be accepted.")
+    if claim != CLAIMED:
+        raise HTTPException(status_code=402, detail="Payment hash already used.")
+
+    await maybe_prune(receipt['block_number'])
 
-    payment_found = False
+async def verify_usdc_payment(
+    required_usdc_units: int,
+    x_payment_tx: str = Header(..., alias="X-Payment-Tx"),
+    wait_seconds: Optional[float] = None,
+    shortfall_payer: Optional[str] = None
+) -> Payment:
+    """
+    Dependency function to verify USDC payment on Avalanche Fuji.
+    Now accepts dynamic amount based on model cost.
     
-    for transfer in transfers:
+    Args:
+        required_usdc_units: Required payment in USDC units, 6 decimals (e.g., 30000 for SDXL);
+            precomputed in x402/pricing.py or taken from a signed quote
+        x_payment_tx: Transaction hash from header
+        wait_seconds: How long to wait for a just-broadcast transaction to be mined
+            (defaults to PAYMENT_RECEIPT_WAIT_SECONDS, capped by PAYMENT_MAX_RECEIPT_WAIT_SECONDS)
+        shortfall_payer: Accept the largest transfer to us from this (authenticated)
+            address even if it is below the required amount (`paid_units < units`);
+            the caller covers the rest from that address's credits
+    """
+    tx_hash, receipt = await load_payment_receipt(x_payment_tx, wait_seconds)
+
+    payment_transfer = None
+    
+    for transfer in receipt['transfers']:
         # Check if money was sent TO us
-        if transfer['args']['to'] == RECEIVING_WALLET_ADDRESS:
+        if transfer['to'] == RECEIVING_WALLET_ADDRESS:
             # Check amount
-            if transfer['args']['value'] >= required_usdc_units:
-                payment_found = True
+            if transfer['value'] >= required_usdc_units:
+                payment_transfer = transfer
                 break
+            # Otherwise remember the largest partial payment
+            if shortfall_payer is not None and transfer['from'] == shortfall_payer and transfer['value'] > 0:
+                if payment_transfer is None or transfer['value'] > payment_transfer['value']:
+                    payment_transfer = transfer
     
-    if not payment_found:
+    if payment_transfer is None:
         raise HTTPException(
             status_code=402, 
-            detail=f"No valid USDC transfer found. Required: ${required_amount_usd} USD ({required_usdc_units} units)"
+            detail=f"No valid USDC transfer found. Required: ${required_usdc_units / 10**6} USD ({required_usdc_units} units)"
         )
 
-    USED_TRANSACTION_HASHES.add(x_payment_tx)
-    return x_payment_tx
\ No newline at end of file
+    await claim_payment(tx_hash, receipt)
+    return Payment(
+        method="onchain",
+        payer=payment_transfer['from'],
+        reference=tx_hash,
+        units=required_usdc_units,
+        paid_units=payment_transfer['value']
+    )
+
+async def verify_usdc_deposit(x_payment_tx: str, wait_seconds: Optional[float] = None) -> Dict[str, int]:
+    """
+    Verify and spend a payment used as a deposit.
+    Returns {sender address: USDC units sent to us}.
+    """
+    tx_hash, receipt = await load_payment_receipt(x_payment_tx, wait_seconds)
+
+    deposits: Dict[str, int] = {}
+    for transfer in receipt['transfers']:
+        if transfer['to'] == RECEIVING_WALLET_ADDRESS and transfer['value'] > 0:
+            deposits[transfer['from']] = deposits.get(transfer['from'], 0) + transfer['value']
+
+    if not deposits:
+        raise HTTPException(status_code=402, detail="No USDC transfer to the receiving wallet found.")
+
+    await claim_payment(tx_hash, receipt)
+    return deposits
@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import hmac
+import base64
+import hashlib
+import secrets
+from typing import Any, Literal, Optional, List, Dict
+from pydantic import BaseModel
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from x402.payment import usd_to_units
+from model.registry import RegistrySnapshot, model_registry
+from model.tts import TTSRequest, count_request_tokens
+
+load_dotenv()
+
+# --- CONFIGURATION ---
+# Set the same secret on every worker so any of them accepts any quote
+QUOTE_SIGNING_SECRET = os.getenv("QUOTE_SIGNING_SECRET") or secrets.token_hex(32)
+QUOTE_TTL_SECONDS = int(os.getenv("QUOTE_TTL_SECONDS", "300"))
+
+def _build_price_units(snapshot: RegistrySnapshot) -> Dict[str, Dict[str, int]]:
+    return {
+        "image": {name: usd_to_units(c["cost_usd"]) for name, c in snapshot.image.items()},
+        "video": {name: usd_to_units(c["cost_usd"]) for name, c in snapshot.video.items()},
+        "tts": {name: usd_to_units(c["cost_per_1000_tokens"]) for name, c in snapshot.tts.items()}
+    }
+
+def price_units() -> Dict[str, Dict[str, int]]:
+    """
+    Prices in integer USDC units (6 decimals) per modality and model (TTS: per
+    1000 tokens), computed once per registry version.
+    """
+    return model_registry.current.derived("price_units", _build_price_units)
+
+class QuoteRequest(BaseModel):
+    modality: Literal["image", "video", "tts"]
+    # Body of the generation request being priced, exactly as it will be sent
+    request: Dict[str, Any]
+
+class Quote(BaseModel):
+    quote_id: str
+    modality: str
+    amount_units: int
+    amount_usd: float
+    breakdown_units: Dict[str, int]
+    expires_at: int
+    receiver: str
+    models: Optional[List[str]] = None  # Models routing picked for a routed request; these are run
+
+class QuoteTerms(BaseModel):
+    # What a valid X-Payment-Quote fixes for its request
+    amount_units: int
+    models: Optional[List[str]] = None
+
+def image_price_units(models: List[str]) -> Dict[str, int]:
+    table = price_units()["image"]
+    return {m: table[m] for m in models}
+
+def video_price_units(models: List[str]) -> Dict[str, int]:
+    table = price_units()["video"]
+    return {m: table[m] for m in models}
+
+def tts_price_units(models: List[str], request: TTSRequest) -> Dict[str, int]:
+    # Integer math end to end; rounds down like the per-request float conversion did.
+    # Token counts are memoized on the request, so the TTS results reuse them.
+    table = price_units()["tts"]
+    return {m: count_request_tokens(m, request) * table[m] // 1000 for m in models}
+
+def request_digest(modality: str, request: BaseModel) -> str:
+    """
+    Canonical hash of a generation request, binding a quote to exactly that request.
+    """
+    canonical = json.dumps(request.model_dump(), sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(f"{modality}\n{canonical}".encode("utf-8")).hexdigest()
+
+def _sign(payload: str) -> str:
+    signature = hmac.new(QUOTE_SIGNING_SECRET.encode(), payload.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(signature).decode().rstrip("=")
+
+def issue_quote(
+    modality: str,
+    request: BaseModel,
+    breakdown_units: Dict[str, int],
+    receiver: str,
+    models: Optional[List[str]] = None
+) -> Quote:
+    """
+    Sign the price of a request, as the client sends it. The quote id carries the
+    amount, expiry, request digest and any routed `models`, so accepting it needs
+    no server-side state and runs the models that were priced.
+    """
+    amount_units = sum(breakdown_units.values())
+    expires_at = int(time.time()) + QUOTE_TTL_SECONDS
+    routed = json.dumps(models, separators=(",", ":")) if models is not None else ""
+    payload = f"{modality}.{amount_units}.{expires_at}.{request_digest(modality, request)}.{routed}"
+    quote_id = base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=") + "." + _sign(payload)
+    return Quote(
+        quote_id=quote_id,
+        modality=modality,
+        amount_units=amount_units,
+        amount_usd=amount_units / 10**6,
+        breakdown_units=breakdown_units,
+        expires_at=expires_at,
+        receiver=receiver,
+        models=models
+    )
+
+def accepted_quote(quote_id: Optional[str], modality: str, request: BaseModel) -> Optional[QuoteTerms]:
+    """
+    Terms of a valid quote for this exact request, or None when no quote was sent.
+    Raises 400 for a quote that is forged, expired or for a different request.
+    """
+    if not quote_id:
+        return None
+    try:
+        encoded, signature = quote_id.rsplit(".", 1)
+        payload = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4)).decode()
+        if not hmac.compare_digest(signature, _sign(payload)):
+            raise ValueError("bad signature")
+        # Model names may contain dots, so the routed list is everything after the fourth
+        quote_modality, amount_units, expires_at, digest, routed = payload.split(".", 4)
+        models = json.loads(routed) if routed else None
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid X-Payment-Quote.")
+
+    if int(expires_at) < time.time():
+        raise HTTPException(status_code=400, detail="X-Payment-Quote has expired; request a new quote.")
+    if quote_modality != modality or digest != request_digest(modality, request):
+        raise HTTPException(status_code=400, detail="X-Payment-Quote was issued for a different request.")
+    return QuoteTerms(amount_units=int(amount_units), models=models)
+
+def quoted_units(quote_id: Optional[str], modality: str, request: BaseModel) -> Optional[int]:
+    """
+    Amount of a valid quote for this exact request, or None when no quote was sent.
+    """
+    terms = accepted_quote(quote_id, modality, request)
+    return terms.amount_units if terms is not None else None
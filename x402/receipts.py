@@ -0,0 +1,150 @@
+import os
+import math
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+from dotenv import load_dotenv
+from web3.exceptions import TransactionNotFound
+from x402.rpc import rpc_pool
+
+load_dotenv()
+
+# --- CONFIGURATION ---
+# How long verification waits for a not-yet-mined payment when the client does not say
+PAYMENT_RECEIPT_WAIT_SECONDS = float(os.getenv("PAYMENT_RECEIPT_WAIT_SECONDS", "15"))
+# Upper bound for the X-Payment-Wait header
+PAYMENT_MAX_RECEIPT_WAIT_SECONDS = float(os.getenv("PAYMENT_MAX_RECEIPT_WAIT_SECONDS", "60"))
+# Exponential backoff between receipt lookups
+RECEIPT_POLL_INITIAL_SECONDS = 0.25
+RECEIPT_POLL_MAX_SECONDS = 4.0
+# How often the shared block watcher asks for new blocks
+BLOCK_POLL_SECONDS = float(os.getenv("BLOCK_POLL_SECONDS", "1.0"))
+
+class BlockWatcher:
+    """
+    One shared loop that notices new blocks while any payment is waiting.
+
+    It prefers an `eth_newBlockFilter` subscription on the current best endpoint
+    and falls back to `eth_blockNumber` when the node does not support filters.
+    Waiters re-check their receipt once per new block instead of on a timer.
+    """
+    def __init__(self):
+        self._new_block = asyncio.Event()
+        self._task = None
+        self._users = 0
+        self._filter = None
+        self._filters_supported = True
+        self._last_block = None
+
+    def acquire(self) -> None:
+        self._users += 1
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def release(self) -> None:
+        self._users -= 1
+
+    async def wait_for_block(self, timeout: float) -> None:
+        event = self._new_block
+        try:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _has_new_block(self) -> bool:
+        if self._filters_supported:
+            if self._filter is None:
+                try:
+                    self._filter = await rpc_pool.ranked()[0].w3.eth.filter("latest")
+                except Exception:
+                    self._filters_supported = False
+            if self._filter is not None:
+                try:
+                    return bool(await self._filter.get_new_entries())
+                except Exception:
+                    # Filters expire on the node after a while; make a new one next time
+                    self._filter = None
+                    return False
+
+        block_number = await rpc_pool.call(lambda rpc: rpc.eth.block_number)
+        is_new = self._last_block is not None and block_number > self._last_block
+        self._last_block = block_number
+        return is_new
+
+    async def _run(self) -> None:
+        while self._users > 0:
+            try:
+                if await self._has_new_block():
+                    # Wake every waiter, then arm a fresh event for the next block
+                    self._new_block.set()
+                    self._new_block = asyncio.Event()
+            except Exception:
+                pass
+            await asyncio.sleep(BLOCK_POLL_SECONDS)
+        self._filter = None
+
+block_watcher = BlockWatcher()
+
+class _ReceiptWait:
+    def __init__(self):
+        self.task = None
+        self.waiters = 0
+
+# tx hash -> the single poll loop every concurrent verification of it shares
+_pending_waits: Dict[str, _ReceiptWait] = {}
+
+async def _poll_until_mined(wait: _ReceiptWait, tx_hash: str, fetch: Callable[[str], Awaitable[Any]]) -> Any:
+    delay = RECEIPT_POLL_INITIAL_SECONDS
+    block_watcher.acquire()
+    try:
+        while True:
+            try:
+                return await fetch(tx_hash)
+            except TransactionNotFound:
+                pass
+            # Stop once every caller has given up
+            if wait.waiters <= 0:
+                raise TransactionNotFound(f"Transaction {tx_hash} not found")
+            await block_watcher.wait_for_block(timeout=delay)
+            delay = min(delay * 2, RECEIPT_POLL_MAX_SECONDS)
+    finally:
+        block_watcher.release()
+
+def _finish_wait(tx_hash: str, task: asyncio.Task) -> None:
+    _pending_waits.pop(tx_hash, None)
+    # Mark the outcome as seen even when every waiter already timed out
+    if not task.cancelled():
+        task.exception()
+
+async def wait_for_receipt(tx_hash: str, fetch: Callable[[str], Awaitable[Any]], wait_seconds: float) -> Any:
+    """
+    Return `fetch(tx_hash)` once the transaction is mined, waiting up to
+    `wait_seconds`. Concurrent waits for the same hash share one poll loop.
+    Raises TransactionNotFound if it is still unmined at the deadline.
+    """
+    if wait_seconds <= 0:
+        return await fetch(tx_hash)
+
+    wait = _pending_waits.get(tx_hash)
+    if wait is None:
+        wait = _ReceiptWait()
+        wait.task = asyncio.create_task(_poll_until_mined(wait, tx_hash, fetch))
+        wait.task.add_done_callback(lambda task: _finish_wait(tx_hash, task))
+        _pending_waits[tx_hash] = wait
+
+    wait.waiters += 1
+    try:
+        # Shield so one caller timing out does not cancel the loop for the others
+        return await asyncio.wait_for(asyncio.shield(wait.task), timeout=wait_seconds)
+    except asyncio.TimeoutError:
+        raise TransactionNotFound(f"Transaction {tx_hash} not mined within {wait_seconds:g} seconds")
+    finally:
+        wait.waiters -= 1
+
+def clamp_wait_seconds(requested) -> float:
+    if requested is None:
+        return PAYMENT_RECEIPT_WAIT_SECONDS
+    requested = float(requested)
+    # NaN slips through min/max unchanged; treat it (and infinities) as unset
+    if not math.isfinite(requested):
+        return PAYMENT_RECEIPT_WAIT_SECONDS
+    return min(max(requested, 0.0), PAYMENT_MAX_RECEIPT_WAIT_SECONDS)
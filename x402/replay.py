@@ -0,0 +1,217 @@
+import os
+import time
+import sqlite3
+from typing import Optional
+from dotenv import load_dotenv
+from model.fanout import run_sqlite
+
+load_dotenv()
+
+# --- CONFIGURATION ---
+# "sqlite" (default, shared by all workers on the host), "redis" or "memory"
+SPENT_HASH_STORE = os.getenv("SPENT_HASH_STORE", "sqlite")
+SPENT_HASH_DB_PATH = os.getenv("SPENT_HASH_DB_PATH", "spent_hashes.sqlite3")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Payments older than this many blocks are refused, so older hashes can be forgotten
+# (~7 days of 2s Fuji blocks). 0 disables expiry.
+PAYMENT_MAX_AGE_BLOCKS = int(os.getenv("PAYMENT_MAX_AGE_BLOCKS", "302400"))
+# How far the chain must advance between prunes
+PRUNE_INTERVAL_BLOCKS = int(os.getenv("SPENT_HASH_PRUNE_INTERVAL_BLOCKS", "1000"))
+
+# Outcomes of SpentHashStore.claim
+CLAIMED = "claimed"
+ALREADY_SPENT = "already_spent"
+TOO_OLD = "too_old"
+
+class SpentHashStore:
+    """
+    Records spent payment hashes with the block they were mined in.
+
+    `claim` is an atomic check-and-insert: of any number of concurrent claims
+    for one hash (across processes), exactly one returns CLAIMED. Hashes below
+    the prune watermark are gone from the store, so claims for blocks under it
+    return TOO_OLD instead of being accepted a second time.
+    """
+    async def is_spent(self, tx_hash: str) -> bool:
+        raise NotImplementedError
+
+    async def claim(self, tx_hash: str, block_number: int) -> str:
+        raise NotImplementedError
+
+    async def prune(self, below_block: int) -> int:
+        raise NotImplementedError
+
+class InMemorySpentHashStore(SpentHashStore):
+    """
+    Single-process store; only safe with one uvicorn worker.
+    """
+    def __init__(self):
+        self._spent = {}
+        self._watermark = 0
+
+    async def is_spent(self, tx_hash: str) -> bool:
+        return tx_hash in self._spent
+
+    async def claim(self, tx_hash: str, block_number: int) -> str:
+        # No awaits between check and insert, so this is atomic on the event loop
+        if block_number < self._watermark:
+            return TOO_OLD
+        if tx_hash in self._spent:
+            return ALREADY_SPENT
+        self._spent[tx_hash] = block_number
+        return CLAIMED
+
+    async def prune(self, below_block: int) -> int:
+        self._watermark = max(self._watermark, below_block)
+        expired = [h for h, block in self._spent.items() if block < self._watermark]
+        for tx_hash in expired:
+            del self._spent[tx_hash]
+        return len(expired)
+
+class SQLiteSpentHashStore(SpentHashStore):
+    """
+    SQLite in WAL mode; the primary key makes claims atomic across worker processes.
+    """
+    def __init__(self, path: str):
+        self._path = path
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS spent_hashes ("
+                " tx_hash TEXT PRIMARY KEY,"
+                " block_number INTEGER NOT NULL,"
+                " spent_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS spent_hashes_block ON spent_hashes (block_number)")
+            conn.execute("CREATE TABLE IF NOT EXISTS prune_watermark (id INTEGER PRIMARY KEY CHECK (id = 0), block_number INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO prune_watermark (id, block_number) VALUES (0, 0)")
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self._path, timeout=30, isolation_level=None)
+
+    def _is_spent(self, tx_hash: str) -> bool:
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT 1 FROM spent_hashes WHERE tx_hash = ?", (tx_hash,)).fetchone() is not None
+        finally:
+            conn.close()
+
+    def _claim(self, tx_hash: str, block_number: int) -> str:
+        conn = self._connect()
+        try:
+            # Watermark read and insert share one write transaction
+            conn.execute("BEGIN IMMEDIATE")
+            watermark = conn.execute("SELECT block_number FROM prune_watermark WHERE id = 0").fetchone()[0]
+            if block_number < watermark:
+                conn.execute("ROLLBACK")
+                return TOO_OLD
+            inserted = conn.execute(
+                "INSERT OR IGNORE INTO spent_hashes (tx_hash, block_number, spent_at) VALUES (?, ?, ?)",
+                (tx_hash, block_number, time.time())
+            ).rowcount
+            conn.execute("COMMIT")
+            return CLAIMED if inserted == 1 else ALREADY_SPENT
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _prune(self, below_block: int) -> int:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "UPDATE prune_watermark SET block_number = MAX(block_number, ?) WHERE id = 0",
+                (below_block,)
+            )
+            removed = conn.execute(
+                "DELETE FROM spent_hashes WHERE block_number < (SELECT block_number FROM prune_watermark WHERE id = 0)"
+            ).rowcount
+            conn.execute("COMMIT")
+            return removed
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    async def is_spent(self, tx_hash: str) -> bool:
+        return await run_sqlite(self._is_spent, tx_hash)
+
+    async def claim(self, tx_hash: str, block_number: int) -> str:
+        return await run_sqlite(self._claim, tx_hash, block_number)
+
+    async def prune(self, below_block: int) -> int:
+        return await run_sqlite(self._prune, below_block)
+
+# Atomic claim: refuse blocks under the watermark, then ZADD NX (returns 1 only for the first claim)
+_REDIS_CLAIM_SCRIPT = """
+local watermark = tonumber(redis.call('GET', KEYS[2]) or '0')
+if tonumber(ARGV[2]) < watermark then return -1 end
+return redis.call('ZADD', KEYS[1], 'NX', ARGV[2], ARGV[1])
+"""
+
+_REDIS_PRUNE_SCRIPT = """
+local watermark = math.max(tonumber(redis.call('GET', KEYS[2]) or '0'), tonumber(ARGV[1]))
+redis.call('SET', KEYS[2], watermark)
+return redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', '(' .. watermark)
+"""
+
+class RedisSpentHashStore(SpentHashStore):
+    """
+    Redis (or any Redis-compatible server) sorted set scored by block number.
+    Needs the optional `redis` package.
+    """
+    def __init__(self, url: str, key_prefix: str = "x402"):
+        try:
+            import redis.asyncio as redis_asyncio
+        except ImportError:
+            raise RuntimeError("SPENT_HASH_STORE=redis requires the 'redis' package (pip install redis)")
+        self._redis = redis_asyncio.from_url(url)
+        self._spent_key = f"{key_prefix}:spent_hashes"
+        self._watermark_key = f"{key_prefix}:spent_hashes:watermark"
+        self._claim_script = self._redis.register_script(_REDIS_CLAIM_SCRIPT)
+        self._prune_script = self._redis.register_script(_REDIS_PRUNE_SCRIPT)
+
+    async def is_spent(self, tx_hash: str) -> bool:
+        return await self._redis.zscore(self._spent_key, tx_hash) is not None
+
+    async def claim(self, tx_hash: str, block_number: int) -> str:
+        result = await self._claim_script(keys=[self._spent_key, self._watermark_key], args=[tx_hash, block_number])
+        if result == -1:
+            return TOO_OLD
+        return CLAIMED if result == 1 else ALREADY_SPENT
+
+    async def prune(self, below_block: int) -> int:
+        return await self._prune_script(keys=[self._spent_key, self._watermark_key], args=[below_block])
+
+def create_spent_hash_store() -> SpentHashStore:
+    if SPENT_HASH_STORE == "sqlite":
+        return SQLiteSpentHashStore(SPENT_HASH_DB_PATH)
+    if SPENT_HASH_STORE == "redis":
+        return RedisSpentHashStore(REDIS_URL)
+    if SPENT_HASH_STORE == "memory":
+        return InMemorySpentHashStore()
+    raise ValueError(f"Unknown SPENT_HASH_STORE '{SPENT_HASH_STORE}'. Use 'sqlite', 'redis' or 'memory'.")
+
+spent_hash_store = create_spent_hash_store()
+
+_last_prune_block: Optional[int] = None
+
+async def maybe_prune(current_block: int) -> None:
+    """
+    Forget hashes older than PAYMENT_MAX_AGE_BLOCKS, at most once per PRUNE_INTERVAL_BLOCKS.
+    """
+    global _last_prune_block
+    if PAYMENT_MAX_AGE_BLOCKS <= 0:
+        return
+    if _last_prune_block is not None and current_block - _last_prune_block < PRUNE_INTERVAL_BLOCKS:
+        return
+    _last_prune_block = current_block
+    await spent_hash_store.prune(current_block - PAYMENT_MAX_AGE_BLOCKS)
@@ -0,0 +1,205 @@
+import os
+import time
+import asyncio
+import aiohttp
+from collections import deque
+from urllib.parse import urlparse
+from typing import Any, Awaitable, Callable, List, Optional
+from dotenv import load_dotenv
+from web3 import AsyncWeb3
+from web3.exceptions import Web3RPCError
+from model.metrics import RPC_CALL_SECONDS, add_timing
+
+load_dotenv()
+
+# --- CONFIGURATION ---
+DEFAULT_RPC_URL = "https://api.avax-test.network/ext/bc/C/rpc"
+# Comma-separated list of Avalanche C-Chain RPC endpoints, best first
+AVAX_RPC_URLS = [
+    url.strip()
+    for url in os.getenv("AVAX_RPC_URLS", os.getenv("AVAX_RPC_URL", DEFAULT_RPC_URL)).split(",")
+    if url.strip()
+]
+# Keep-alive connections kept open across all RPC endpoints
+RPC_POOL_SIZE = int(os.getenv("RPC_POOL_SIZE", "32"))
+RPC_TIMEOUT_SECONDS = float(os.getenv("RPC_TIMEOUT_SECONDS", "10"))
+# Extra endpoints a slow call may be duplicated to (0 disables hedging)
+RPC_MAX_HEDGES = int(os.getenv("RPC_MAX_HEDGES", "1"))
+# Hedge delay used until an endpoint has enough latency samples for its p95
+RPC_HEDGE_DELAY_SECONDS = float(os.getenv("RPC_HEDGE_DELAY_SECONDS", "0.5"))
+RPC_HEDGE_MIN_DELAY_SECONDS = 0.05
+RPC_HEDGE_MAX_DELAY_SECONDS = 2.0
+
+def is_node_answer(error: BaseException) -> bool:
+    """
+    True for a JSON-RPC error response (e.g. TransactionNotFound or -32602
+    invalid params): a healthy node answered, so there is nothing to fail over
+    from. Timeouts, connection errors and HTTP 5xx are not answers.
+    """
+    if isinstance(error, Web3RPCError):
+        return True
+    # Older web3 versions raise ValueError with the response's `error` object
+    return isinstance(error, ValueError) and bool(error.args) and isinstance(error.args[0], dict) \
+        and "code" in error.args[0]
+
+class RpcEndpoint:
+    """
+    One RPC node plus its rolling health: latency EWMA, recent latency samples
+    for the p95 hedge budget, and a failure-rate EWMA.
+    """
+    EWMA_ALPHA = 0.2
+    MIN_SAMPLES_FOR_P95 = 20
+
+    def __init__(self, url: str):
+        self.url = url
+        # Metrics label; provider URLs often carry an API key in the path
+        self.host = urlparse(url).netloc or url
+        # The pool fails over and hedges itself; web3's own retries would hold a
+        # call on a dead node for seconds before the next endpoint is tried
+        self.w3 = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(url, exception_retry_configuration=None))
+        self.latency_ewma = RPC_HEDGE_DELAY_SECONDS
+        self.failure_rate = 0.0
+        self.samples = deque(maxlen=200)
+
+    def record_success(self, latency: float) -> None:
+        self.samples.append(latency)
+        self.latency_ewma += self.EWMA_ALPHA * (latency - self.latency_ewma)
+        self.failure_rate *= (1 - self.EWMA_ALPHA)
+
+    def record_failure(self, latency: float) -> None:
+        # A failure costs at least the hedge delay so a fast-failing node does not look fast
+        self.latency_ewma += self.EWMA_ALPHA * (max(latency, RPC_HEDGE_DELAY_SECONDS) - self.latency_ewma)
+        self.failure_rate += self.EWMA_ALPHA * (1 - self.failure_rate)
+
+    def score(self) -> float:
+        # Lower is better: expected latency inflated by recent failures
+        return self.latency_ewma * (1 + 4 * self.failure_rate)
+
+    def p95(self) -> Optional[float]:
+        if len(self.samples) < self.MIN_SAMPLES_FOR_P95:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def hedge_delay(self) -> float:
+        budget = self.p95()
+        if budget is None:
+            budget = RPC_HEDGE_DELAY_SECONDS
+        return min(max(budget, RPC_HEDGE_MIN_DELAY_SECONDS), RPC_HEDGE_MAX_DELAY_SECONDS)
+
+    def health(self) -> dict:
+        return {
+            "url": self.url,
+            "latency_ewma_ms": round(self.latency_ewma * 1000, 2),
+            "p95_ms": round(self.p95() * 1000, 2) if self.p95() is not None else None,
+            "failure_rate": round(self.failure_rate, 4),
+            "score": round(self.score(), 4)
+        }
+
+class RpcPool:
+    """
+    Sends each call to the healthiest endpoint. If it has not answered within
+    its p95 latency, the same call is hedged to the next-best endpoint and the
+    first answer wins. Endpoints that time out, cannot be reached or return
+    HTTP 5xx are failed over immediately; JSON-RPC error answers are returned.
+    """
+    def __init__(self, urls: List[str]):
+        self.endpoints = [RpcEndpoint(url) for url in urls]
+        self._session = None
+
+    async def ensure_session(self):
+        """
+        Share one pooled keep-alive aiohttp session between every endpoint.
+        Created lazily because it must belong to the running event loop.
+        """
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=RPC_POOL_SIZE, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=RPC_TIMEOUT_SECONDS)
+            )
+            for endpoint in self.endpoints:
+                await endpoint.w3.provider.cache_async_session(self._session)
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def ranked(self) -> List[RpcEndpoint]:
+        return sorted(self.endpoints, key=lambda e: e.score())
+
+    async def _timed(self, endpoint: RpcEndpoint, method: Callable[[AsyncWeb3], Awaitable[Any]]) -> Any:
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            result = await method(endpoint.w3)
+        except asyncio.CancelledError:
+            # Lost a hedge race; says nothing about the endpoint's health
+            outcome = "cancelled"
+            raise
+        except Exception as error:
+            if is_node_answer(error):
+                # Caller-caused errors must not let clients poison health scoring
+                outcome = "answer_error"
+                endpoint.record_success(time.perf_counter() - started)
+            else:
+                outcome = "error"
+                endpoint.record_failure(time.perf_counter() - started)
+            raise
+        else:
+            endpoint.record_success(time.perf_counter() - started)
+            return result
+        finally:
+            RPC_CALL_SECONDS.labels(endpoint=endpoint.host, outcome=outcome).observe(time.perf_counter() - started)
+
+    async def call(self, method: Callable[[AsyncWeb3], Awaitable[Any]]) -> Any:
+        """
+        Run `method(w3)` against the pool, e.g. `lambda w3: w3.eth.get_transaction_receipt(h)`.
+        """
+        await self.ensure_session()
+        started = time.perf_counter()
+        endpoints = self.ranked()
+        pending = {}
+        launched = 0
+        last_error: Optional[BaseException] = None
+
+        def launch() -> None:
+            nonlocal launched
+            endpoint = endpoints[launched]
+            launched += 1
+            pending[asyncio.create_task(self._timed(endpoint, method))] = endpoint
+
+        launch()
+        try:
+            while pending:
+                # Hedge only while spare endpoints and hedge budget remain
+                can_hedge = launched < len(endpoints) and launched <= RPC_MAX_HEDGES
+                timeout = endpoints[launched - 1].hedge_delay() if can_hedge else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    launch()
+                    continue
+
+                for task in done:
+                    pending.pop(task)
+                    error = task.exception()
+                    if error is None or is_node_answer(error):
+                        return task.result()
+                    last_error = error
+
+                # Everything in flight failed: fail over to the next endpoint
+                if not pending and launched < len(endpoints):
+                    launch()
+
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+            add_timing("rpc", time.perf_counter() - started)
+
+    def health(self) -> List[dict]:
+        return [endpoint.health() for endpoint in self.ranked()]
+
+rpc_pool = RpcPool(AVAX_RPC_URLS)